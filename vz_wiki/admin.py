@@ -1,16 +1,18 @@
 from django.contrib import admin
-from models import WikiPage, Revision, Comparison
+from django.forms.models import BaseInlineFormSet
+from models import WikiPage, Revision, Comparison, DiffJob
+from forms import RevisionBodyForm
+import locks
 
 
 def latest_revision_display(obj):
-    latest_revision = obj.latest_revision()
-    if latest_revision is None:
-        return '0'
-    return u'%s' % latest_revision.number
+    """revision_count is the number of the latest revision."""
+    return u'%s' % obj.revision_count
 latest_revision_display.short_description = 'Version'
 
 
 def who_checked_out(obj):
+    """No query, WikiPageAdmin.queryset joins checked_out_by in."""
     return obj.who_checked_out()
 who_checked_out.short_description = 'Checked out by'
 
@@ -26,29 +28,84 @@ make_not_editable.short_description = 'Make the selected pages not editable'
 
 
 def make_checked_in(modelAdmin, request, queryset):
-    queryset.update(is_checked_out=False)
-make_checked_in.short_description = 'Check in the selected pages'
+    checked_in, published, abandoned = locks.check_in_pages(queryset)
+    modelAdmin.message_user(request, 'Checked in %s page(s), abandoning %s '
+        'draft(s).' % (checked_in, abandoned))
+make_checked_in.short_description = 'Check in the selected pages, ' \
+    'abandoning drafts'
+
+
+def make_checked_in_publishing(modelAdmin, request, queryset):
+    checked_in, published, abandoned = locks.check_in_pages(queryset,
+        publish=True)
+    modelAdmin.message_user(request, 'Checked in %s page(s), publishing %s '
+        'draft(s) and abandoning %s unchanged one(s).' % (checked_in,
+        published, abandoned))
+make_checked_in_publishing.short_description = 'Check in the selected ' \
+    'pages, publishing drafts'
 
 
 def make_checked_out(modelAdmin, request, queryset):
-    queryset.update(is_checked_out=True)
+    checked_out = locks.check_out_pages(queryset, request.user)
+    skipped = queryset.count() - checked_out
+    message = 'Checked out %s page(s) to you.' % checked_out
+    if skipped:
+        message += ' %s page(s) were already checked out.' % skipped
+    modelAdmin.message_user(request, message)
 make_checked_out.short_description = 'Check out the selected pages'
 
 
+class DraftRevisionFormSet(BaseInlineFormSet):
+    """
+    Only the page's draft.  Published revisions can't be changed, and a
+    page may have thousands, each with a body to load; they're listed in
+    the Revision admin instead.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs['queryset'] = Revision.objects.filter(is_published=False)
+        super(DraftRevisionFormSet, self).__init__(*args, **kwargs)
+
+
 class RevisionInline(admin.StackedInline):
     model = Revision
+    form = RevisionBodyForm
+    formset = DraftRevisionFormSet
     extra = 1
 
 
+class RevisionAdmin(admin.ModelAdmin):
+    form = RevisionBodyForm
+    list_display = ('page', 'number', 'author', 'is_published',
+        'published_on')
+    list_filter = ('is_published', )
+    search_fields = ('page__title', )
+
+
+class ComparisonAdmin(admin.ModelAdmin):
+    list_display = ('digest', 'size', 'created_on', 'last_used_on')
+
+
+class DiffJobAdmin(admin.ModelAdmin):
+    list_display = ('digest', 'rev1', 'rev2', 'status', 'queued_on',
+        'started_on')
+    list_filter = ('status', )
+
+
 class WikiPageAdmin(admin.ModelAdmin):
     actions = [make_editable, make_not_editable, make_checked_in,
-        make_checked_out]
+        make_checked_in_publishing, make_checked_out]
     inlines = [RevisionInline]
     prepopulated_fields = {'slug': ('title', )}
     list_display = ('title', latest_revision_display, 'is_editable',
         'is_checked_out', who_checked_out, 'created_on', 'edited_on')
     list_filter = ('is_editable', 'is_checked_out')
 
+    def queryset(self, request):
+        return super(WikiPageAdmin, self).queryset(request).select_related(
+            'checked_out_by')
+
 admin.site.register(WikiPage, WikiPageAdmin)
-admin.site.register(Revision)
-admin.site.register(Comparison)
+admin.site.register(Revision, RevisionAdmin)
+admin.site.register(Comparison, ComparisonAdmin)
+admin.site.register(DiffJob, DiffJobAdmin)
@@ -0,0 +1,9 @@
+"""
+Benchmarks, run each module as a script, e.g.::
+
+    python -m vz_wiki.benchmarks.sanitize
+
+The wiki benchmarks need DJANGO_SETTINGS_MODULE set, see wiki.  diff_engine
+times the diff engine on the diff_corpus cases, and writes its results to a
+file.
+"""
@@ -0,0 +1,106 @@
+"""
+Pairs of revision texts for the diff engine benchmark.
+
+Each case is a kind of edit an editor makes, generated deterministically from
+the seed with the wiki generator's Markdown, so the corpus is the same on
+every run and every machine:
+
+small_edit
+    a page of a few KB with a block or two rewritten, added or removed
+append
+    a section added to the end of a page
+reorder
+    the same blocks, shuffled
+rewrite
+    a different page of about the same length
+large_edit
+    a 1 MB page with a few small edits spread through it
+large_rewrite
+    two unrelated 1 MB pages
+
+dump_pairs reads consecutive revisions of real pages from an export made
+by the export_pages command instead.
+"""
+import random
+
+from vz_wiki.benchmarks.generator import block, body, edit
+
+LARGE = 1024 * 1024
+
+CASES = ('small_edit', 'append', 'reorder', 'rewrite', 'large_edit',
+    'large_rewrite')
+# Pairs per case, the large ones take seconds each.
+PAIRS = {'large_edit': 2, 'large_rewrite': 2}
+DEFAULT_PAIRS = 10
+
+
+def _page(rng, size=None):
+    blocks = body(rng, 1000, rng.randint(8, 30))
+    if size is not None:
+        while len(u'\n\n'.join(blocks)) < size:
+            blocks.extend(body(rng, 1000, 100))
+    return blocks
+
+
+def small_edit(rng):
+    blocks = _page(rng)
+    return blocks, edit(rng, 1000, blocks)
+
+
+def append(rng):
+    blocks = _page(rng)
+    return blocks, blocks + [block(rng, 1000) for x in range(3)]
+
+
+def reorder(rng):
+    blocks = _page(rng)
+    shuffled = list(blocks)
+    rng.shuffle(shuffled)
+    return blocks, shuffled
+
+
+def rewrite(rng):
+    return _page(rng), _page(rng)
+
+
+def large_edit(rng):
+    blocks = _page(rng, LARGE)
+    edited = list(blocks)
+    for x in range(5):
+        edited = edit(rng, 1000, edited)
+    return blocks, edited
+
+
+def large_rewrite(rng):
+    return _page(rng, LARGE), _page(rng, LARGE)
+
+
+def pairs(case, seed=0, count=None):
+    """The (text1, text2) pairs of case."""
+    if count is None:
+        count = PAIRS.get(case, DEFAULT_PAIRS)
+    make = globals()[case]
+    result = []
+    for x in range(count):
+        rng = random.Random(seed * 1000003 + CASES.index(case) * 1009 + x)
+        blocks1, blocks2 = make(rng)
+        result.append((u'\n\n'.join(blocks1), u'\n\n'.join(blocks2)))
+    return result
+
+
+def dump_pairs(path, limit=50):
+    """
+    Up to limit pairs of consecutive published revisions from the pages of
+    the dump at path.  Reading a dump needs DJANGO_SETTINGS_MODULE set.
+    """
+    from vz_wiki import dumps
+    result = []
+    for where, page in dumps.read_dump(path):
+        bodies = [revision.get('body') or u'' for revision
+            in page.get('revisions') or []
+            if revision.get('is_published', True)]
+        for text1, text2 in zip(bodies, bodies[1:]):
+            if len(result) >= limit:
+                return result
+            result.append((text1, text2))
+    return result
@@ -0,0 +1,199 @@
+"""
+Times the diff_match_patch operations the wiki relies on against the
+diff_corpus cases, and records the results for tracking across versions.
+
+    python -m vz_wiki.benchmarks.diff_engine [options]
+
+The operations are diff_main (with the linear-space engine the wiki uses by
+default, and as diff_main_map with the original diff_map engine),
+diff_cleanupSemantic, diff_cleanupEfficiency, match_bitap, patch_make and
+patch_apply.  Each operation runs on every pair of a case --repeat times, in
+a child process of its own, so the memory it reports is the growth of that
+process's peak resident size while the operation ran, in KB.  diff_main
+gives up after --timeout seconds (Diff_Timeout); the runs that reached it
+are counted as timeouts, and their diffs are approximate.  patch_apply
+counts the patches that failed to apply.
+
+Results are printed and written as JSON to --output, with the vz_wiki
+version and a digest of the diff_match_patch source, so runs of different
+versions can be compared.  --dump benchmarks consecutive revisions from an
+export_pages file as the case "dump", which needs DJANGO_SETTINGS_MODULE
+set.
+"""
+import datetime
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+from optparse import OptionParser
+
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
+
+import vz_wiki
+from vz_wiki.benchmarks import diff_corpus
+from vz_wiki.utils.diff_match_patch import diff_match_patch
+
+OPERATIONS = ('diff_main', 'diff_main_map', 'diff_cleanupSemantic',
+    'diff_cleanupEfficiency', 'match_bitap', 'patch_make', 'patch_apply')
+# match_bitap can't take longer patterns.
+PATTERN_LENGTH = 32
+
+
+def make_dmp(linear_space, timeout):
+    dmp = diff_match_patch()
+    dmp.Diff_LinearSpace = linear_space
+    dmp.Diff_Timeout = timeout
+    return dmp
+
+
+def prepare(dmp, operation, text1, text2):
+    """The arguments the operation is timed on, worked out beforehand."""
+    if operation in ('diff_main', 'diff_main_map'):
+        return text1, text2
+    if operation == 'match_bitap':
+        loc = max(0, len(text1) / 2 - PATTERN_LENGTH / 2)
+        return text2, text1[loc:loc + PATTERN_LENGTH], loc
+    diffs = dmp.diff_main(text1, text2)
+    if operation == 'patch_make':
+        return text1, diffs
+    if operation == 'patch_apply':
+        return dmp.patch_make(text1, diffs), text1
+    return diffs
+
+
+def run(dmp, operation, args):
+    """Runs operation once, returns the number of failed patches for
+    patch_apply, or None."""
+    if operation in ('diff_main', 'diff_main_map'):
+        dmp.diff_main(*args)
+    elif operation == 'diff_cleanupSemantic':
+        dmp.diff_cleanupSemantic(list(args))
+    elif operation == 'diff_cleanupEfficiency':
+        dmp.diff_cleanupEfficiency(list(args))
+    elif operation == 'match_bitap':
+        dmp.match_bitap(*args)
+    elif operation == 'patch_make':
+        dmp.patch_make(*args)
+    elif operation == 'patch_apply':
+        text, applied = dmp.patch_apply(*args)
+        return len([ok for ok in applied if not ok])
+    return None
+
+
+def peak_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(operation, pairs, repeat, timeout):
+    """
+    Times operation on each pair repeat times.  Returns its median and
+    slowest time, the growth of peak memory, the number of runs, and of
+    timeouts and failed patches.
+    """
+    dmp = make_dmp(operation != 'diff_main_map', timeout)
+    prepared = [prepare(dmp, operation, text1, text2)
+        for text1, text2 in pairs]
+    peak = peak_kb()
+    times = []
+    timeouts = failures = 0
+    for args in prepared:
+        for x in range(repeat):
+            started = time.time()
+            failed = run(dmp, operation, args)
+            elapsed = time.time() - started
+            times.append(elapsed)
+            if operation.startswith('diff_main') and timeout and \
+                elapsed >= timeout:
+                timeouts += 1
+            failures += failed or 0
+    times.sort()
+    return {'median': times[len(times) / 2], 'max': times[-1],
+        'peak_kb': peak_kb() - peak, 'runs': len(times),
+        'timeouts': timeouts, 'timeout_rate': float(timeouts) / len(times),
+        'failed_patches': failures}
+
+
+def _measure_in_child(connection, operation, pairs, repeat, timeout):
+    connection.send(measure(operation, pairs, repeat, timeout))
+    connection.close()
+
+
+def measure_in_child(operation, pairs, repeat, timeout):
+    """measure in a child process, so its memory is measured alone."""
+    receiver, sender = multiprocessing.Pipe(False)
+    child = multiprocessing.Process(target=_measure_in_child,
+        args=(sender, operation, pairs, repeat, timeout))
+    child.start()
+    sender.close()
+    result = receiver.recv()
+    child.join()
+    receiver.close()
+    return result
+
+
+def engine_digest():
+    module = sys.modules[diff_match_patch.__module__]
+    source = os.path.splitext(module.__file__)[0] + '.py'
+    return sha1(open(source, 'rb').read()).hexdigest()
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--cases', default=','.join(diff_corpus.CASES),
+        help='Comma separated cases to run.')
+    parser.add_option('--operations', default=','.join(OPERATIONS),
+        help='Comma separated operations to time.')
+    parser.add_option('--seed', type='int', default=0)
+    parser.add_option('--repeat', type='int', default=3)
+    parser.add_option('--timeout', type='float', default=1.0,
+        help='Diff_Timeout, in seconds, 0 for none.')
+    parser.add_option('--dump',
+        help='Also time consecutive revisions from this export.')
+    parser.add_option('--output', default='diff-benchmark.json',
+        help='File to write the results to.')
+    options, args = parser.parse_args(argv)
+
+    from django.utils import simplejson
+    corpus = []
+    for case in options.cases.split(','):
+        corpus.append((case, diff_corpus.pairs(case, options.seed)))
+    if options.dump:
+        corpus.append(('dump', diff_corpus.dump_pairs(options.dump)))
+    operations = options.operations.split(',')
+
+    results = {}
+    print '%-14s %-24s %11s %11s %10s %9s' % ('case', 'operation',
+        'median (ms)', 'max (ms)', 'peak (KB)', 'timeouts')
+    for case, pairs in corpus:
+        results[case] = {}
+        for operation in operations:
+            result = measure_in_child(operation, pairs, options.repeat,
+                options.timeout)
+            results[case][operation] = result
+            print '%-14s %-24s %11.2f %11.2f %10d %8.0f%%' % (case, operation,
+                result['median'] * 1000, result['max'] * 1000,
+                result['peak_kb'], result['timeout_rate'] * 100)
+
+    output = open(options.output, 'w')
+    try:
+        output.write(simplejson.dumps({'version': vz_wiki.__version__,
+            'engine': engine_digest(), 'python': platform.python_version(),
+            'date': datetime.datetime.now().isoformat(),
+            'config': {'seed': options.seed, 'repeat': options.repeat,
+            'timeout': options.timeout},
+            'corpus': dict([(case, {'pairs': len(pairs),
+            'characters': sum([len(text1) + len(text2)
+            for text1, text2 in pairs])}) for case, pairs in corpus]),
+            'results': results}, sort_keys=True, indent=2) + '\n')
+    finally:
+        output.close()
+    print 'Wrote the results to %s.' % options.output
+
+
+if __name__ == '__main__':
+    main()
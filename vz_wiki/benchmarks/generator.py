@@ -0,0 +1,146 @@
+"""
+Deterministic synthetic wikis for the benchmarks.
+
+generate(pages, revisions, seed) yields pages in the dump format of
+vz_wiki.dumps, each with revisions published revisions of Markdown text:
+headings, paragraphs, lists and code, [[links]] to other pages (and to a
+few that don't exist) and tags from a small vocabulary, each revision an
+edit of the one before.  The same arguments always give the same wiki.
+populate loads one into the database through the bulk import and rebuilds
+the renderings, links and search index.
+
+    python -m vz_wiki.benchmarks.generator pages revisions [seed] > dump.jsonl
+"""
+import datetime
+import random
+import sys
+
+WORDS = (u'wiki page revision history draft editor publish link tag search '
+    u'index cache render markdown table list heading section paragraph '
+    u'release server client request response database query record field '
+    u'backup restore import export archive report summary detail overview '
+    u'design plan meeting review budget schedule milestone project team '
+    u'customer support ticket incident outage deploy config network storage '
+    u'memory process thread worker queue timer metric alert dashboard '
+    u'policy guide howto faq glossary template example sample draft note '
+    u'apple river mountain forest garden harbour bridge castle village '
+    u'market orchard meadow valley island lantern compass anchor').split()
+TAGS = (u'howto reference policy meeting project team archive draft faq '
+    u'support release design ops').split()
+USERS = ['editor%s' % x for x in range(10)]
+STARTED = datetime.datetime(2009, 1, 1)
+# One in MISSING_EVERY links points at a page that doesn't exist.
+MISSING_EVERY = 10
+
+
+def title(number):
+    return u'%s %s %s' % (WORDS[number % len(WORDS)].capitalize(),
+        WORDS[(number * 7 + 3) % len(WORDS)], number)
+
+
+def sentence(rng, pages):
+    words = [rng.choice(WORDS) for x in range(rng.randint(6, 16))]
+    if pages and rng.random() < 0.3:
+        target = rng.randrange(pages)
+        if target % MISSING_EVERY == 0:
+            link = u'Missing %s' % target
+        else:
+            link = title(target)
+        words.insert(rng.randrange(len(words)), u'[[%s]]' % link)
+    if rng.random() < 0.1:
+        x = rng.randrange(len(words))
+        words[x] = u'*%s*' % words[x]
+    text = u' '.join(words)
+    return text[0].upper() + text[1:] + u'.'
+
+
+def block(rng, pages):
+    kind = rng.random()
+    if kind < 0.15:
+        return u'## %s' % u' '.join([rng.choice(WORDS)
+            for x in range(rng.randint(2, 5))]).capitalize()
+    if kind < 0.3:
+        return u'\n'.join([u'* %s' % sentence(rng, pages)
+            for x in range(rng.randint(2, 6))])
+    if kind < 0.35:
+        return u'\n'.join([u'    %s = %s(%s)' % (rng.choice(WORDS),
+            rng.choice(WORDS), rng.choice(WORDS))
+            for x in range(rng.randint(2, 6))])
+    return u' '.join([sentence(rng, pages) for x in range(rng.randint(2, 7))])
+
+
+def body(rng, pages, blocks):
+    return [block(rng, pages) for x in range(blocks)]
+
+
+def edit(rng, pages, blocks):
+    """An editor's change: rewrite, add, remove or move a block or two."""
+    blocks = list(blocks)
+    for x in range(rng.randint(1, 2)):
+        kind = rng.random()
+        at = rng.randrange(len(blocks))
+        if kind < 0.5:
+            blocks[at] = block(rng, pages)
+        elif kind < 0.8 or len(blocks) < 3:
+            blocks.insert(at, block(rng, pages))
+        elif kind < 0.9:
+            del blocks[at]
+        else:
+            blocks.insert(rng.randrange(len(blocks)), blocks.pop(at))
+    return blocks
+
+
+def generate(pages, revisions, seed=0, blocks=12):
+    """Yields pages dump dictionaries, see the module's docstring."""
+    from vz_wiki.links import link_slug
+    for number in range(pages):
+        rng = random.Random(seed * 1000003 + number)
+        created_on = STARTED + datetime.timedelta(hours=number)
+        page_blocks = body(rng, pages, rng.randint(blocks / 2, blocks * 2))
+        page_revisions = []
+        for x in range(revisions):
+            if x:
+                page_blocks = edit(rng, pages, page_blocks)
+            published_on = created_on + datetime.timedelta(days=x,
+                minutes=rng.randrange(600))
+            page_revisions.append({'author': rng.choice(USERS),
+                'body': u'\n\n'.join(page_blocks),
+                'published_on': unicode(published_on)})
+        page_title = title(number)
+        yield {'title': page_title, 'slug': link_slug(page_title),
+            'tags': u' '.join(sorted(set(rng.sample(TAGS,
+            rng.randint(1, 3))))), 'creator': rng.choice(USERS),
+            'created_on': unicode(created_on), 'revisions': page_revisions}
+
+
+def populate(pages, revisions, seed=0, verbosity=0, blocks=12,
+    rebuild=True):
+    """
+    Imports a generated wiki and, if rebuild, compresses it under delta
+    storage and rebuilds what depends on it, as import_pages does.  Without,
+    the pages are stored in full and have no renderings, links or search
+    postings.
+    """
+    from django.core.management import call_command
+    from vz_wiki import dumps, storage
+    records = (('generated:%s' % x, page) for x, page
+        in enumerate(generate(pages, revisions, seed, blocks)))
+    for batch in dumps.read_batches(records):
+        dumps.import_batch(batch)
+    if not rebuild:
+        return
+    if storage.storage_mode() == storage.DELTA:
+        call_command('compress_revisions', verbosity=verbosity)
+    call_command('render_revisions', verbosity=verbosity)
+    call_command('index_links', verbosity=verbosity)
+    call_command('build_search_index', verbosity=verbosity)
+
+
+def main(pages, revisions, seed=0):
+    from django.utils import simplejson
+    for page in generate(pages, revisions, seed):
+        sys.stdout.write(simplejson.dumps(page, sort_keys=True) + '\n')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,83 @@
+"""
+Times the streaming sanitizer against the BeautifulSoup sanitize filter it
+replaced, on large bodies, and checks they give the same output.
+
+    python -m vz_wiki.benchmarks.sanitize [repeat]
+"""
+import re
+import sys
+import time
+
+from vz_wiki.sanitizer import get_policy
+
+ALLOWED_TAGS = 'a:href:title b i em strong p ul ol li pre code blockquote ' \
+    'img:src:alt br table tr td th'
+
+SAMPLE = u"""<p>Some <b>bold</b> and <i>italic</i> text, with a
+<a href="/wiki/page?a=1&amp;b=2" title="A &quot;page&quot;" onclick="x()">link</a>
+and <span style="color: red">a span</span> &copy; 2010 &#169; AT&amp;T.</p>
+<!-- a comment -->
+<ul>
+  <li>one <li>two
+  <li><a href="javascript:alert(1)">three</a></li>
+</ul>
+<script>if (a < b && c) { document.write('<b>x</b>'); }</script>
+<table><tr><td>a<td>b</tr></table>
+<pre>
+  keep   this
+</pre>
+<img src="/logo.png" alt="logo"><br/>
+<div><div>nested <p>para <p>para</div></div>
+"""
+
+SIZES = (10, 100, 1000)
+
+
+def legacy_sanitize(value, allowed_tags):
+    """The sanitize filter as it was, on BeautifulSoup."""
+    from BeautifulSoup import BeautifulSoup, Comment
+    js_regex = re.compile(r'[\s]*(&#x.{1,7})?'.join(list('javascript')))
+
+    allowed_tags = [tag.split(':') for tag in allowed_tags.split()]
+    allowed_tags = dict((tag[0], tag[1:]) for tag in allowed_tags)
+
+    soup = BeautifulSoup(value)
+    for comment in soup.findAll(text=lambda text: isinstance(text, Comment)):
+        comment.extract()
+
+    for tag in soup.findAll(True):
+        if tag.name not in allowed_tags:
+            tag.hidden = True
+        else:
+            tag.attrs = [(attr, js_regex.sub('', val)) for attr, val \
+                in tag.attrs
+                         if attr in allowed_tags[tag.name]]
+
+    return soup.renderContents().decode('utf8')
+
+
+def best_of(repeat, function, *args):
+    times = []
+    for x in range(repeat):
+        started = time.time()
+        result = function(*args)
+        times.append(time.time() - started)
+    return min(times), result
+
+
+def main(repeat=3):
+    policy = get_policy(ALLOWED_TAGS)
+    print '%10s %12s %12s %8s %s' % ('body (KB)', 'legacy (s)', 'stream (s)',
+        'speedup', 'same output')
+    for size in SIZES:
+        body = SAMPLE * size
+        legacy_time, legacy = best_of(repeat, legacy_sanitize, body,
+            ALLOWED_TAGS)
+        stream_time, stream = best_of(repeat, policy.sanitize, body)
+        print '%10d %12.3f %12.3f %7.1fx %s' % (len(body) / 1024,
+            legacy_time, stream_time, legacy_time / max(stream_time, 1e-6),
+            legacy == stream)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
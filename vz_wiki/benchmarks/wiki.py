@@ -0,0 +1,215 @@
+"""
+Times the main wiki operations on a generated wiki and compares them with a
+baseline, to catch regressions before a release.
+
+    python -m vz_wiki.benchmarks.wiki [options]
+
+Run it with DJANGO_SETTINGS_MODULE set to a project with vz_wiki installed.
+It builds a wiki of --pages pages with --revisions revisions each (see the
+generator module) in a fresh test database, which is destroyed afterwards,
+and runs each benchmark --repeat times: page detail, history, compare (on
+pages not compared before, so the diff is computed), publish, tag union and
+search.  The views are called directly, as an anonymous visitor, except
+for publishing, which checks a page out and publishes an edit.
+
+Each benchmark reports its median and fastest time and the queries made
+per run.  Results are compared with the baseline file (baseline.json next
+to this module by default), made with --save on the same settings: a
+benchmark regresses when its median is more than --tolerance slower, or it
+makes more queries.  The exit status is 1 if any did.
+"""
+import os
+import random
+import sys
+import time
+from optparse import OptionParser
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+class Fixture(object):
+    """The generated wiki, and a request maker for the views."""
+
+    def __init__(self):
+        from django.contrib.auth.models import User
+        from vz_wiki.models import WikiPage
+        self.pages = list(WikiPage.objects.select_related('current_revision')
+            .order_by('pk'))
+        self.user = User.objects.get(username='editor0')
+
+    def page(self, x):
+        return self.pages[x * 7919 % len(self.pages)]
+
+    def get(self, view, *args, **GET):
+        from django.contrib.auth.models import AnonymousUser
+        from django.http import HttpRequest
+        request = HttpRequest()
+        request.method = 'GET'
+        request.user = AnonymousUser()
+        request.GET = GET
+        response = view(request, *args)
+        assert response.status_code == 200, response.status_code
+        return response
+
+
+def page_detail(fixture, x):
+    from vz_wiki.views import page_detail
+    fixture.get(page_detail, fixture.page(x).slug)
+
+
+def page_history(fixture, x):
+    from vz_wiki.views import page_history
+    fixture.get(page_history, fixture.page(x).pk)
+
+
+def compare(fixture, x):
+    from vz_wiki.models import Revision
+    from vz_wiki.views import compare_revisions
+    page = fixture.page(x)
+    first = Revision.objects.filter(page=page, number=1).values_list('pk',
+        flat=True)[0]
+    fixture.get(compare_revisions, page.pk, rev1=first,
+        rev2=page.current_revision_id)
+
+
+def publish(fixture, x):
+    page = fixture.page(x)
+    draft = page.check_out(user=fixture.user)
+    draft.body = u'%s\n\nEdited in run %s.' % (draft.body, x)
+    draft.publish()
+
+
+def tag_union(fixture, x):
+    from vz_wiki.benchmarks.generator import TAGS
+    from vz_wiki.views import page_tags
+    fixture.get(page_tags, tags=u'%s %s' % (TAGS[x % len(TAGS)],
+        TAGS[(x + 5) % len(TAGS)]))
+
+
+def search(fixture, x):
+    from vz_wiki.benchmarks.generator import WORDS
+    from vz_wiki.views import search_pages
+    fixture.get(search_pages, q=u'%s %s' % (WORDS[x % len(WORDS)],
+        WORDS[(x * 3 + 1) % len(WORDS)]))
+
+
+BENCHMARKS = (
+    ('page_detail', page_detail),
+    ('page_history', page_history),
+    ('compare', compare),
+    ('publish', publish),
+    ('tag_union', tag_union),
+    ('search', search),
+)
+
+
+def run(fixture, benchmark, repeat):
+    """Runs benchmark repeat times, returns its median and fastest times
+    and the most queries a run made."""
+    from django.db import transaction
+    from vz_wiki import metrics
+    times = []
+    queries = 0
+    for x in range(repeat):
+        before = metrics.query_count()
+        started = time.time()
+        benchmark(fixture, x)
+        times.append(time.time() - started)
+        queries = max(queries, metrics.query_count() - before)
+        transaction.commit_unless_managed()
+    times.sort()
+    return {'median': times[len(times) / 2], 'min': times[0],
+        'queries': queries}
+
+
+def compare_results(results, baseline, tolerance):
+    """Returns a list of (name, reason) for each regression."""
+    regressions = []
+    for name, result in sorted(results.items()):
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        if result['queries'] > expected['queries']:
+            regressions.append((name, '%s queries, %s in the baseline' % (
+                result['queries'], expected['queries'])))
+        if result['median'] > expected['median'] * (1 + tolerance):
+            regressions.append((name, '%.1fms, %.1fms in the baseline' % (
+                result['median'] * 1000, expected['median'] * 1000)))
+    return regressions
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--pages', type='int', default=1000)
+    parser.add_option('--revisions', type='int', default=5)
+    parser.add_option('--seed', type='int', default=0)
+    parser.add_option('--repeat', type='int', default=20)
+    parser.add_option('--baseline', default=BASELINE,
+        help='Baseline file to compare with, or to write with --save.')
+    parser.add_option('--save', action='store_true', default=False,
+        help='Write the results to the baseline file.')
+    parser.add_option('--tolerance', type='float', default=0.5,
+        help='How much slower than the baseline a median may be, 0.5 is '
+            '50%.')
+    options, args = parser.parse_args(argv)
+
+    from django.conf import settings
+    from django.db import connection
+    from django.utils import simplejson
+    from vz_wiki import metrics
+    from vz_wiki.benchmarks.generator import populate
+
+    config = {'pages': options.pages, 'revisions': options.revisions,
+        'seed': options.seed, 'repeat': options.repeat}
+    # NAME with a DATABASES setting, DATABASE_NAME before Django 1.2.
+    database = connection.settings_dict.get('NAME', settings.DATABASE_NAME)
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        started = time.time()
+        populate(options.pages, options.revisions, options.seed)
+        print 'Generated %s pages of %s revisions in %.1fs.' % (
+            options.pages, options.revisions, time.time() - started)
+        metrics.count_queries()
+        # The diff cache prunes itself at random.
+        random.seed(options.seed)
+        fixture = Fixture()
+        results = {}
+        print '%-14s %12s %12s %8s' % ('benchmark', 'median (ms)',
+            'min (ms)', 'queries')
+        for name, benchmark in BENCHMARKS:
+            results[name] = run(fixture, benchmark, options.repeat)
+            print '%-14s %12.2f %12.2f %8d' % (name,
+                results[name]['median'] * 1000, results[name]['min'] * 1000,
+                results[name]['queries'])
+    finally:
+        connection.creation.destroy_test_db(database, verbosity=0)
+
+    if options.save:
+        output = open(options.baseline, 'w')
+        try:
+            output.write(simplejson.dumps({'config': config,
+                'results': results}, sort_keys=True, indent=2) + '\n')
+        finally:
+            output.close()
+        print 'Saved the baseline to %s.' % options.baseline
+        return 0
+    if not os.path.exists(options.baseline):
+        print 'No baseline at %s, run with --save to make one.' % \
+            options.baseline
+        return 0
+    baseline = simplejson.load(open(options.baseline))
+    if baseline['config'] != config:
+        print 'The baseline was made with %s, not comparing.' % \
+            baseline['config']
+        return 0
+    regressions = compare_results(results, baseline['results'],
+        options.tolerance)
+    for name, reason in regressions:
+        print 'REGRESSION %s: %s' % (name, reason)
+    if not regressions:
+        print 'No regressions against %s.' % options.baseline
+    return regressions and 1 or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""
+ETag and Last-Modified validators for the page, history and comparison
+views, so browsers and caching proxies can revalidate them and get a
+``304 Not Modified`` without the views running.
+
+Each validator function reads what its view's output depends on in one
+small query.  Only anonymous, non-AJAX requests are served
+conditionally: logged in users see their own menus and messages, and the
+AJAX comparison status shares its URL with the HTML page.
+"""
+import datetime
+
+from django.db import connection
+from django.utils.functional import wraps
+from django.utils.hashcompat import sha_constructor
+from django.views.decorators.http import condition
+
+import diffs
+import rendering
+
+
+def make_etag(*parts):
+    return sha_constructor(u'\0'.join([unicode(part) for part in parts])
+        .encode('utf-8')).hexdigest()
+
+
+def latest(*dates):
+    dates = [date for date in dates if date is not None]
+    if dates:
+        return max(dates)
+    return None
+
+
+def page_validators(request, slug):
+    """
+    The page's current revision and its stored rendering, lock, tags and
+    title.  Without a stored rendering (one is made when the view runs), or
+    a current revision, there are no validators, and while the page is
+    locked there is only the ETag.
+    """
+    from models import RenderedRevision, WikiPage
+    qn = connection.ops.quote_name
+    fingerprint = rendering.settings_fingerprint()
+    rendered = 'SELECT MAX(%s) FROM %s WHERE %s = %s.%s AND %s = %%s' % (
+        qn(RenderedRevision._meta.pk.column),
+        qn(RenderedRevision._meta.db_table),
+        qn(RenderedRevision._meta.get_field('revision').column),
+        qn(WikiPage._meta.db_table),
+        qn(WikiPage._meta.get_field('current_revision').column),
+        qn(RenderedRevision._meta.get_field('fingerprint').column))
+    try:
+        (pk, title, tags, is_editable, edited_on, revision_id, published_on,
+            is_checked_out, checked_out_by, checked_out_until, rendered) = \
+            WikiPage.objects.filter(slug=slug).extra(
+            select={'rendered': rendered}, select_params=[fingerprint]) \
+            .values_list('pk', 'title', 'tags', 'is_editable', 'edited_on',
+            'current_revision', 'current_revision__published_on',
+            'is_checked_out', 'checked_out_by', 'checked_out_until',
+            'rendered')[0]
+    except IndexError:
+        return None, None
+    if rendered is None:
+        return None, None
+
+    # A lock shows on the page until it is released or expires, which takes
+    # the page back to its unlocked dates, earlier than the lock.  A locked
+    # page has no last modified date then, only the ETag, or a client
+    # revalidating by date alone would keep the locked page for good.
+    locked = is_checked_out and (checked_out_until is None or
+        checked_out_until >= datetime.datetime.now())
+    etag = make_etag('page', pk, title, tags, is_editable, revision_id,
+        rendered, fingerprint, locked, locked and checked_out_by,
+        locked and checked_out_until)
+    if locked:
+        return etag, None
+    return etag, latest(published_on, edited_on)
+
+
+def history_validators(request, page_id):
+    """Published revisions are only ever added, after the current one."""
+    from models import WikiPage
+    try:
+        title, slug, edited_on, revision_id, published_on = \
+            WikiPage.objects.filter(pk=page_id).values_list('title', 'slug',
+            'edited_on', 'current_revision',
+            'current_revision__published_on')[0]
+    except IndexError:
+        return None, None
+    etag = make_etag('history', page_id, title, slug, revision_id)
+    return etag, latest(published_on, edited_on)
+
+
+def comparison_validators(request, page_id):
+    """Two published revisions always compare the same."""
+    from models import Revision
+    try:
+        pks = sorted([int(request.GET['rev1']), int(request.GET['rev2'])])
+    except (KeyError, TypeError, ValueError):
+        return None, None
+    revisions = list(Revision.objects.filter(page=page_id, pk__in=pks,
+        is_published=True).values_list('published_on', 'page__title',
+        'page__slug', 'page__edited_on'))
+    if len(revisions) != 2 or pks[0] == pks[1]:
+        return None, None
+    title, slug, edited_on = revisions[0][1:]
+    etag = make_etag('comparison', page_id, pks[0], pks[1], title, slug,
+        diffs.DIFF_VERSION, diffs.linear_space())
+    return etag, latest(revisions[0][0], revisions[1][0], edited_on)
+
+
+def conditional(validators):
+    """
+    Django's condition decorator, with the ETag and the last modified date
+    both from a single call of validators, which takes the view's arguments
+    and returns the two.  ``202 Accepted`` responses go out without them,
+    and uncached.
+    """
+    def get(request, *args, **kwargs):
+        if not hasattr(request, '_wiki_validators'):
+            if request.user.is_authenticated() or request.is_ajax():
+                request._wiki_validators = None, None
+            else:
+                request._wiki_validators = validators(request, *args,
+                    **kwargs)
+        return request._wiki_validators
+
+    def etag(request, *args, **kwargs):
+        return get(request, *args, **kwargs)[0]
+
+    def last_modified(request, *args, **kwargs):
+        return get(request, *args, **kwargs)[1]
+
+    def decorator(view):
+        conditional_view = condition(etag_func=etag,
+            last_modified_func=last_modified)(view)
+
+        def inner(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            if response.status_code == 202:
+                # Not the answer yet, revalidating it against the finished
+                # one's validators would keep it on screen for good.
+                del response['ETag']
+                del response['Last-Modified']
+                response['Cache-Control'] = 'no-cache'
+            return response
+        # Django's decorator doesn't pass the view's name on.
+        return wraps(view)(inner)
+    return decorator
@@ -0,0 +1,266 @@
+"""
+Revision comparisons.
+
+Diffs are cached in Comparison rows keyed by a digest of the two texts and
+the diff settings, not by page and revision, so reverts, copied pages and
+repeated requests for the same pair of texts are only ever diffed once.
+
+Small pairs of texts are diffed inline.  Once the two texts together are
+longer than ``WIKI_DIFF_SYNC_LIMIT`` characters (default 50000) the comparison
+is queued as a DiffJob instead, and the run_diff_worker command diffs it in a
+separate process that is killed after ``WIKI_DIFF_TIME_LIMIT`` seconds
+(default 30).  A diff that runs out of time is stored as the quick,
+timeout-limited diff that would have been computed inline.
+
+The cache is bounded by ``WIKI_DIFF_CACHE_MAX_ENTRIES`` (default 10000)
+entries, evicting the least recently used first, and entries unused for
+``WIKI_DIFF_CACHE_TTL`` days (default 30) expire.  Run the prune_diff_cache
+command to evict; new entries also prune now and then on their own.
+"""
+import datetime
+import multiprocessing
+import random
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils.encoding import smart_str
+from django.utils.hashcompat import sha_constructor
+
+import metrics
+from utils.diff_match_patch import diff_match_patch
+
+# Bump when the diff output format changes so old entries are not reused.
+DIFF_VERSION = 1
+# Hits only refresh an entry's last use this often, to spare a write per view.
+TOUCH_INTERVAL = datetime.timedelta(hours=1)
+# One in this many new entries prunes the cache.
+PRUNE_EVERY = 100
+
+
+def linear_space():
+    return getattr(settings, 'WIKI_DIFF_LINEAR_SPACE', True)
+
+
+def sync_limit():
+    return getattr(settings, 'WIKI_DIFF_SYNC_LIMIT', 50000)
+
+
+def time_limit():
+    return getattr(settings, 'WIKI_DIFF_TIME_LIMIT', 30)
+
+
+def max_entries():
+    return getattr(settings, 'WIKI_DIFF_CACHE_MAX_ENTRIES', 10000)
+
+
+def ttl():
+    return datetime.timedelta(days=getattr(settings, 'WIKI_DIFF_CACHE_TTL',
+        30))
+
+
+def make_diff_match_patch():
+    diff = diff_match_patch()
+    diff.Diff_LinearSpace = linear_space()
+    return diff
+
+
+def diff_digest(text1, text2):
+    """Identifies the diff of text1 to text2 under the current settings."""
+    text1 = smart_str(text1)
+    text2 = smart_str(text2)
+    diff = make_diff_match_patch()
+    key = sha_constructor('%s:%s:%s:%s:%s:' % (DIFF_VERSION,
+        diff.Diff_LinearSpace, diff.Diff_Timeout, len(text1), len(text2)))
+    key.update(text1)
+    key.update(text2)
+    return key.hexdigest()
+
+
+@metrics.timed('diff')
+def compute_diff(text1, text2):
+    diff = make_diff_match_patch()
+    diff_array = diff.diff_main(text1, text2)
+    diff.diff_cleanupSemantic(diff_array)
+    return diff.diff_prettyHtml(diff_array)
+
+
+def find_comparison(digest):
+    """Returns the cached Comparison for digest or None, refreshing its last
+    use."""
+    from models import Comparison
+    now = datetime.datetime.now()
+    try:
+        comparison = Comparison.objects.get(digest=digest)
+    except Comparison.DoesNotExist:
+        return None
+
+    if comparison.last_used_on < now - TOUCH_INTERVAL:
+        Comparison.objects.filter(pk=comparison.pk).update(last_used_on=now)
+        comparison.last_used_on = now
+    return comparison
+
+
+@metrics.timed('compare')
+def get_or_queue_comparison(rev1, rev2):
+    """
+    Returns the Comparison of the two revisions' bodies, diffing small ones
+    right away.  For a large pair that isn't cached yet the diff is queued
+    and None is returned; call again later.
+    """
+    from models import DiffJob
+    text1 = rev1.body
+    text2 = rev2.body
+    digest = diff_digest(text1, text2)
+    comparison = find_comparison(digest)
+    if comparison is not None:
+        return comparison
+    if len(text1) + len(text2) <= sync_limit():
+        return store_comparison(digest, compute_diff(text1, text2))
+
+    sid = transaction.savepoint()
+    try:
+        DiffJob.objects.get_or_create(digest=digest,
+            defaults={'rev1': rev1, 'rev2': rev2})
+        transaction.savepoint_commit(sid)
+    except IntegrityError:
+        # Queued concurrently by somebody else.
+        transaction.savepoint_rollback(sid)
+    return None
+
+
+def get_comparison(text1, text2):
+    """Returns the cached Comparison of text1 to text2, diffing on a miss."""
+    digest = diff_digest(text1, text2)
+    comparison = find_comparison(digest)
+    if comparison is None:
+        comparison = store_comparison(digest, compute_diff(text1, text2))
+    return comparison
+
+
+def store_comparison(digest, diff_text):
+    """Saves a new cache entry with a single INSERT."""
+    from models import Comparison
+    now = datetime.datetime.now()
+    comparison = Comparison(digest=digest, diff_text=diff_text,
+        size=len(diff_text), created_on=now, last_used_on=now)
+    sid = transaction.savepoint()
+    try:
+        comparison.save(force_insert=True)
+        transaction.savepoint_commit(sid)
+    except IntegrityError:
+        # Diffed concurrently by somebody else.
+        transaction.savepoint_rollback(sid)
+        return Comparison.objects.get(digest=digest)
+    if random.randrange(PRUNE_EVERY) == 0:
+        prune()
+    return comparison
+
+
+def _diff_in_child(connection, text1, text2):
+    diff = make_diff_match_patch()
+    # No soft timeout, the worker enforces a hard one.
+    diff.Diff_Timeout = 0
+    diff_array = diff.diff_main(text1, text2)
+    diff.diff_cleanupSemantic(diff_array)
+    connection.send(diff.diff_prettyHtml(diff_array))
+    connection.close()
+
+
+@metrics.timed('diff_worker')
+def compute_diff_limited(text1, text2, limit):
+    """
+    Diffs in a child process that is killed after limit seconds, then falls
+    back to the inline diff, which gives up after Diff_Timeout.
+    """
+    receiver, sender = multiprocessing.Pipe(False)
+    child = multiprocessing.Process(target=_diff_in_child,
+        args=(sender, text1, text2))
+    child.start()
+    sender.close()
+    diff_text = None
+    if receiver.poll(limit):
+        try:
+            diff_text = receiver.recv()
+        except EOFError:
+            pass
+    if child.is_alive():
+        child.terminate()
+    child.join()
+    receiver.close()
+    if diff_text is None:
+        diff_text = compute_diff(text1, text2)
+    return diff_text
+
+
+def claim_job():
+    """
+    Takes the oldest pending DiffJob and marks it running, with a
+    compare-and-set so several workers never take the same job.  Returns None
+    when the queue is empty.
+    """
+    from models import DiffJob
+    while True:
+        try:
+            job = DiffJob.objects.filter(status=DiffJob.PENDING) \
+                .order_by('queued_on', 'pk')[0]
+        except IndexError:
+            return None
+        now = datetime.datetime.now()
+        if DiffJob.objects.filter(pk=job.pk, status=DiffJob.PENDING).update(
+            status=DiffJob.RUNNING, started_on=now):
+            job.status = DiffJob.RUNNING
+            job.started_on = now
+            return job
+
+
+def run_job(job, limit=None):
+    """Diffs a claimed job, stores the Comparison and deletes the job."""
+    from models import DiffJob
+    if limit is None:
+        limit = time_limit()
+    text1 = job.rev1.body
+    text2 = job.rev2.body
+    if find_comparison(job.digest) is None:
+        store_comparison(job.digest, compute_diff_limited(text1, text2,
+            limit))
+    DiffJob.objects.filter(pk=job.pk).delete()
+
+
+def requeue_stale_jobs(limit=None):
+    """Puts back jobs left running by a worker that died."""
+    from models import DiffJob
+    if limit is None:
+        limit = time_limit()
+    started_before = datetime.datetime.now() - \
+        datetime.timedelta(seconds=limit * 2)
+    return DiffJob.objects.filter(status=DiffJob.RUNNING,
+        started_on__lt=started_before).update(status=DiffJob.PENDING,
+        started_on=None)
+
+
+def prune(entries=None, age=None):
+    """
+    Deletes entries unused for longer than age, then the least recently used
+    entries beyond the newest entries.  Returns the number deleted.
+    """
+    from models import Comparison
+    if entries is None:
+        entries = max_entries()
+    if age is None:
+        age = ttl()
+
+    deleted = 0
+    expired = Comparison.objects.filter(
+        last_used_on__lt=datetime.datetime.now() - age)
+    deleted += expired.count()
+    expired.delete()
+
+    cutoff = list(Comparison.objects.order_by('-last_used_on', '-pk')
+        .values_list('last_used_on', 'pk')[entries:entries + 1])
+    if cutoff:
+        last_used_on, pk = cutoff[0]
+        evicted = Comparison.objects.filter(last_used_on__lte=last_used_on) \
+            .exclude(last_used_on=last_used_on, pk__gt=pk)
+        deleted += evicted.count()
+        evicted.delete()
+    return deleted
@@ -0,0 +1,717 @@
+"""
+Streaming export and import of pages and their revision histories.
+
+A dump is a JSON Lines file, one page per line, a directory of them
+(``*.jsonl``) and of single page ``*.json`` files, read in name order, or a
+tar archive of JSON Lines files, possibly compressed::
+
+    {"title": "Front Page", "slug": "front-page", "tags": "home help",
+     "creator": "alice", "is_editable": true,
+     "created_on": "2009-05-01 12:00:00", "edited_on": "2009-06-01 09:30:00",
+     "revisions": [
+        {"author": "alice", "body": "...", "is_published": true,
+         "published_on": "2009-05-01 12:00:00"},
+        {"author": "bob", "body": "...", "is_published": false}]}
+
+Published revisions are numbered in the order they are listed, oldest
+first.  At most one revision may be unpublished, the page is then checked
+out to its author for a fresh lease.  A page without published revisions
+gets the usual hello world one.  Users are matched by username, and created
+without a usable password when missing; a missing creator or author is
+taken to be DEFAULT_USERNAME.  Only title and slug are required.  Exported
+published revisions also carry their number, and a page whose numbers don't
+start at 1, from an incremental export, is skipped rather than renumbered,
+unless appending: then it is added to the existing page with its slug, if
+that page's last revision is the one before.  Appending updates the page's
+title and tags too, but an incremental export only holds the pages with
+new revisions, so title and tag changes made without a new revision are
+lost, as are unpublished revisions.
+
+Lines with a digest instead of a title are cached diffs, Comparisons, and
+are imported as they are unless one with the same digest exists.
+
+export_pages and export_comparisons walk the wiki CHUNK_SIZE rows at a
+time.  export_pages streams each chunk's revisions, rebuilding delta
+stored bodies as it goes and handing each page on as soon as its last
+revision is read, so exporting holds the rows of one chunk of pages, and
+the history of one page, in memory at a time.  write_jsonl and write_tar
+write them out as they come, the archive with one JSON Lines member per
+chunk.
+
+Going through Model.save would fire create_first_revision, the numbering,
+storage, rendering, link and search handlers once per row.  import_pages
+instead reads the dump one page at a time and inserts whole batches of
+pages, revisions and tags with raw executemany INSERTs, one transaction per
+batch, so no per-row signal ever fires and memory use stays bounded by the
+batch.  The pointers those handlers keep (current_revision, revision_count)
+are written per batch, check_invariants verifies them in one pass at the
+end, and the derived data (renderings, links, search index) is rebuilt by
+the bulk commands afterwards.
+"""
+import datetime
+import os
+import tarfile
+import tempfile
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import simplejson
+from tagging.utils import parse_tag_input
+
+import locks
+import storage
+
+BATCH_SIZE = 200
+CHUNK_SIZE = 200
+# Bodies are held in memory until their batch is written.
+BATCH_CHARACTERS = 8 * 1024 * 1024
+FIRST_REVISION_BODY = u'hello world!'
+DEFAULT_USERNAME = 'admin'
+
+
+class DumpError(ValueError):
+    pass
+
+
+def parse_datetime(value):
+    if value is None:
+        return None
+    value = value.replace(u'T', u' ')
+    for format in ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S',
+        '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(value, format)
+        except ValueError:
+            pass
+    raise DumpError('Unknown date format %r.' % value)
+
+
+def _read_lines(path):
+    dump = open(path)
+    try:
+        for number, line in enumerate(dump):
+            if line.strip():
+                yield '%s:%s' % (path, number + 1), line
+    finally:
+        dump.close()
+
+
+def _read_archive(path):
+    archive = tarfile.open(path, 'r|*')
+    try:
+        for member in archive:
+            if not member.isfile() or not member.name.endswith('.jsonl'):
+                continue
+            for number, line in enumerate(archive.extractfile(member)):
+                if line.strip():
+                    yield '%s:%s:%s' % (path, member.name, number + 1), line
+    finally:
+        archive.close()
+
+
+def _dump_files(path):
+    if not os.path.isdir(path):
+        return [path]
+    return [os.path.join(path, name) for name in sorted(os.listdir(path))
+        if name.endswith('.jsonl') or name.endswith('.json')]
+
+
+def read_dump(path):
+    """
+    Yields (where, record) for each page or comparison of the dump at path,
+    where is the file and line it came from.  Only one record is in memory
+    at a time.
+    """
+    for filename in _dump_files(path):
+        if filename.endswith('.json'):
+            dump = open(filename)
+            try:
+                lines = [(filename, dump.read())]
+            finally:
+                dump.close()
+        elif tarfile.is_tarfile(filename):
+            lines = _read_archive(filename)
+        else:
+            lines = _read_lines(filename)
+        for where, line in lines:
+            try:
+                record = simplejson.loads(line)
+            except ValueError, e:
+                raise DumpError('%s: %s' % (where, e))
+            if not isinstance(record, dict) or not record.get('digest') and \
+                (not record.get('title') or not record.get('slug')):
+                raise DumpError('%s: a page needs a title and a slug.' %
+                    where)
+            yield where, record
+
+
+def read_batches(pages, batch_size=BATCH_SIZE,
+    batch_characters=BATCH_CHARACTERS):
+    """Groups the (where, page) pairs into lists of at most batch_size
+    pages or about batch_characters of revision text."""
+    batch = []
+    characters = 0
+    for where, page in pages:
+        batch.append((where, page))
+        characters += sum([len(revision.get('body') or u'')
+            for revision in page.get('revisions') or []])
+        if len(batch) >= batch_size or characters >= batch_characters:
+            yield batch
+            batch = []
+            characters = 0
+    if batch:
+        yield batch
+
+
+def _insert(model, names, rows):
+    if not rows:
+        return
+    opts = model._meta
+    columns = [opts.get_field(name).column for name in names]
+    qn = connection.ops.quote_name
+    connection.cursor().executemany('INSERT INTO %s (%s) VALUES (%s)' % (
+        qn(opts.db_table), ', '.join([qn(column) for column in columns]),
+        ', '.join(['%s'] * len(columns))), rows)
+
+
+def _db_datetime(value):
+    return connection.ops.value_to_db_datetime(value)
+
+
+def get_users(usernames):
+    """Maps each username to a User id, creating the missing users without
+    a usable password."""
+    from django.contrib.auth.models import User
+    usernames = set(usernames)
+    users = dict(User.objects.filter(username__in=usernames)
+        .values_list('username', 'pk'))
+    for username in usernames:
+        if username not in users:
+            user = User(username=username)
+            user.set_unusable_password()
+            user.save()
+            users[username] = user.pk
+    return users
+
+
+def _tag_pages(pages):
+    """Tags the (page id, tags string) pairs, as Tag.objects.update_tags
+    would, in a few queries for the lot."""
+    from django.contrib.contenttypes.models import ContentType
+    from tagging.models import Tag, TaggedItem
+    from models import WikiPage
+    force_lowercase = getattr(settings, 'FORCE_LOWERCASE_TAGS', False)
+    page_tags = []
+    for page_id, tags in pages:
+        names = parse_tag_input(tags or u'')
+        if force_lowercase:
+            names = [name.lower() for name in names]
+        page_tags.append((page_id, set(names)))
+    names = set()
+    for page_id, tag_names in page_tags:
+        names.update(tag_names)
+    if not names:
+        return
+    tags = dict(Tag.objects.filter(name__in=names).values_list('name', 'pk'))
+    for name in names:
+        if name not in tags:
+            tags[name] = Tag.objects.create(name=name).pk
+    content_type = ContentType.objects.get_for_model(WikiPage)
+    # Left behind by deleted pages whose ids are being reused.
+    TaggedItem.objects.filter(content_type=content_type,
+        object_id__in=[page_id for page_id, tag_names in page_tags]).delete()
+    _insert(TaggedItem, ('tag', 'content_type', 'object_id'),
+        [(tags[name], content_type.pk, page_id)
+        for page_id, tag_names in page_tags for name in tag_names])
+
+
+def _first_number(page):
+    """The number of the first published revision of a page record, 1 if
+    its revisions aren't numbered."""
+    for revision in page.get('revisions') or []:
+        if revision.get('is_published', True):
+            return revision.get('number') or 1
+    return 1
+
+
+@transaction.commit_on_success
+def import_batch(batch, default_username=DEFAULT_USERNAME, append=False):
+    """
+    Inserts a batch of (where, record) pairs from read_dump, skipping the
+    pages whose title or slug is already taken and the comparisons already
+    cached.  With append, a page whose slug exists and whose published
+    revisions carry on from its last one, as in an incremental export, gets
+    those revisions added, and its title and tags are updated.
+
+    Returns the ids of the pages created or appended to, the numbers of
+    revisions and comparisons created and the pages skipped, as (where,
+    reason) pairs.
+    """
+    from models import WikiPage
+    comparisons = import_comparisons([record for where, record in batch
+        if record.get('digest')])
+    skipped = []
+    pages = []
+    titles, slugs = set(), set()
+    for where, page in batch:
+        if page.get('digest'):
+            continue
+        revisions = page.get('revisions') or []
+        numbers = [revision.get('number') for revision in revisions
+            if revision.get('is_published', True)]
+        if len([revision for revision in revisions
+            if not revision.get('is_published', True)]) > 1:
+            skipped.append((where, 'more than one unpublished revision'))
+        elif numbers and numbers[0] is not None and \
+            numbers != range(numbers[0], numbers[0] + len(numbers)):
+            skipped.append((where, 'revisions missing from its history'))
+        elif page['title'] in titles or page['slug'] in slugs:
+            skipped.append((where, 'title or slug repeated in the dump'))
+        else:
+            titles.add(page['title'])
+            slugs.add(page['slug'])
+            pages.append((where, page))
+
+    existing = {}
+    taken = {}
+    for pk, slug, title, revision_count in WikiPage.objects.filter(
+        Q(slug__in=slugs) | Q(title__in=titles)).values_list('pk', 'slug',
+        'title', 'revision_count'):
+        existing[slug] = (pk, revision_count)
+        taken[slug] = taken[title] = pk
+    new_pages = []
+    appended = []
+    for where, page in pages:
+        first = _first_number(page)
+        if page['slug'] in existing and append:
+            pk, revision_count = existing[page['slug']]
+            if taken.get(page['title'], pk) != pk:
+                skipped.append((where, 'title already exists'))
+            elif first != revision_count + 1 or first == 1:
+                skipped.append((where, "revisions don't follow on from the "
+                    "page's %s" % revision_count))
+            elif [revision for revision in page.get('revisions') or []
+                if not revision.get('is_published', True)]:
+                skipped.append((where, 'unpublished revision to append'))
+            else:
+                appended.append((where, page, pk))
+        elif page['slug'] in taken or page['title'] in taken:
+            skipped.append((where, 'title or slug already exists'))
+        elif first != 1:
+            skipped.append((where, 'revisions missing from its history'))
+        else:
+            new_pages.append((where, page))
+    if not new_pages and not appended:
+        return [], 0, comparisons, skipped
+
+    usernames = set()
+    for where, page in new_pages + [(where, page)
+        for where, page, pk in appended]:
+        usernames.add(page.get('creator') or default_username)
+        for revision in page.get('revisions') or []:
+            usernames.add(revision.get('author') or page.get('creator') or
+                default_username)
+    users = get_users(usernames)
+
+    now = datetime.datetime.now()
+    page_ids, revision_rows = _create_pages(new_pages, users,
+        default_username, now)
+    revision_rows.extend(_append_pages(appended, users, default_username,
+        now))
+    _insert_revisions(revision_rows)
+    ids = page_ids.values() + [pk for where, page, pk in appended]
+    _update_current_revisions(ids)
+    _tag_pages([(page_ids[page['slug']], page.get('tags'))
+        for where, page in new_pages] + [(pk, page.get('tags'))
+        for where, page, pk in appended])
+    return ids, len(revision_rows), comparisons, skipped
+
+
+def _revision_rows(page_id, page, revisions, number, users, default_username,
+    now):
+    """Revision rows for _insert_revisions, published ones numbered on
+    from number."""
+    creator = page.get('creator') or default_username
+    created_on = parse_datetime(page.get('created_on')) or now
+    rows = []
+    for revision in revisions:
+        is_published = revision.get('is_published', True)
+        published_on = None
+        if is_published:
+            number += 1
+            published_on = parse_datetime(revision.get('published_on')) \
+                or created_on
+        revision_created_on = parse_datetime(revision.get('created_on')) \
+            or published_on or now
+        rows.append((page_id, users[revision.get('author') or creator],
+            is_published and number or 0, revision.get('body') or u'',
+            False, is_published, published_on and
+            _db_datetime(published_on), _db_datetime(revision_created_on),
+            _db_datetime(parse_datetime(revision.get('edited_on')) or
+            revision_created_on)))
+    return rows
+
+
+def _create_pages(pages, users, default_username, now):
+    """
+    Inserts the (where, record) pages, returns their ids by slug and the
+    rows of their revisions.
+    """
+    from models import WikiPage
+    if not pages:
+        return {}, []
+    until = now + locks.lease_length()
+    page_rows = []
+    for where, page in pages:
+        creator = page.get('creator') or default_username
+        revisions = page.get('revisions') or []
+        published = [revision for revision in revisions
+            if revision.get('is_published', True)]
+        drafts = [revision for revision in revisions
+            if not revision.get('is_published', True)]
+        created_on = parse_datetime(page.get('created_on')) or now
+        draft_author = None
+        if drafts:
+            draft_author = users[drafts[0].get('author') or creator]
+        page_rows.append((page['title'], page['slug'], page.get('tags') or u'',
+            users[creator], page.get('is_editable', True), bool(drafts),
+            draft_author, drafts and _db_datetime(until) or None,
+            _db_datetime(created_on),
+            _db_datetime(parse_datetime(page.get('edited_on')) or created_on),
+            max(len(published), 1)))
+    _insert(WikiPage, ('title', 'slug', 'tags', 'creator', 'is_editable',
+        'is_checked_out', 'checked_out_by', 'checked_out_until', 'created_on',
+        'edited_on', 'revision_count'), page_rows)
+    page_ids = dict(WikiPage.objects.filter(slug__in=[page['slug']
+        for where, page in pages]).values_list('slug', 'pk'))
+
+    revision_rows = []
+    for where, page in pages:
+        revisions = page.get('revisions') or []
+        if not [revision for revision in revisions
+            if revision.get('is_published', True)]:
+            revisions = [{'author': page.get('creator') or default_username,
+                'body': FIRST_REVISION_BODY,
+                'published_on': page.get('created_on')}] + revisions
+        revision_rows.extend(_revision_rows(page_ids[page['slug']], page,
+            revisions, 0, users, default_username, now))
+    return page_ids, revision_rows
+
+
+def _append_pages(appended, users, default_username, now):
+    """
+    Updates the title, tags and revision count of the (where, record, page
+    id) pages appended to, returns the rows of their new revisions.
+    """
+    from models import WikiPage
+    if not appended:
+        return []
+    page_rows = []
+    revision_rows = []
+    for where, page, pk in appended:
+        revisions = page.get('revisions') or []
+        first = _first_number(page)
+        page_rows.append((page['title'], page.get('tags') or u'',
+            _db_datetime(parse_datetime(page.get('edited_on')) or now),
+            first + len(revisions) - 1, pk, first - 1))
+        revision_rows.extend(_revision_rows(pk, page, revisions, first - 1,
+            users, default_username, now))
+    # Only while the page still ends where the dump carries on from.
+    qn = connection.ops.quote_name
+    opts = WikiPage._meta
+    connection.cursor().executemany('UPDATE %s SET %s = %%s, %s = %%s, '
+        '%s = %%s, %s = %%s WHERE %s = %%s AND %s = %%s' % (
+        qn(opts.db_table), qn(opts.get_field('title').column),
+        qn(opts.get_field('tags').column),
+        qn(opts.get_field('edited_on').column),
+        qn(opts.get_field('revision_count').column), qn(opts.pk.column),
+        qn(opts.get_field('revision_count').column)), page_rows)
+    return revision_rows
+
+
+def _insert_revisions(rows):
+    from models import Revision
+    _insert(Revision, ('page', 'author', 'number', 'content', 'is_delta',
+        'is_published', 'published_on', 'created_on', 'edited_on'), rows)
+
+
+def _update_current_revisions(ids):
+    """What update_current_revision does on each publication, for the pages
+    with ids at once."""
+    from models import Revision, WikiPage
+    qn = connection.ops.quote_name
+    connection.cursor().execute(
+        'UPDATE %(page)s SET %(current)s = (SELECT %(revision_pk)s '
+        'FROM %(revision)s WHERE %(revision)s.%(page_fk)s = %(page)s.%(pk)s '
+        'AND %(revision)s.%(number)s = %(page)s.%(count)s AND '
+        '%(revision)s.%(published)s = %%s) WHERE %(pk)s IN (%(ids)s)' % {
+        'page': qn(WikiPage._meta.db_table),
+        'pk': qn(WikiPage._meta.pk.column),
+        'current': qn(WikiPage._meta.get_field('current_revision').column),
+        'count': qn(WikiPage._meta.get_field('revision_count').column),
+        'revision': qn(Revision._meta.db_table),
+        'revision_pk': qn(Revision._meta.pk.column),
+        'page_fk': qn(Revision._meta.get_field('page').column),
+        'number': qn(Revision._meta.get_field('number').column),
+        'published': qn(Revision._meta.get_field('is_published').column),
+        'ids': ', '.join(['%s'] * len(ids))}, [True] + ids)
+
+
+def import_comparisons(comparisons):
+    """Inserts the comparisons whose digest isn't cached yet, returns how
+    many."""
+    from models import Comparison
+    digests = set(Comparison.objects.filter(digest__in=[comparison['digest']
+        for comparison in comparisons]).values_list('digest', flat=True))
+    rows = []
+    now = datetime.datetime.now()
+    for comparison in comparisons:
+        if comparison['digest'] in digests:
+            continue
+        digests.add(comparison['digest'])
+        created_on = parse_datetime(comparison.get('created_on')) or now
+        rows.append((comparison['digest'], comparison.get('diff_text') or u'',
+            comparison.get('size') or 0, _db_datetime(created_on),
+            _db_datetime(parse_datetime(comparison.get('last_used_on')) or
+            created_on)))
+    _insert(Comparison, ('digest', 'diff_text', 'size', 'created_on',
+        'last_used_on'), rows)
+    return len(rows)
+
+
+def _by_page(rows):
+    """Turns an iterator of rows ordered by their first value into a
+    function looking them up by it, called in the same order."""
+    rows = iter(rows)
+    state = {'row': None}
+
+    def get(page_id):
+        row = state['row']
+        while row is None or row[0] < page_id:
+            try:
+                row = rows.next()
+            except StopIteration:
+                row = (float('inf'),)
+        state['row'] = row
+        if row[0] == page_id:
+            return row
+        return None
+    return get
+
+
+def check_invariants(first_pk, last_pk):
+    """
+    Checks the pages with ids from first_pk to last_pk in one pass over
+    them and, alongside, the totals of their revisions, both in page order:
+    published revisions are numbered 1 to revision_count, the current
+    revision is the last of them and a page has at most one draft, only
+    while it is checked out.
+
+    Returns a list of the problems found.
+    """
+    from models import Revision, WikiPage
+    qn = connection.ops.quote_name
+    published = qn(Revision._meta.get_field('is_published').column)
+    number = qn(Revision._meta.get_field('number').column)
+    page = qn(Revision._meta.get_field('page').column)
+    cursor = connection.cursor()
+    cursor.execute('SELECT %(page)s, SUM(CASE WHEN %(published)s THEN 1 '
+        'ELSE 0 END), MIN(CASE WHEN %(published)s THEN %(number)s END), '
+        'MAX(CASE WHEN %(published)s THEN %(number)s END), SUM(CASE WHEN '
+        '%(published)s THEN 0 ELSE 1 END) FROM %(revision)s WHERE %(page)s '
+        'BETWEEN %%s AND %%s GROUP BY %(page)s ORDER BY %(page)s' % {
+        'page': page, 'published': published, 'number': number,
+        'revision': qn(Revision._meta.db_table)}, [first_pk, last_pk])
+    totals = _by_page(iter(cursor.fetchone, None))
+
+    problems = []
+    for pk, slug, revision_count, current, is_checked_out in \
+        WikiPage.objects.filter(pk__gte=first_pk, pk__lte=last_pk) \
+        .order_by('pk').values_list('pk', 'slug', 'revision_count',
+        'current_revision__number', 'is_checked_out').iterator():
+        count, first, last, drafts = (totals(pk) or (pk, 0, None, None, 0))[1:]
+        if not count:
+            problems.append(u'%s: no published revisions' % slug)
+        elif (count, first, last) != (revision_count, 1, revision_count):
+            problems.append(u'%s: %s published revisions numbered %s to %s, '
+                'expected 1 to %s' % (slug, count, first, last,
+                revision_count))
+        elif current != revision_count:
+            problems.append(u'%s: the current revision is number %s, not %s'
+                % (slug, current, revision_count))
+        if drafts > 1:
+            problems.append(u'%s: %s drafts' % (slug, drafts))
+        elif drafts and not is_checked_out:
+            problems.append(u'%s: a draft but not checked out' % slug)
+    return problems
+
+
+def format_datetime(value):
+    if value is None:
+        return None
+    return unicode(value)
+
+
+def _page_revisions(revisions, since=None):
+    """
+    Yields each page id and its revisions as dump dictionaries, from
+    values_list rows ordered by page, published revisions first by number,
+    as soon as the page's last row is read.  Delta stored bodies are rebuilt
+    from the body before them.  With since, only the revisions published
+    since then are kept, the ones before are only read for their bodies.
+    """
+    page_id = None
+    page_revisions = []
+    body = None
+    for (revision_page, number, content, is_delta, is_published, published_on,
+        created_on, edited_on, author) in revisions:
+        if revision_page != page_id:
+            if page_id is not None:
+                yield page_id, page_revisions
+            page_id, page_revisions, body = revision_page, [], None
+        if is_delta:
+            body = storage.apply_delta(body, content)
+        else:
+            body = content
+        if since is not None and published_on < since:
+            continue
+        revision = {'author': author, 'body': body,
+            'is_published': is_published,
+            'created_on': format_datetime(created_on),
+            'edited_on': format_datetime(edited_on)}
+        if is_published:
+            revision['number'] = number
+            revision['published_on'] = format_datetime(published_on)
+        page_revisions.append(revision)
+    if page_id is not None:
+        yield page_id, page_revisions
+
+
+def _export_chunk(chunk, tags, revisions, since):
+    """Yields the page dictionaries of the chunk of page rows, each as soon
+    as its revisions have been read."""
+    groups = _page_revisions(revisions, since)
+    group = next(groups, None)
+    for pk, title, slug, creator, is_editable, created_on, edited_on \
+        in chunk:
+        page_revisions = []
+        if group is not None and group[0] == pk:
+            page_revisions = group[1]
+            group = next(groups, None)
+        yield {'title': title, 'slug': slug,
+            'tags': u' '.join(sorted(tags.get(pk, []))),
+            'creator': creator, 'is_editable': is_editable,
+            'created_on': format_datetime(created_on),
+            'edited_on': format_datetime(edited_on),
+            'revisions': page_revisions}
+
+
+def export_pages(since=None, chunk_size=CHUNK_SIZE):
+    """
+    Yields chunks of page dictionaries, chunk_size pages at a time, each
+    with its tags and revisions.  Each chunk is itself an iterator, reading
+    the revisions as it goes, and has to be used up before the next one is
+    taken.  With since, only the pages with revisions published since then,
+    and only those revisions, are exported.
+    """
+    from django.contrib.contenttypes.models import ContentType
+    from tagging.models import TaggedItem
+    from models import Revision, WikiPage
+    content_type = ContentType.objects.get_for_model(WikiPage)
+    pages = WikiPage.objects.all()
+    if since is not None:
+        pages = pages.filter(revision__published_on__gte=since).distinct()
+    last_pk = 0
+    while True:
+        chunk = list(pages.filter(pk__gt=last_pk).order_by('pk').values_list(
+            'pk', 'title', 'slug', 'creator__username', 'is_editable',
+            'created_on', 'edited_on')[:chunk_size])
+        if not chunk:
+            break
+        last_pk = chunk[-1][0]
+        page_ids = [row[0] for row in chunk]
+
+        tags = {}
+        for page_id, name in TaggedItem.objects.filter(
+            content_type=content_type, object_id__in=page_ids) \
+            .values_list('object_id', 'tag__name').iterator():
+            tags.setdefault(page_id, []).append(name)
+        revisions = Revision.objects.filter(page__in=page_ids)
+        if since is not None:
+            # Walk the whole history, the deltas need the bodies before.
+            revisions = revisions.filter(is_published=True)
+        revisions = revisions.order_by('page__id', '-is_published',
+            'number').values_list('page', 'number', 'content', 'is_delta',
+            'is_published', 'published_on', 'created_on', 'edited_on',
+            'author__username').iterator()
+        yield _export_chunk(chunk, tags, revisions, since)
+
+
+def export_comparisons(since=None, chunk_size=CHUNK_SIZE):
+    """Yields lists of cached diff dictionaries, chunk_size at a time, the
+    ones created since since if given."""
+    from models import Comparison
+    comparisons = Comparison.objects.all()
+    if since is not None:
+        comparisons = comparisons.filter(created_on__gte=since)
+    last_pk = 0
+    while True:
+        chunk = list(comparisons.filter(pk__gt=last_pk).order_by('pk')
+            .values_list('pk', 'digest', 'diff_text', 'size', 'created_on',
+            'last_used_on')[:chunk_size])
+        if not chunk:
+            break
+        last_pk = chunk[-1][0]
+        yield [{'digest': digest, 'diff_text': diff_text, 'size': size,
+            'created_on': format_datetime(created_on),
+            'last_used_on': format_datetime(last_used_on)}
+            for pk, digest, diff_text, size, created_on, last_used_on
+            in chunk]
+
+
+def _encode(record):
+    return simplejson.dumps(record, sort_keys=True) + '\n'
+
+
+def write_jsonl(chunks, stream):
+    """Writes each record of each chunk to stream as a line of JSON,
+    returns how many."""
+    written = 0
+    for chunk in chunks:
+        for record in chunk:
+            stream.write(_encode(record))
+            written += 1
+    return written
+
+
+def write_tar(sections, stream, compression='gz'):
+    """
+    Writes a tar archive to stream, with a JSON Lines member for each chunk
+    of each (name, chunks) pair of sections, called name-000001.jsonl and
+    so on.  Returns the number of records.  The archive is written as a
+    stream, it can go to a pipe; each member is spooled to a temporary file
+    first, for its size.  compression is 'gz', 'bz2' or '' for none.
+    """
+    archive = tarfile.open(fileobj=stream, mode='w|%s' % compression)
+    written = 0
+    try:
+        for name, chunks in sections:
+            for number, chunk in enumerate(chunks):
+                spool = tempfile.TemporaryFile()
+                try:
+                    for record in chunk:
+                        spool.write(_encode(record))
+                        written += 1
+                    member = tarfile.TarInfo('%s-%06d.jsonl' % (name,
+                        number + 1))
+                    member.size = spool.tell()
+                    member.mtime = int(time.time())
+                    spool.seek(0)
+                    archive.addfile(member, spool)
+                finally:
+                    spool.close()
+    finally:
+        archive.close()
+    return written
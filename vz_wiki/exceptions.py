@@ -1,7 +1,9 @@
-class PageAlreadyCheckedOut(Exception):
+class WikiPageAlreadyCheckedOut(Exception):
     "Paged check out, please check it in"
     pass
 
+PageAlreadyCheckedOut = WikiPageAlreadyCheckedOut
+
 
 class UnpublishedRevisionExists(Exception):
     """
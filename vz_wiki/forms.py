@@ -1,4 +1,4 @@
-from django.forms import ModelForm
+from django.forms import ModelForm, CharField, Textarea
 from tagging.forms import TagField
 from models import WikiPage, Revision
 
@@ -10,7 +10,26 @@ class WikiPageForm(ModelForm):
         exclude = ['creator', 'is_checked_out']
 
 
-class RevisionForm(ModelForm):
+class RevisionBodyForm(ModelForm):
+    """
+    Revision text is stored in Revision.content, possibly delta-encoded, so
+    edit it through the Revision.body property instead.
+    """
+    body = CharField(widget=Textarea)
+
+    def __init__(self, *args, **kwargs):
+        super(RevisionBodyForm, self).__init__(*args, **kwargs)
+        self.initial.setdefault('body', self.instance.body)
+
+    def save(self, commit=True):
+        self.instance.body = self.cleaned_data['body']
+        return super(RevisionBodyForm, self).save(commit)
+
+    class Meta:
+        model = Revision
+
+
+class RevisionForm(RevisionBodyForm):
     tags = TagField(label='Tags for WikiPage')
 
     class Meta:
@@ -0,0 +1,108 @@
+"""
+The wiki link graph.
+
+Every [[link]] in a page's current revision is recorded as a WikiLink row
+from the page to the slug the link points at, parsed once when the revision
+is published.  Backlinks, orphaned pages and wanted pages are then each a
+single indexed query rather than a scan of every revision body.
+
+A page's links to itself aren't recorded, so they don't keep it from being
+an orphan.
+
+Links are rendered as red links (class="missing") when their target doesn't
+exist, so stored renderings of the pages linking to a slug are dropped when a
+page with that slug is created or deleted.
+"""
+import re
+
+from django.db.models import Count
+
+wiki_link_pattern = re.compile('\[\[([^\]]+)\]\]')
+white_space_pattern = re.compile('[^\w]+')
+
+
+# Slugs looked up per query, within every database's parameter limit.
+LOOKUP_CHUNK_SIZE = 500
+
+
+def link_slug(text):
+    """
+    The slug a [[text]] link points at, normalized the way slug.js fills in
+    the create page form.
+    """
+    slug = white_space_pattern.sub('-', text.strip()).lower()
+    if slug.endswith('-'):
+        slug = slug[:-1]
+    return slug
+
+
+def linked_slugs(text):
+    """The set of slugs text links to."""
+    return set(link_slug(match) for match in wiki_link_pattern.findall(text))
+
+
+def existing_slugs(slugs):
+    """The subset of slugs that have a page, in one query per
+    LOOKUP_CHUNK_SIZE slugs."""
+    from models import WikiPage
+    slugs = list(slugs)
+    existing = set()
+    for start in xrange(0, len(slugs), LOOKUP_CHUNK_SIZE):
+        existing.update(WikiPage.objects.filter(
+            slug__in=slugs[start:start + LOOKUP_CHUNK_SIZE])
+            .values_list('slug', flat=True))
+    return existing
+
+
+def forget_renderings_linking_to(slug):
+    """Drops the stored renderings of the pages linking to slug, so they're
+    rendered again with the link's new colour."""
+    from models import RenderedRevision
+    RenderedRevision.objects.filter(
+        revision__page__links__target_slug=slug).delete()
+
+
+def update_links(page, text):
+    """
+    Makes page's recorded links those in text, touching only the links that
+    changed.  Returns the number of links added and removed.
+    """
+    from models import WikiLink
+    slugs = linked_slugs(text)
+    slugs.discard(page.slug)
+    existing = set(WikiLink.objects.filter(source=page)
+        .values_list('target_slug', flat=True))
+
+    removed = existing - slugs
+    if removed:
+        WikiLink.objects.filter(source=page, target_slug__in=removed).delete()
+    added = slugs - existing
+    for slug in added:
+        WikiLink.objects.create(source=page, target_slug=slug)
+    return len(added) + len(removed)
+
+
+def backlinks(page):
+    """The pages linking to page."""
+    from models import WikiPage
+    return WikiPage.objects.filter(links__target_slug=page.slug).distinct()
+
+
+def orphans():
+    """The pages nothing links to."""
+    from models import WikiLink, WikiPage
+    return WikiPage.objects.exclude(
+        slug__in=WikiLink.objects.values('target_slug'))
+
+
+def wanted():
+    """
+    The slugs linked to that have no page yet, as dictionaries of
+    target_slug and links (the number of pages linking there), most wanted
+    first.
+    """
+    from models import WikiLink, WikiPage
+    return WikiLink.objects.exclude(
+        target_slug__in=WikiPage.objects.values('slug')) \
+        .values('target_slug').annotate(links=Count('source')) \
+        .order_by('-links', 'target_slug')
@@ -0,0 +1,253 @@
+"""
+Check-out locks for WikiPages.
+
+A lock is the is_checked_out, checked_out_by and checked_out_until columns of
+the page row.  Every change is a single conditional UPDATE on that row, which
+acts as a compare-and-set: two editors racing for the same page can't both
+win, and nothing has to be read first.
+
+Locks are leases.  A lock held past its checked_out_until time may be taken
+by anybody else.  The lease length is ``WIKI_CHECKOUT_LEASE`` seconds,
+one hour by default.
+
+check_in_pages and check_out_pages do the same for many pages at once, along
+with the drafts that go with a check-out, in one transaction and a fixed
+number of queries per BULK_CHUNK_SIZE pages.
+"""
+import datetime
+import random
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+
+BULK_CHUNK_SIZE = 500
+
+
+def lease_length():
+    return datetime.timedelta(seconds=getattr(settings, 'WIKI_CHECKOUT_LEASE',
+        60 * 60))
+
+
+def _set_lock(page, is_checked_out, user, until):
+    page.is_checked_out = is_checked_out
+    page.checked_out_by = user
+    page.checked_out_until = until
+
+
+def acquire(page, user):
+    """
+    Checks the page out to user if it is free or its lease has expired.
+    Returns True if the lock was taken.
+    """
+    from models import WikiPage
+    now = datetime.datetime.now()
+    until = now + lease_length()
+    acquired = WikiPage.objects.filter(pk=page.pk).filter(
+        Q(is_checked_out=False) | Q(checked_out_until__lt=now)).update(
+        is_checked_out=True, checked_out_by=user, checked_out_until=until)
+    if acquired:
+        _set_lock(page, True, user, until)
+    return bool(acquired)
+
+
+def renew(page, user):
+    """
+    Extends user's lease on the page.  Returns False if user doesn't hold the
+    lock any more.
+    """
+    from models import WikiPage
+    until = datetime.datetime.now() + lease_length()
+    renewed = WikiPage.objects.filter(pk=page.pk, is_checked_out=True,
+        checked_out_by=user).update(checked_out_until=until)
+    if renewed:
+        page.checked_out_until = until
+    return bool(renewed)
+
+
+def release(page, user=None):
+    """
+    Checks the page back in.  If user is given, only releases a lock held by
+    that user.  Returns True if the page was checked out.
+    """
+    from models import WikiPage
+    pages = WikiPage.objects.filter(pk=page.pk, is_checked_out=True)
+    if user is not None:
+        pages = pages.filter(checked_out_by=user)
+    released = pages.update(is_checked_out=False, checked_out_by=None,
+        checked_out_until=None)
+    _set_lock(page, False, None, None)
+    return bool(released)
+
+
+def is_expired(page, now=None):
+    """Locks without a lease (from before leases existed) never expire."""
+    if page.checked_out_until is None:
+        return False
+    return page.checked_out_until < (now or datetime.datetime.now())
+
+
+def is_locked(page):
+    """Checks an already fetched page, no queries."""
+    return page.is_checked_out and not is_expired(page)
+
+
+def is_locked_by_id(page_id):
+    """Checks the current lock state in one query."""
+    from models import WikiPage
+    return WikiPage.objects.filter(pk=page_id).filter(is_checked_out=True) \
+        .exclude(checked_out_until__lt=datetime.datetime.now()).count() > 0
+
+
+def _chunks(ids):
+    for start in xrange(0, len(ids), BULK_CHUNK_SIZE):
+        yield ids[start:start + BULK_CHUNK_SIZE]
+
+
+def abandon_drafts(page_ids, keep=()):
+    """
+    Deletes the unpublished revisions of the pages, but for those in keep,
+    with one DELETE, rather than the ORM's queries per revision.  Returns
+    the number deleted.
+    """
+    from models import DiffJob, RenderedRevision, Revision
+    if not page_ids:
+        return 0
+    draft_ids = [pk for pk in Revision.objects.filter(page__in=page_ids,
+        is_published=False).values_list('pk', flat=True) if pk not in keep]
+    if not draft_ids:
+        return 0
+    RenderedRevision.objects.filter(revision__in=draft_ids).delete()
+    DiffJob.objects.filter(Q(rev1__in=draft_ids) | Q(rev2__in=draft_ids)) \
+        .delete()
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    cursor.execute('DELETE FROM %s WHERE %s IN (%s)' % (
+        qn(Revision._meta.db_table), qn(Revision._meta.pk.column),
+        ', '.join(['%s'] * len(draft_ids))), draft_ids)
+    return len(draft_ids)
+
+
+def create_drafts(pages, user, now):
+    """
+    Inserts a draft for each page, a full copy of its current revision, with
+    a single executemany.  Drafts don't need any of the Revision signals,
+    those only act on publication.
+    """
+    from models import Revision, prefetch_bodies
+    prefetch_bodies([page.current_revision for page in pages
+        if page.current_revision is not None])
+    opts = Revision._meta
+    columns = [opts.get_field(name).column for name in ('page', 'author',
+        'number', 'content', 'is_delta', 'is_published', 'created_on',
+        'edited_on')]
+    now = connection.ops.value_to_db_datetime(now)
+    rows = []
+    for page in pages:
+        body = u''
+        if page.current_revision is not None:
+            body = page.current_revision.body
+        rows.append([page.pk, user.pk, 0, body, False, False, now, now])
+    qn = connection.ops.quote_name
+    connection.cursor().executemany('INSERT INTO %s (%s) VALUES (%s)' % (
+        qn(opts.db_table), ', '.join([qn(column) for column in columns]),
+        ', '.join(['%s'] * len(columns))), rows)
+
+
+def _marker():
+    """
+    A lease in the distant past, in whole seconds, that tells the pages one
+    call of check_in_pages claimed from any others'.
+    """
+    return datetime.datetime(1901, 1, 1) + datetime.timedelta(
+        seconds=random.randrange(1 << 30))
+
+
+@transaction.commit_on_success
+def check_in_pages(pages, publish=False, expired_before=None):
+    """
+    Checks in every page of the queryset pages, abandoning their drafts, or
+    if publish, publishing the ones that changed the page's text.
+    Publishing renders and indexes each draft, so it costs queries per
+    draft.  If expired_before is given, only the pages whose lease ran out
+    before then are checked in, so a page somebody has just taken over, or
+    another check_in_pages has just checked in, is left alone.
+
+    The pages are claimed first with a marker lease, in one conditional
+    UPDATE, and only the drafts of the pages claimed are touched.
+
+    Returns the numbers of pages that were checked in, of drafts published
+    and of drafts abandoned.
+    """
+    from models import Revision, WikiPage, prefetch_bodies
+    checked_in = published = abandoned = 0
+    marker = _marker()
+    for page_ids in _chunks(list(pages.values_list('pk', flat=True))):
+        claimed = WikiPage.objects.filter(pk__in=page_ids,
+            is_checked_out=True)
+        if expired_before is not None:
+            claimed = claimed.filter(checked_out_until__lt=expired_before)
+        if not claimed.update(checked_out_until=marker):
+            continue
+        page_ids = list(WikiPage.objects.filter(pk__in=page_ids,
+            is_checked_out=True, checked_out_until=marker)
+            .values_list('pk', flat=True))
+        if publish:
+            drafts = list(Revision.objects.filter(page__in=page_ids,
+                is_published=False).select_related('page__current_revision'))
+            prefetch_bodies([draft.page.current_revision for draft in drafts
+                if draft.page.current_revision is not None])
+            unchanged = []
+            for draft in drafts:
+                current = draft.page.current_revision
+                if current is not None and current.body == draft.body:
+                    unchanged.append(draft.page_id)
+                    continue
+                # Revision.publish would commit our transaction early.
+                draft.is_published = True
+                draft.save()
+                published += 1
+            abandoned += abandon_drafts(unchanged)
+        else:
+            abandoned += abandon_drafts(page_ids)
+        checked_in += WikiPage.objects.filter(pk__in=page_ids,
+            is_checked_out=True).update(is_checked_out=False,
+            checked_out_by=None, checked_out_until=None)
+    return checked_in, published, abandoned
+
+
+@transaction.commit_on_success
+def check_out_pages(pages, user):
+    """
+    Checks out to user every page of the queryset pages that is free or
+    whose lease has expired.  As with WikiPage.check_out, user carries on
+    with their own latest draft if their last check-out expired; whatever
+    drafts other users' expired check-outs left behind are replaced with
+    fresh ones.  Returns the number of pages checked out.
+    """
+    from models import Revision, WikiPage
+    now = datetime.datetime.now()
+    # Whole seconds, so the pages just taken can be found again by their
+    # lease on databases that drop microseconds.
+    until = (now + lease_length()).replace(microsecond=0)
+    checked_out = 0
+    for page_ids in _chunks(list(pages.values_list('pk', flat=True))):
+        if not WikiPage.objects.filter(pk__in=page_ids).filter(
+            Q(is_checked_out=False) | Q(checked_out_until__lt=now)).update(
+            is_checked_out=True, checked_out_by=user,
+            checked_out_until=until):
+            continue
+        taken = list(WikiPage.objects.filter(pk__in=page_ids,
+            checked_out_by=user, checked_out_until=until)
+            .select_related('current_revision'))
+        kept = {}
+        for page_id, draft_id in Revision.objects.filter(
+            page__in=[page.pk for page in taken], is_published=False,
+            author=user).order_by('created_on', 'pk').values_list('page',
+            'pk'):
+            kept[page_id] = draft_id
+        abandon_drafts([page.pk for page in taken], set(kept.values()))
+        create_drafts([page for page in taken if page.pk not in kept], user,
+            now)
+        checked_out += len(taken)
+    return checked_out
@@ -0,0 +1,49 @@
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from vz_wiki.models import WikiPage, Revision
+
+CHUNK_SIZE = 500
+
+
+class Command(NoArgsCommand):
+    help = "Populates WikiPage.current_revision and WikiPage.revision_count " \
+        "(the latest revision number) from the published revisions."
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        updated = 0
+        last_pk = 0
+        while True:
+            page_ids = list(WikiPage.objects.filter(pk__gt=last_pk)
+                .order_by('pk').values_list('pk', flat=True)[:CHUNK_SIZE])
+            if not page_ids:
+                break
+            updated += backfill_pages(page_ids)
+            last_pk = page_ids[-1]
+        if verbosity > 0:
+            print 'Updated %s page(s).' % updated
+
+
+@transaction.commit_on_success
+def backfill_pages(page_ids):
+    """Sets the pointer and count for a chunk of pages from one revision
+    query."""
+    current = {}
+    counts = dict((page_id, 0) for page_id in page_ids)
+    revisions = Revision.objects.filter(page__in=page_ids, is_published=True) \
+        .order_by('page', 'number').values_list('page', 'pk', 'number')
+    for page_id, revision_id, number in revisions:
+        current[page_id] = revision_id
+        counts[page_id] = number
+
+    updated = 0
+    pages = WikiPage.objects.filter(pk__in=page_ids).values_list('pk',
+        'current_revision', 'revision_count')
+    for page_id, revision_id, count in pages:
+        if (revision_id, count) != (current.get(page_id), counts[page_id]):
+            WikiPage.objects.filter(pk=page_id).update(
+                current_revision=current.get(page_id),
+                revision_count=counts[page_id])
+            updated += 1
+    return updated
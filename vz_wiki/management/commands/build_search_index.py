@@ -0,0 +1,38 @@
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from vz_wiki import search
+from vz_wiki.models import WikiPage
+
+CHUNK_SIZE = 200
+
+
+class Command(NoArgsCommand):
+    help = "Indexes every page for the built-in search, run it once after " \
+        "upgrading."
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        indexed = 0
+        last_pk = 0
+        while True:
+            pages = list(WikiPage.objects.filter(pk__gt=last_pk)
+                .order_by('pk').select_related('current_revision')
+                [:CHUNK_SIZE])
+            if not pages:
+                break
+            indexed += index_pages(pages)
+            last_pk = pages[-1].pk
+        if verbosity > 0:
+            print 'Indexed %s page(s).' % indexed
+
+
+@transaction.commit_on_success
+def index_pages(pages):
+    indexed = 0
+    for page in pages:
+        revision = page.latest_revision()
+        if revision is not None:
+            search.index_page(page, revision.body)
+            indexed += 1
+    return indexed
@@ -0,0 +1,66 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from vz_wiki import storage
+from vz_wiki.models import WikiPage, Revision
+
+CHUNK_SIZE = 500
+
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--full', action='store_true', dest='full', default=False,
+            help='Store every published revision in full again.'),
+    )
+    help = "Converts published revisions to the storage mode set by " \
+        "WIKI_REVISION_STORAGE, keyframing every " \
+        "WIKI_REVISION_KEYFRAME_INTERVAL revisions."
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        if options.get('full'):
+            mode = storage.FULL
+        else:
+            mode = storage.storage_mode()
+
+        converted = 0
+        last_pk = 0
+        while True:
+            page_ids = list(WikiPage.objects.filter(pk__gt=last_pk)
+                .order_by('pk').values_list('pk', flat=True)[:CHUNK_SIZE])
+            if not page_ids:
+                break
+            for page_id in page_ids:
+                converted += self.convert_page(page_id, mode)
+            last_pk = page_ids[-1]
+        if verbosity > 0:
+            print 'Re-encoded %s revision(s) as %s.' % (converted, mode)
+
+    @transaction.commit_on_success
+    def convert_page(self, page_id, mode):
+        converted = 0
+        previous = None
+        revisions = list(Revision.objects.filter(page=page_id,
+            is_published=True).order_by('number').values_list('pk', 'number',
+            'content', 'is_delta'))
+        for pk, number, content, is_delta in revisions:
+            if is_delta:
+                body = storage.apply_delta(previous, content)
+            else:
+                body = content
+
+            new_content, new_is_delta = body, False
+            if mode == storage.DELTA and previous is not None and \
+                not storage.is_keyframe_number(number):
+                delta = storage.make_delta(previous, body)
+                if len(delta) < len(body):
+                    new_content, new_is_delta = delta, True
+
+            if new_is_delta != is_delta or new_content != content:
+                Revision.objects.filter(pk=pk).update(content=new_content,
+                    is_delta=new_is_delta)
+                converted += 1
+            previous = body
+        return converted
@@ -0,0 +1,73 @@
+import itertools
+import sys
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+from vz_wiki import dumps
+
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--output', dest='output', default='-',
+            help='File to write to, standard output by default.'),
+        make_option('--format', dest='format', choices=('jsonl', 'tar'),
+            help='jsonl, or tar for a tar of JSON Lines files, gzipped '
+                'unless the output file name ends in .tar.  Guessed from the '
+                'output file name by default.'),
+        make_option('--since', dest='since',
+            help='Only export the revisions published, and the diffs '
+                'cached, since this date ("YYYY-MM-DD HH:MM:SS").'),
+        make_option('--no-comparisons', action='store_false',
+            dest='comparisons', default=True,
+            help="Don't export the cached diffs."),
+        make_option('--chunk-size', type='int', dest='chunk_size',
+            default=dumps.CHUNK_SIZE,
+            help='Pages loaded at a time.'),
+    )
+    help = "Exports every page with its tags and revision history, and the " \
+        "cached diffs, streaming them to a JSON Lines file or a tar archive."
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        output = options.get('output')
+        format = options.get('format')
+        if format is None:
+            format = 'jsonl'
+            for extension in ('.tar', '.tar.gz', '.tgz'):
+                if output.endswith(extension):
+                    format = 'tar'
+        # A plain .tar is what it says, anything else gets gzipped.
+        compression = 'gz'
+        if output.endswith('.tar'):
+            compression = ''
+        since = options.get('since')
+        if since:
+            try:
+                since = dumps.parse_datetime(since)
+            except dumps.DumpError, e:
+                raise CommandError(str(e))
+        chunk_size = options.get('chunk_size')
+
+        sections = [('pages', dumps.export_pages(since, chunk_size))]
+        if options.get('comparisons'):
+            sections.insert(0, ('comparisons',
+                dumps.export_comparisons(since, chunk_size)))
+        started = time.time()
+        if output == '-':
+            stream = sys.stdout
+        else:
+            stream = open(output, 'wb')
+        try:
+            if format == 'tar':
+                written = dumps.write_tar(sections, stream, compression)
+            else:
+                written = dumps.write_jsonl(itertools.chain(*[chunks
+                    for name, chunks in sections]), stream)
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+        if verbosity > 0:
+            print >> sys.stderr, 'Exported %s record(s) in %.2fs.' % (
+                written, time.time() - started)
@@ -0,0 +1,83 @@
+import time
+from optparse import make_option
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from vz_wiki import dumps, pagination, storage
+
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size',
+            default=dumps.BATCH_SIZE,
+            help='Pages inserted per transaction.'),
+        make_option('--default-user', dest='default_user',
+            default=dumps.DEFAULT_USERNAME,
+            help='Username for pages and revisions without a creator or '
+                'author.'),
+        make_option('--append', action='store_true', dest='append',
+            default=False,
+            help='Add the revisions of pages that already exist and whose '
+                'history the dump carries on, as in an incremental export.'),
+        make_option('--no-rebuild', action='store_false', dest='rebuild',
+            default=True,
+            help="Don't compress, render, link and search index the imported "
+                "revisions afterwards."),
+    )
+    help = "Imports pages and their revision histories from a JSON Lines " \
+        "dump, a directory or a tar archive of them, in batches without " \
+        "per-row signals."
+    args = '<dump>'
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Give the path of one dump file or directory.')
+        verbosity = int(options.get('verbosity', 1))
+        started = time.time()
+        imported = revisions = comparisons = 0
+        skipped = []
+        first_pk = last_pk = None
+        try:
+            try:
+                for batch in dumps.read_batches(dumps.read_dump(args[0]),
+                    options.get('batch_size')):
+                    page_ids, batch_revisions, batch_comparisons, \
+                        batch_skipped = dumps.import_batch(batch,
+                        options.get('default_user'), options.get('append'))
+                    imported += len(page_ids)
+                    revisions += batch_revisions
+                    comparisons += batch_comparisons
+                    skipped.extend(batch_skipped)
+                    if page_ids:
+                        first_pk = min([first_pk or page_ids[0]] + page_ids)
+                        last_pk = max([last_pk or 0] + page_ids)
+                    if verbosity > 1:
+                        print 'Imported %s page(s), %s revision(s) ' \
+                            '(%.0f pages/s).' % (imported, revisions,
+                            imported / max(time.time() - started, 0.001))
+            except (IOError, dumps.DumpError), e:
+                raise CommandError(str(e))
+        finally:
+            pagination.forget_page_count()
+
+        if verbosity > 0:
+            print 'Imported %s page(s), %s revision(s) and %s cached ' \
+                'diff(s) in %.2fs.' % (imported, revisions, comparisons,
+                time.time() - started)
+            for where, reason in skipped:
+                print 'Skipped %s: %s.' % (where, reason)
+
+        if first_pk is None:
+            return
+        problems = dumps.check_invariants(first_pk, last_pk)
+        if problems:
+            raise CommandError('%s problem(s) in the imported pages:\n%s' % (
+                len(problems), '\n'.join(problems[:50])))
+
+        if options.get('rebuild'):
+            if storage.storage_mode() == storage.DELTA:
+                call_command('compress_revisions', verbosity=verbosity)
+            call_command('render_revisions', verbosity=verbosity)
+            call_command('index_links', verbosity=verbosity)
+            call_command('build_search_index', verbosity=verbosity)
@@ -0,0 +1,37 @@
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from vz_wiki import links
+from vz_wiki.models import WikiPage
+
+CHUNK_SIZE = 200
+
+
+class Command(NoArgsCommand):
+    help = "Records the [[links]] in each page's current revision, run it " \
+        "once after upgrading."
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        changed = 0
+        last_pk = 0
+        while True:
+            pages = list(WikiPage.objects.filter(pk__gt=last_pk)
+                .order_by('pk').select_related('current_revision')
+                [:CHUNK_SIZE])
+            if not pages:
+                break
+            changed += index_pages(pages)
+            last_pk = pages[-1].pk
+        if verbosity > 0:
+            print 'Added or removed %s link(s).' % changed
+
+
+@transaction.commit_on_success
+def index_pages(pages):
+    changed = 0
+    for page in pages:
+        revision = page.latest_revision()
+        if revision is not None:
+            changed += links.update_links(page, revision.body)
+    return changed
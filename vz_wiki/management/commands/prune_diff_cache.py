@@ -0,0 +1,30 @@
+import datetime
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from vz_wiki import diffs
+
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--max-entries', type='int', dest='max_entries',
+            default=None,
+            help='Entries to keep, defaults to WIKI_DIFF_CACHE_MAX_ENTRIES.'),
+        make_option('--ttl-days', type='int', dest='ttl_days', default=None,
+            help='Drop entries unused for this many days, defaults to '
+                'WIKI_DIFF_CACHE_TTL.'),
+    )
+    help = "Evicts expired and least recently used entries from the diff " \
+        "cache.  Can be run as a cronjob."
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        age = None
+        if options.get('ttl_days') is not None:
+            age = datetime.timedelta(days=options['ttl_days'])
+        deleted = diffs.prune(options.get('max_entries'), age)
+        transaction.commit_unless_managed()
+        if verbosity > 0:
+            print 'Evicted %s comparison(s).' % deleted
@@ -0,0 +1,27 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from vz_wiki import reaper
+
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--publish', action='store_true', dest='publish',
+            default=False,
+            help='Publish the drafts that changed their page instead of '
+                'abandoning them.'),
+        make_option('--batch-size', type='int', dest='batch_size',
+            default=reaper.BATCH_SIZE,
+            help='Pages checked in per transaction.'),
+    )
+    help = "Checks in the pages whose check-out lease has expired."
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        pages, published, abandoned, seconds = reaper.reap(
+            options.get('publish'), options.get('batch_size'))
+        if verbosity > 0:
+            print 'Checked in %s page(s), publishing %s draft(s) and ' \
+                'abandoning %s, in %.2fs.' % (pages, published, abandoned,
+                seconds)
@@ -0,0 +1,61 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from vz_wiki import rendering
+from vz_wiki.models import Revision, RenderedRevision
+
+CHUNK_SIZE = 200
+
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--all-revisions', action='store_true',
+            dest='all_revisions', default=False,
+            help='Render every published revision, not just the current '
+                'revision of each page.'),
+        make_option('--keep-stale', action='store_false', dest='prune',
+            default=True,
+            help="Don't delete renderings made with other settings."),
+    )
+    help = "Renders published revisions with the current WIKI_ALLOWED_TAGS " \
+        "and WIKI_BASE settings, run it after changing them."
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        fingerprint = rendering.settings_fingerprint()
+
+        if options.get('all_revisions'):
+            revisions = Revision.objects.filter(is_published=True)
+        else:
+            revisions = Revision.objects.filter(is_published=True,
+                current_for__isnull=False)
+
+        rendered = 0
+        last_pk = 0
+        while True:
+            chunk = list(revisions.filter(pk__gt=last_pk).order_by('pk')
+                .select_related('page')[:CHUNK_SIZE])
+            if not chunk:
+                break
+            rendered += render_chunk(chunk, fingerprint)
+            last_pk = chunk[-1].pk
+
+        if options.get('prune'):
+            RenderedRevision.objects.exclude(fingerprint=fingerprint).delete()
+            transaction.commit_unless_managed()
+        if verbosity > 0:
+            print 'Rendered %s revision(s).' % rendered
+
+
+@transaction.commit_on_success
+def render_chunk(revisions, fingerprint):
+    done = set(RenderedRevision.objects.filter(revision__in=revisions,
+        fingerprint=fingerprint).values_list('revision', flat=True))
+    rendered = 0
+    for revision in revisions:
+        if revision.pk not in done:
+            rendering.store_rendering(revision, fingerprint)
+            rendered += 1
+    return rendered
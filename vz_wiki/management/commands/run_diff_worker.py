@@ -0,0 +1,44 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from vz_wiki import diffs
+
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--once', action='store_true', dest='once', default=False,
+            help='Exit once the queue is empty instead of polling.'),
+        make_option('--poll-interval', type='float', dest='poll_interval',
+            default=1.0, help='Seconds to sleep when the queue is empty.'),
+        make_option('--time-limit', type='float', dest='time_limit',
+            default=None,
+            help='Seconds a diff may run, defaults to WIKI_DIFF_TIME_LIMIT.'),
+    )
+    help = "Computes queued revision comparisons in the background."
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        limit = options.get('time_limit') or diffs.time_limit()
+        done = 0
+        while True:
+            diffs.requeue_stale_jobs(limit)
+            transaction.commit_unless_managed()
+            job = diffs.claim_job()
+            if job is None:
+                if options.get('once'):
+                    break
+                time.sleep(options.get('poll_interval'))
+                continue
+
+            started = time.time()
+            diffs.run_job(job, limit)
+            transaction.commit_unless_managed()
+            done += 1
+            if verbosity > 1:
+                print 'Diffed %s in %.2fs.' % (job.digest,
+                    time.time() - started)
+        if verbosity > 0:
+            print 'Diffed %s comparison(s).' % done
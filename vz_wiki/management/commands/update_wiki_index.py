@@ -0,0 +1,61 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from vz_wiki import reindex
+
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--chunk-size', type='int', dest='chunk_size',
+            default=reindex.CHUNK_SIZE,
+            help='Pages loaded and sent to the backend at a time.'),
+        make_option('--processes', type='int', dest='processes', default=1,
+            help='Index chunks in this many processes.  Only for backends '
+                'that take concurrent writes, Whoosh locks its index.'),
+        make_option('--queued', action='store_true', dest='queued',
+            default=False,
+            help='Index the pages queued since they were published instead '
+                'of every page, polling for more.'),
+        make_option('--once', action='store_true', dest='once', default=False,
+            help='With --queued, exit once the queue is empty.'),
+        make_option('--poll-interval', type='float', dest='poll_interval',
+            default=5.0, help='Seconds to sleep when the queue is empty.'),
+    )
+    help = "Updates the Haystack index of wiki pages in chunks."
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        chunk_size = options.get('chunk_size')
+
+        if options.get('queued'):
+            done = 0
+            while True:
+                started = time.time()
+                count = reindex.process_queue(chunk_size)
+                transaction.commit_unless_managed()
+                if not count:
+                    if options.get('once'):
+                        break
+                    time.sleep(options.get('poll_interval'))
+                    continue
+                done += count
+                if verbosity > 1:
+                    print 'Indexed %s queued page(s) in %.2fs.' % (count,
+                        time.time() - started)
+            if verbosity > 0:
+                print 'Indexed %s queued page(s).' % done
+            return
+
+        def report(indexed, seconds):
+            if verbosity > 1:
+                print 'Indexed %s page(s) in %.1fs (%.0f pages/s).' % (
+                    indexed, seconds, indexed / max(seconds, 0.001))
+
+        indexed, seconds = reindex.reindex(chunk_size,
+            options.get('processes'), report)
+        if verbosity > 0:
+            print 'Indexed %s page(s) in %.1fs (%.0f pages/s).' % (indexed,
+                seconds, indexed / max(seconds, 0.001))
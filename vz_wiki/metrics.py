@@ -0,0 +1,198 @@
+"""
+In-process counters, timings and latency histograms.
+
+Background jobs record what they did here, and snapshot() reads it all
+back.  Everything is kept per process and starts from zero when the
+process does.
+
+Functions decorated with timed record how long each call took, and how
+many queries it made, under their stage name: check_out, publish, compare,
+diff, sanitize, wiki_link, update_tags, template and the pre_save signal
+handlers.  Each timing keeps a count, total, max and last, the queries made
+and a histogram of cumulative counts for the BUCKETS upper bounds, in
+seconds.  Queries are only counted on threads where count_queries has been
+called, MetricsMiddleware does that for each request.
+
+While a request is being served, begin_request and end_request bracket it
+and the stages timed in between are also added up for that request alone,
+for the slow request log.  render_text writes it all in the Prometheus text
+format.
+"""
+import re
+import threading
+import time
+
+from django.utils.functional import wraps
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+    10.0)
+PREFIX = 'vz_wiki_'
+
+_lock = threading.Lock()
+_local = threading.local()
+_counters = {}
+_timings = {}
+
+
+def incr(name, value=1):
+    _lock.acquire()
+    try:
+        _counters[name] = _counters.get(name, 0) + value
+    finally:
+        _lock.release()
+
+
+def timing(name, seconds, queries=0):
+    """Records one run of name taking seconds and making queries."""
+    _lock.acquire()
+    try:
+        stats = _timings.setdefault(name, {'count': 0, 'total': 0.0,
+            'max': 0.0, 'last': 0.0, 'queries': 0,
+            'buckets': [0] * len(BUCKETS)})
+        stats['count'] += 1
+        stats['total'] += seconds
+        stats['max'] = max(stats['max'], seconds)
+        stats['last'] = seconds
+        stats['queries'] += queries
+        for x, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                stats['buckets'][x] += 1
+    finally:
+        _lock.release()
+
+    request = getattr(_local, 'request', None)
+    if request is not None:
+        stage = request['stages'].setdefault(name, {'count': 0,
+            'seconds': 0.0, 'queries': 0})
+        stage['count'] += 1
+        stage['seconds'] += seconds
+        stage['queries'] += queries
+
+
+def timed(name):
+    """Decorator recording every call of the function as a run of name."""
+    def decorator(func):
+        def inner(*args, **kwargs):
+            queries = query_count()
+            started = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timing(name, time.time() - started, query_count() - queries)
+        # Where template filters have their arguments checked.
+        inner._decorated_function = getattr(func, '_decorated_function',
+            func)
+        return wraps(func)(inner)
+    return decorator
+
+
+class CountingCursor(object):
+    """Counts the statements run through a database cursor."""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, *args, **kwargs):
+        _local.queries = query_count() + 1
+        return self.cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        _local.queries = query_count() + 1
+        return self.cursor.executemany(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+
+def count_queries():
+    """
+    Counts the queries made on this thread from now on.  Django keeps a
+    database connection per thread, so this wraps the cursors of this
+    thread's only.
+    """
+    from django.db import connection
+    if getattr(connection, '_vz_wiki_counted', False):
+        return
+    cursor = connection.cursor
+
+    def counting_cursor():
+        return CountingCursor(cursor())
+    connection.cursor = counting_cursor
+    connection._vz_wiki_counted = True
+
+
+def query_count():
+    """The number of queries counted on this thread so far."""
+    return getattr(_local, 'queries', 0)
+
+
+def begin_request():
+    _local.request = {'started': time.time(), 'queries': query_count(),
+        'stages': {}}
+
+
+def end_request():
+    """
+    Returns the seconds and queries since begin_request, and the stages
+    timed in between, as a dictionary of their count, seconds and queries.
+    None if no request was begun.
+    """
+    request = getattr(_local, 'request', None)
+    if request is None:
+        return None
+    _local.request = None
+    return (time.time() - request['started'],
+        query_count() - request['queries'], request['stages'])
+
+
+def snapshot():
+    """Copies of the counters and of the timings' count, total, max, last,
+    queries and buckets."""
+    _lock.acquire()
+    try:
+        timings = {}
+        for name, stats in _timings.iteritems():
+            timings[name] = dict(stats)
+            timings[name]['buckets'] = list(stats['buckets'])
+        return {'counters': dict(_counters), 'timings': timings}
+    finally:
+        _lock.release()
+
+
+def reset():
+    _lock.acquire()
+    try:
+        _counters.clear()
+        _timings.clear()
+    finally:
+        _lock.release()
+
+
+def metric_name(name):
+    return PREFIX + re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+def render_text():
+    """The counters and timings in the Prometheus text exposition format,
+    each timing as a histogram in seconds and a counter of queries."""
+    current = snapshot()
+    lines = []
+    for name, value in sorted(current['counters'].items()):
+        name = metric_name(name) + '_total'
+        lines.append('# TYPE %s counter' % name)
+        lines.append('%s %s' % (name, value))
+    for name, stats in sorted(current['timings'].items()):
+        seconds = metric_name(name) + '_seconds'
+        lines.append('# TYPE %s histogram' % seconds)
+        for bound, count in zip(BUCKETS, stats['buckets']):
+            lines.append('%s_bucket{le="%s"} %s' % (seconds, bound, count))
+        lines.append('%s_bucket{le="+Inf"} %s' % (seconds, stats['count']))
+        lines.append('%s_sum %r' % (seconds, stats['total']))
+        lines.append('%s_count %s' % (seconds, stats['count']))
+        queries = metric_name(name) + '_queries_total'
+        lines.append('# TYPE %s counter' % queries)
+        lines.append('%s %s' % (queries, stats['queries']))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,75 @@
+"""
+Per-request instrumentation for the wiki views.
+
+Add ``'vz_wiki.middleware.MetricsMiddleware'`` to MIDDLEWARE_CLASSES, as
+early as possible, to time every wiki view and count its queries as the
+request.<view name> timing in metrics, along with the stages timed while it
+ran.  Requests taking WIKI_SLOW_REQUEST_SECONDS (default 1) or longer are
+logged, as a line of JSON with the stages' times and queries, to the
+vz_wiki.slow_requests logger.  Set it to None not to log any.
+
+Add ``'vz_wiki.middleware.ReaperMiddleware'`` to start the expired check-out
+reaper's thread in each process as it handles its first request, if
+WIKI_REAPER_INTERVAL is set.
+"""
+import logging
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils import simplejson
+
+import metrics
+import reaper
+
+logger = logging.getLogger('vz_wiki.slow_requests')
+
+
+def slow_request_seconds():
+    return getattr(settings, 'WIKI_SLOW_REQUEST_SECONDS', 1.0)
+
+
+class MetricsMiddleware(object):
+
+    def process_request(self, request):
+        metrics.count_queries()
+        metrics.begin_request()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if getattr(view_func, '__module__', '').startswith('vz_wiki.'):
+            request._wiki_view = view_func.__name__
+
+    def process_exception(self, request, exception):
+        view = getattr(request, '_wiki_view', None)
+        if view is not None:
+            metrics.incr('request.%s.errors' % view)
+
+    def process_response(self, request, response):
+        measured = metrics.end_request()
+        view = getattr(request, '_wiki_view', None)
+        if measured is None or view is None:
+            return response
+        seconds, queries, stages = measured
+        metrics.timing('request.%s' % view, seconds, queries)
+
+        limit = slow_request_seconds()
+        if limit is not None and seconds >= limit:
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_authenticated():
+                user = user.username
+            else:
+                user = None
+            logger.warning(simplejson.dumps({'view': view,
+                'method': request.method, 'path': request.path,
+                'status': response.status_code, 'user': user,
+                'seconds': round(seconds, 4), 'queries': queries,
+                'stages': stages}, sort_keys=True))
+        return response
+
+
+class ReaperMiddleware(object):
+    """Starts the reaper, then takes no further part in requests."""
+
+    def __init__(self):
+        if reaper.interval():
+            reaper.start()
+        raise MiddlewareNotUsed
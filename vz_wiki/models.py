@@ -1,12 +1,24 @@
-from django.db import models
-from django.db.models.signals import post_save, pre_save
+from django.db import connection, models, transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save, pre_delete, \
+    pre_save
 from django.contrib.auth.models import User
 from exceptions import *
+import diffs
+import links
+import locks
+import metrics
+import pagination
+import rendering
+import search
+import storage
+from signals import revision_published
 import tagging
 from tagging.fields import TagField
 
 import datetime
 import difflib
+import operator
 
 
 class WikiPage(models.Model):
@@ -20,6 +32,14 @@ class WikiPage(models.Model):
     Revision is created when a WikiPage is checked out.
 
     A WikiPage cannot be checked in while an unblished Revision for it exists.
+
+    Check-outs are leases taken and released through the locks module, see
+    there.
+
+    current_revision and revision_count are denormalized from the published
+    Revisions and are only ever written when a Revision is published.
+    revision_count doubles as the counter revision numbers are allocated from,
+    so it always equals the number of the latest revision.
     """
     title = models.CharField(max_length=255, unique=True)
     slug = models.SlugField(unique=True)
@@ -27,35 +47,55 @@ class WikiPage(models.Model):
     creator = models.ForeignKey(User)
     is_editable = models.BooleanField(default=True)
     is_checked_out = models.BooleanField(default=False)
+    checked_out_by = models.ForeignKey(User, null=True, blank=True,
+        editable=False, related_name='checked_out_wikipages')
+    checked_out_until = models.DateTimeField(null=True, blank=True,
+        editable=False, db_index=True)
     created_on = models.DateTimeField(auto_now_add=True, editable=False)
     edited_on = models.DateTimeField(auto_now=True)
+    current_revision = models.ForeignKey('Revision', null=True, blank=True,
+        editable=False, related_name='current_for')
+    revision_count = models.IntegerField(default=0, editable=False)
 
+    @metrics.timed('check_out')
+    @transaction.commit_on_success
     def check_out(self, user):
         """
-        Before checking a page out, check if page is already checked out.  If
-        the page is already checked out, raise WikiPageAlreadyCheckedOut exception.
+        Try to take the check-out lock.  If the page is already checked out
+        and the lease hasn't expired, raise WikiPageAlreadyCheckedOut
+        exception.
 
-        If the page isn't checked out, create a skeleton revision, check out
-        page.
+        Once the lock is held, carry on with the user's own draft if their
+        last check-out expired, otherwise drop whatever draft somebody
+        else's expired check-out left behind and create a skeleton revision.
         """
-        if self.is_checked_out:
+        if not locks.acquire(self, user):
             raise WikiPageAlreadyCheckedOut
-        revision = Revision.objects.create(page=self, author=user,
-            body=self.latest_revision().body)
-        self.is_checked_out = True
-        self.save()
-        return revision
+        drafts = Revision.objects.filter(page=self, is_published=False)
+        try:
+            draft = drafts.filter(author=user).latest('created_on')
+        except Revision.DoesNotExist:
+            drafts.delete()
+            return Revision.objects.create(page=self, author=user,
+                body=self.latest_revision().body)
+        drafts.exclude(pk=draft.pk).delete()
+        return draft
 
     def check_in(self):
         """
-        When model is saved a pre_save signal will throw a
-        UnpublishedRevisionExists exception if the unpublished revision isn't
-        published or abandoned first.
+        Throws a UnpublishedRevisionExists exception if the unpublished
+        revision isn't published or abandoned first.
         """
-        self.is_checked_out = False
-        self.save()
+        if Revision.objects.filter(page=self, is_published=False).count():
+            raise UnpublishedRevisionExists
+        locks.release(self)
+
+    def is_locked(self):
+        return locks.is_locked(self)
 
     def latest_revision(self):
+        if self.current_revision_id is not None:
+            return self.current_revision
         try:
             return Revision.objects.filter(page=self, is_published=True). \
             latest('published_on')
@@ -74,25 +114,47 @@ class WikiPage(models.Model):
             return None
 
     def count_revisions(self):
-        return Revision.objects.filter(page=self, is_published=True).count()
+        return self.revision_count
 
     def who_checked_out(self):
+        if not self.is_locked():
+            return None
+        if self.checked_out_by_id is not None:
+            return self.checked_out_by
         try:
             return Revision.objects.filter(page=self, is_published=False). \
             latest('created_on').author
         except Revision.DoesNotExist:
             return None
 
-    def compare(self, rev1, rev2):
-        if rev1 == rev2:
+    def revision_pair(self, rev1, rev2):
+        """
+        Returns the revisions with primary keys rev1 and rev2, older revision
+        first.
+        """
+        try:
+            pks = sorted([int(rev1), int(rev2)])
+        except (TypeError, ValueError):
+            raise RevisionDoesNotExist
+        if pks[0] == pks[1]:
             raise ComparingSameRevision
-        revisions = Revision.objects.filter(page=self,
-            pk__in=sorted([rev1, rev2]))
-        if revisions.count() != 2:
+        revisions = list(Revision.objects.filter(page=self, pk__in=pks)
+            .order_by('number', 'pk'))
+        if len(revisions) != 2:
             raise RevisionDoesNotExist
+        return revisions
 
-        comparison, created = Comparison.objects.get_or_create(page=self,
-            rev1=revisions[0], rev2=revisions[1])
+    @metrics.timed('compare')
+    def compare(self, rev1, rev2):
+        """
+        Returns the Comparison of the bodies of revisions rev1 and rev2
+        (primary keys), older revision first, diffing them right away on a
+        cache miss.  The revisions are set as its rev1 and rev2 attributes.
+        """
+        revisions = self.revision_pair(rev1, rev2)
+        comparison = diffs.get_comparison(revisions[0].body,
+            revisions[1].body)
+        comparison.rev1, comparison.rev2 = revisions
         return comparison
 
     @models.permalink
@@ -114,23 +176,70 @@ class Revision(models.Model):
 
     A Revision can only be deleted before it is published, once published it
     cannot be changed.
+
+    The text lives in ``content``, which holds either the full text or, for
+    published revisions in delta storage mode, a delta against the previous
+    revision.  Always use ``body`` to read or write the text.
     """
     page = models.ForeignKey(WikiPage)
     author = models.ForeignKey(User)
     number = models.IntegerField(default=0, editable=False)
-    body = models.TextField()
+    content = models.TextField(db_column='body', editable=False)
+    is_delta = models.BooleanField(default=False, editable=False)
     is_published = models.BooleanField(default=False)
     published_on = models.DateTimeField(blank=True, null=True, editable=False)
     created_on = models.DateTimeField(auto_now_add=True, editable=False)
     edited_on = models.DateTimeField(auto_now=True, editable=False)
 
+    def _get_body(self):
+        if not hasattr(self, '_body'):
+            if self.is_delta:
+                self._body = self._rebuild_body()
+            else:
+                self._body = self.content
+        return self._body
+
+    def _set_body(self, value):
+        self._body = value
+        self.content = value
+        self.is_delta = False
+
+    body = property(_get_body, _set_body)
+
+    def _rebuild_body(self):
+        """
+        Walks back from this revision to the closest keyframe in one query and
+        replays the deltas from there.
+        """
+        chain = []
+        revisions = Revision.objects.filter(page=self.page_id,
+            is_published=True, number__lte=self.number).order_by('-number')
+        for content, is_delta in revisions.values_list('content', 'is_delta'
+            ).iterator():
+            chain.append((content, is_delta))
+            if not is_delta:
+                break
+        chain.reverse()
+        return storage.rebuild(chain)
+
+    @metrics.timed('publish')
+    @transaction.commit_on_success
     def publish(self, check_in_page=True):
         self.is_published = True
         self.save()
 
+        self.page.current_revision = self
+        self.page.revision_count = self.number
+
         if check_in_page:
             self.page.check_in()
 
+    def delete(self):
+        # Don't let the page go with its current revision.
+        WikiPage.objects.filter(current_revision=self).update(
+            current_revision=None)
+        super(Revision, self).delete()
+
     def __unicode__(self):
         return '%s #%s' % (self.page.title, self.number)
 
@@ -139,18 +248,53 @@ class Revision(models.Model):
         unique_together = ("page", "number")
 
 
+PREFETCH_WINDOWS = 100
+
+
+def prefetch_bodies(revisions):
+    """
+    Fills in the body of every revision in the list, rebuilding all the
+    delta stored ones with a query per PREFETCH_WINDOWS of them.
+    """
+    deltas = [revision for revision in revisions
+        if revision.is_delta and not hasattr(revision, '_body')]
+    for revision in revisions:
+        if not revision.is_delta:
+            revision._body = revision.content
+    if not deltas:
+        return
+
+    chains = {}
+    # Databases cap the parameters and the depth of the OR a query may have.
+    for start in xrange(0, len(deltas), PREFETCH_WINDOWS):
+        windows = [Q(page=revision.page_id,
+            number__gte=storage.last_keyframe_number(revision.number),
+            number__lte=revision.number)
+            for revision in deltas[start:start + PREFETCH_WINDOWS]]
+        windows = reduce(operator.or_, windows)
+        for page_id, number, content, is_delta in Revision.objects.filter(
+            windows, is_published=True).values_list('page', 'number',
+            'content', 'is_delta').iterator():
+            chains.setdefault(page_id, {})[number] = (content, is_delta)
+
+    for revision in deltas:
+        chain = [chains[revision.page_id][number] for number
+            in sorted(chains.get(revision.page_id, {}))
+            if number <= revision.number]
+        while chain and chain[0][1]:
+            chain.pop(0)
+        if chain:
+            revision._body = storage.rebuild(chain)
+        else:
+            # Keyframed with another interval, walk back the slow way.
+            revision._body = revision._rebuild_body()
+
+
 def create_first_revision(sender, instance, created, **kwargs):
     """Creates a "blank" revision for a new page."""
     if created:
-        Revision.objects.create(page=instance, author=instance.creator,
-            body="hello world!", is_published=True)
-
-
-def check_page_already_checked_out(page_new, page_old):
-    """Checks to see if page is checked out, can't be checked out again."""
-    if page_old is not None and page_new.is_checked_out and \
-        page_old.is_checked_out is True:
-        raise WikiPageAlreadyCheckedOut
+        Revision(page=instance, author=instance.creator,
+            body="hello world!").publish(check_in_page=False)
 
 
 def check_page_unpublished_revisions(page_new):
@@ -160,6 +304,7 @@ def check_page_unpublished_revisions(page_new):
         raise UnpublishedRevisionExists
 
 
+@metrics.timed('pre_save.check_revision_already_published')
 def check_revision_already_published(sender, instance, **kwargs):
     """Published revisions can not be unpublished"""
     if instance.pk != None:
@@ -171,57 +316,252 @@ def check_revision_already_published(sender, instance, **kwargs):
             raise AlreadyPublishedRevision
 
 
+def allocate_revision_number(page_id):
+    """
+    Bumps the page's revision counter and returns the new value.
+
+    The UPDATE takes the page row's write lock, so the SELECT that follows in
+    the same transaction reads this increment and nobody else's.
+    """
+    qn = connection.ops.quote_name
+    table = qn(WikiPage._meta.db_table)
+    counter = qn(WikiPage._meta.get_field('revision_count').column)
+    pk = qn(WikiPage._meta.pk.column)
+    cursor = connection.cursor()
+    cursor.execute('UPDATE %s SET %s = %s + 1 WHERE %s = %%s' % (table,
+        counter, counter, pk), [page_id])
+    cursor.execute('SELECT %s FROM %s WHERE %s = %%s' % (counter, table, pk),
+        [page_id])
+    return cursor.fetchone()[0]
+
+
+@metrics.timed('pre_save.update_published_on')
 def update_published_on(sender, instance, **kwargs):
     """If page goes from not published to published, update published_on
-    date."""
-    published_on = datetime.datetime.now()
-    latest = instance.page.latest_revision()
+    date and give the revision the next number.
 
-    if latest is None:
-        number = 1
-    else:
-        number = latest.number + 1
+    Unpublished revisions are numbered 0, so that is enough to tell a new
+    publication without fetching the original row."""
+    if instance.is_published and not instance.number:
+        instance.published_on = datetime.datetime.now()
+        instance.number = allocate_revision_number(instance.page_id)
+        instance._newly_published = True
+
+
+def update_current_revision(sender, instance, **kwargs):
+    """Point the page at a revision that was just published."""
+    if getattr(instance, '_newly_published', False):
+        del instance._newly_published
+        WikiPage.objects.filter(pk=instance.page_id).update(
+            current_revision=instance)
+        revision_published.send(sender=Revision, revision=instance)
+
+
+def render_published_revision(sender, revision, **kwargs):
+    """Render the body once now rather than on every page view."""
+    rendering.store_rendering(revision)
+
+
+def index_published_links(sender, revision, **kwargs):
+    """Record the links in the page's new current revision."""
+    links.update_links(revision.page, revision.body)
+
+
+def recolour_links_to_page(sender, instance, created=True, **kwargs):
+    """Links to a page that was just created or deleted change colour."""
+    if created:
+        links.forget_renderings_linking_to(instance.slug)
+
+
+def index_published_revision(sender, revision, **kwargs):
+    """Make the page searchable by its new current revision."""
+    search.index_page(revision.page, revision.body)
+
+
+def forget_page_count(sender, instance, created=True, **kwargs):
+    if created:
+        pagination.forget_page_count()
 
+
+def reindex_page(sender, instance, created, **kwargs):
+    """Titles change without a new revision being published."""
+    if not created:
+        revision = instance.latest_revision()
+        if revision is not None:
+            search.index_page(instance, revision.body)
+
+
+def unindex_page(sender, instance, **kwargs):
+    search.unindex_page(instance)
+
+
+@metrics.timed('pre_save.encode_revision_body')
+def encode_revision_body(sender, instance, **kwargs):
+    """When publishing in delta storage mode, store a delta against the
+    previous revision unless this revision is due to be a keyframe."""
+    if not instance.is_published or instance.is_delta or \
+        storage.storage_mode() != storage.DELTA or \
+        storage.is_keyframe_number(instance.number):
+        return
     try:
-        original = Revision.objects.get(pk=instance.pk)
-        if not original.is_published and instance.is_published:
-            instance.published_on = published_on
-            instance.number = number
+        previous = Revision.objects.get(page=instance.page_id,
+            number=instance.number - 1, is_published=True)
     except Revision.DoesNotExist:
-        if instance.is_published:
-            instance.published_on = published_on
-            instance.number = number
+        return
+    body = instance.body
+    delta = storage.make_delta(previous.body, body)
+    if len(delta) < len(body):
+        instance.content = delta
+        instance.is_delta = True
+
+
+def keep_current_revision(page_new, page_old):
+    """The revision pointer and count are maintained by Revision.publish,
+    don't let a stale page instance write them back."""
+    if page_new.current_revision_id != page_old.current_revision_id:
+        page_new.current_revision_id = page_old.current_revision_id
+        if hasattr(page_new, '_current_revision_cache'):
+            del page_new._current_revision_cache
+    page_new.revision_count = page_old.revision_count
+
+
+def keep_lock(page_new, page_old):
+    """The lock holder and lease can only be changed through the locks
+    module, a page that is saved checked in has neither."""
+    if page_new.is_checked_out:
+        page_new.checked_out_by_id = page_old.checked_out_by_id
+        page_new.checked_out_until = page_old.checked_out_until
+    else:
+        page_new.checked_out_by_id = None
+        page_new.checked_out_until = None
 
 
+@metrics.timed('pre_save.page_pre_save_maintenance')
 def page_pre_save_maintenance(sender, instance, **kwargs):
     if instance.pk:
-        check_page_already_checked_out(instance,
-            WikiPage.objects.get(pk=instance.pk))
+        page_old = WikiPage.objects.get(pk=instance.pk)
         check_page_unpublished_revisions(instance)
+        keep_current_revision(instance, page_old)
+        keep_lock(instance, page_old)
 
 post_save.connect(create_first_revision, sender=WikiPage)
+post_save.connect(recolour_links_to_page, sender=WikiPage)
+post_delete.connect(recolour_links_to_page, sender=WikiPage)
+post_save.connect(reindex_page, sender=WikiPage)
+post_save.connect(forget_page_count, sender=WikiPage)
+post_delete.connect(forget_page_count, sender=WikiPage)
+pre_delete.connect(unindex_page, sender=WikiPage)
 pre_save.connect(page_pre_save_maintenance, sender=WikiPage)
 pre_save.connect(check_revision_already_published, sender=Revision)
 pre_save.connect(update_published_on, sender=Revision)
+pre_save.connect(encode_revision_body, sender=Revision)
+post_save.connect(update_current_revision, sender=Revision)
+revision_published.connect(render_published_revision, sender=Revision)
+revision_published.connect(index_published_links, sender=Revision)
+revision_published.connect(index_published_revision, sender=Revision)
+
+
+class RenderedRevision(models.Model):
+    """
+    HTML for a published Revision, rendered with the settings identified by
+    fingerprint.  See the rendering module.
+    """
+    revision = models.ForeignKey(Revision)
+    fingerprint = models.CharField(max_length=40, db_index=True)
+    html = models.TextField()
+    rendered_on = models.DateTimeField(auto_now_add=True)
+
+    def __unicode__(self):
+        return u'%s (%s)' % (self.revision, self.fingerprint[:8])
+
+    class Meta:
+        unique_together = ('revision', 'fingerprint')
 
 
 class Comparison(models.Model):
-    page = models.ForeignKey(WikiPage)
-    rev1 = models.ForeignKey(Revision, related_name='rev1')
-    rev2 = models.ForeignKey(Revision, related_name='rev2')
-    diff_text = models.TextField(default='blank')
+    """
+    A cached diff, keyed by a digest of the two texts and the diff settings.
+    Any pages and revisions with the same pair of texts share one Comparison.
+    See the diffs module.
+    """
+    digest = models.CharField(max_length=40, unique=True)
+    diff_text = models.TextField()
+    size = models.IntegerField(default=0)
+    created_on = models.DateTimeField(editable=False)
+    last_used_on = models.DateTimeField(db_index=True)
 
     def __unicode__(self):
-        return u'%s: %s vs %s' % (self.page.title, self.rev1.pk, self.rev2.pk)
+        return self.digest
 
 
-def comparison_calculate_diff(sender, instance, created, **kwargs):
-    if created:
-        from utils.diff_match_patch import diff_match_patch
-        diff = diff_match_patch()
-        diff_array = diff.diff_main(instance.rev1.body, instance.rev2.body)
-        diff.diff_cleanupSemantic(diff_array)
-        instance.diff_text = diff.diff_prettyHtml(diff_array)
-        instance.save()
-
-post_save.connect(comparison_calculate_diff, sender=Comparison)
+class DiffJob(models.Model):
+    """
+    A comparison waiting for the diff worker (the run_diff_worker command).
+    Once the worker stores the Comparison the job is deleted.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    STATUS_CHOICES = ((PENDING, 'Pending'), (RUNNING, 'Running'))
+
+    digest = models.CharField(max_length=40, unique=True)
+    rev1 = models.ForeignKey(Revision, related_name='diff_jobs_from')
+    rev2 = models.ForeignKey(Revision, related_name='diff_jobs_to')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+        default=PENDING, db_index=True)
+    queued_on = models.DateTimeField(auto_now_add=True)
+    started_on = models.DateTimeField(null=True, blank=True)
+
+    def __unicode__(self):
+        return u'%s (%s)' % (self.digest, self.status)
+
+    class Meta:
+        ordering = ['queued_on']
+
+
+class WikiLink(models.Model):
+    """
+    A [[link]] from the current revision of source to the page with
+    target_slug, which may not exist yet.  See the links module.
+    """
+    source = models.ForeignKey(WikiPage, related_name='links')
+    target_slug = models.CharField(max_length=255, db_index=True)
+
+    def __unicode__(self):
+        return u'%s -> %s' % (self.source.slug, self.target_slug)
+
+    class Meta:
+        unique_together = ('source', 'target_slug')
+
+
+class SearchTerm(models.Model):
+    """A word in the search index, see the search module."""
+    term = models.CharField(max_length=64, unique=True)
+    document_count = models.IntegerField(default=0)
+
+    def __unicode__(self):
+        return self.term
+
+
+class SearchPosting(models.Model):
+    """How much term counts towards finding page."""
+    term = models.ForeignKey(SearchTerm, related_name='postings')
+    page = models.ForeignKey(WikiPage, related_name='search_postings')
+    weight = models.IntegerField()
+
+    def __unicode__(self):
+        return u'%s: %s' % (self.term, self.page_id)
+
+    class Meta:
+        unique_together = ('term', 'page')
+
+
+class IndexUpdate(models.Model):
+    """
+    A page whose Haystack index entry is out of date, waiting for the
+    update_wiki_index command.  See the reindex module.
+    """
+    page_id = models.IntegerField(unique=True)
+    queued_on = models.DateTimeField(db_index=True)
+
+    def __unicode__(self):
+        return u'%s' % self.page_id
@@ -0,0 +1,120 @@
+"""
+Keyset pagination for the page index and page histories.
+
+Rather than an OFFSET, which has the database walk past every row before the
+page asked for, a page starts just after the ordering key of the last row of
+the page before it (or ends just before the first row of the page after
+it), so the last page of a long list costs the same as the first.  Keys go
+in the ``after`` and ``before`` query parameters as cursors.
+
+The number of pages in the wiki is cached for COUNT_TIMEOUT seconds and
+forgotten whenever a page is created or deleted.
+"""
+import datetime
+
+from django.core.cache import cache
+from django.db.models import Q
+
+PAGES_PER_PAGE = 100
+REVISIONS_PER_PAGE = 50
+COUNT_KEY = 'vz_wiki:page_count'
+COUNT_TIMEOUT = 5 * 60
+
+
+def beyond(fields, key, greater):
+    """Q for the rows whose fields sort after key, or before it if not
+    greater."""
+    lookup = greater and 'gt' or 'lt'
+    rows = None
+    for x in range(len(fields)):
+        filters = dict([(str(field), value) for field, value
+            in zip(fields[:x], key[:x])])
+        filters['%s__%s' % (fields[x], lookup)] = key[x]
+        if rows is None:
+            rows = Q(**filters)
+        else:
+            rows = rows | Q(**filters)
+    return rows
+
+
+def keyset_page(queryset, fields, after=None, before=None, limit=50,
+    descending=False):
+    """
+    Up to limit rows of queryset ordered by fields, the last of which must
+    be unique, starting after the key after or ending before the key
+    before.  Keys are tuples of the fields' values.
+
+    Returns the rows and the keys to pass as before and after for the pages
+    either side, None at the ends.
+    """
+    forward = before is None
+    key = forward and after or before
+    ascending = forward != descending
+    if key is not None:
+        queryset = queryset.filter(beyond(fields, key, ascending))
+    order = [ascending and field or '-' + field for field in fields]
+    rows = list(queryset.order_by(*order)[:limit + 1])
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if not forward:
+        rows.reverse()
+    if not rows:
+        return rows, None, None
+
+    if forward:
+        has_previous, has_next = key is not None, more
+    else:
+        has_previous, has_next = more, True
+    previous_key = next_key = None
+    if has_previous:
+        previous_key = tuple([getattr(rows[0], field) for field in fields])
+    if has_next:
+        next_key = tuple([getattr(rows[-1], field) for field in fields])
+    return rows, previous_key, next_key
+
+
+def parse_datetime(value):
+    for format in ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S'):
+        try:
+            return datetime.datetime.strptime(value, format)
+        except ValueError:
+            pass
+    raise ValueError(value)
+
+
+def format_cursor(key):
+    if key is None:
+        return None
+    return u','.join([unicode(value) for value in key])
+
+
+def parse_cursor(value, types):
+    """
+    The key in a cursor, converting each value with the matching callable
+    in types.  Only the first value may contain commas.  Returns None for a
+    missing or mangled cursor.
+    """
+    if not value:
+        return None
+    values = value.rsplit(u',', len(types) - 1)
+    if len(values) != len(types):
+        return None
+    try:
+        return tuple([convert(value) for convert, value
+            in zip(types, values)])
+    except ValueError:
+        return None
+
+
+def page_count():
+    """The number of pages in the wiki, cached."""
+    from models import WikiPage
+    count = cache.get(COUNT_KEY)
+    if count is None:
+        count = WikiPage.objects.count()
+        cache.set(COUNT_KEY, count, COUNT_TIMEOUT)
+    return count
+
+
+def forget_page_count():
+    cache.delete(COUNT_KEY)
@@ -0,0 +1,108 @@
+"""
+Releases check-outs whose lease has run out.
+
+An editor who closes the browser leaves the page checked out with a draft.
+Nobody is kept out, since an expired lease can be taken over, but the lock
+shows and the draft lingers until somebody does.  reap finds the expired
+check-outs through the index on checked_out_until and checks them in
+BATCH_SIZE at a time with locks.check_in_pages, each batch in its own
+transaction, abandoning the drafts or, with publish, publishing the ones
+that changed the page.  check_in_pages checks the lease again as it
+claims each page, so a page taken over since, or reaped by another
+process's reaper, is left alone.  Check-outs from before leases existed
+have no checked_out_until and are left alone.
+
+Run the reap_checkouts command from cron.  Otherwise set
+``WIKI_REAPER_INTERVAL`` to a number of seconds, and ``WIKI_REAPER_PUBLISH``
+to publish, and start a background thread in each serving process, with
+vz_wiki.middleware.ReaperMiddleware or by calling start from the project's
+wsgi file.  Nothing starts it on import, so management commands and the
+master of a pre-forking server don't run one.
+
+Every run is recorded in metrics: the reaper.runs, reaper.pages,
+reaper.published, reaper.abandoned and reaper.errors counters and the
+reaper.run timing.
+"""
+import datetime
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+import locks
+import metrics
+
+BATCH_SIZE = locks.BULK_CHUNK_SIZE
+
+_thread = None
+
+
+def interval():
+    return getattr(settings, 'WIKI_REAPER_INTERVAL', None)
+
+
+def publish_drafts():
+    return getattr(settings, 'WIKI_REAPER_PUBLISH', False)
+
+
+def reap(publish=False, batch_size=BATCH_SIZE):
+    """
+    Checks in the pages whose lease had expired when called.  Returns the
+    numbers of pages checked in, drafts published and drafts abandoned and
+    the seconds it took.
+    """
+    from models import WikiPage
+    started = time.time()
+    now = datetime.datetime.now()
+    pages = published = abandoned = 0
+    while True:
+        page_ids = list(WikiPage.objects.filter(is_checked_out=True,
+            checked_out_until__lt=now).order_by('checked_out_until')
+            .values_list('pk', flat=True)[:batch_size])
+        if not page_ids:
+            break
+        checked_in, batch_published, batch_abandoned = locks.check_in_pages(
+            WikiPage.objects.filter(pk__in=page_ids), publish,
+            expired_before=now)
+        pages += checked_in
+        published += batch_published
+        abandoned += batch_abandoned
+    seconds = time.time() - started
+
+    metrics.incr('reaper.runs')
+    metrics.incr('reaper.pages', pages)
+    metrics.incr('reaper.published', published)
+    metrics.incr('reaper.abandoned', abandoned)
+    metrics.timing('reaper.run', seconds)
+    return pages, published, abandoned, seconds
+
+
+def _reap_forever(seconds, publish):
+    while True:
+        time.sleep(seconds)
+        try:
+            reap(publish)
+        except Exception:
+            # Try again next time round, the thread mustn't die.
+            metrics.incr('reaper.errors')
+        connection.close()
+
+
+def start(seconds=None, publish=None):
+    """
+    Reaps every seconds (default WIKI_REAPER_INTERVAL) in a daemon thread,
+    started once per process.
+    """
+    global _thread
+    if _thread is not None:
+        return _thread
+    if seconds is None:
+        seconds = interval()
+    if publish is None:
+        publish = publish_drafts()
+    _thread = threading.Thread(target=_reap_forever, args=(seconds, publish),
+        name='vz_wiki reaper')
+    _thread.setDaemon(True)
+    _thread.start()
+    return _thread
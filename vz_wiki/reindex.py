@@ -0,0 +1,144 @@
+"""
+Bulk and queued updates of the Haystack index.
+
+Pages are streamed in primary key ranges, each range loaded with its current
+revisions and their bodies in a fixed number of queries, and ranges can be
+spread over a pool of processes for backends that take concurrent writes.
+
+Rather than indexing while a revision is published, search_indexes queues
+the page as an IndexUpdate and ``update_wiki_index --queued`` indexes the
+queued pages in batches.
+"""
+import datetime
+import multiprocessing
+import time
+
+from django.db import connection, IntegrityError, transaction
+
+CHUNK_SIZE = 500
+
+
+def get_index():
+    from haystack import site
+    from models import WikiPage
+    return site.get_index(WikiPage)
+
+
+def page_ranges(chunk_size=CHUNK_SIZE):
+    """Yields (first, last) primary keys of consecutive chunks of pages."""
+    from models import WikiPage
+    last_pk = 0
+    while True:
+        pks = list(WikiPage.objects.filter(pk__gt=last_pk).order_by('pk')
+            .values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            break
+        yield pks[0], pks[-1]
+        last_pk = pks[-1]
+
+
+def load_pages(**filters):
+    """The matching pages with their current revisions and bodies, in two
+    queries plus one for any delta stored bodies."""
+    from models import WikiPage, prefetch_bodies
+    pages = list(WikiPage.objects.filter(**filters).order_by('pk')
+        .select_related('current_revision'))
+    prefetch_bodies([page.current_revision for page in pages
+        if page.current_revision is not None])
+    return pages
+
+
+def index_range(pk_range, index=None):
+    """Indexes the pages in an inclusive primary key range."""
+    if index is None:
+        index = get_index()
+    first, last = pk_range
+    pages = load_pages(pk__gte=first, pk__lte=last)
+    if pages:
+        index.backend.update(index, pages)
+    return len(pages)
+
+
+def _index_range_in_child(pk_range):
+    try:
+        return index_range(pk_range)
+    finally:
+        connection.close()
+
+
+def reindex(chunk_size=CHUNK_SIZE, processes=1, report=None):
+    """
+    Indexes every page, chunk_size at a time, in processes processes, and
+    empties the queue of pages it covered.  report, if given, is called with
+    the number of pages indexed so far and the seconds taken after each
+    chunk.  Returns the same two numbers.
+    """
+    from models import IndexUpdate
+    started_on = datetime.datetime.now()
+    started = time.time()
+    indexed = 0
+    ranges = page_ranges(chunk_size)
+    if processes > 1:
+        # Children mustn't share the parent's database connection.
+        connection.close()
+        pool = multiprocessing.Pool(processes)
+        try:
+            for count in pool.imap_unordered(_index_range_in_child,
+                list(ranges)):
+                indexed += count
+                if report:
+                    report(indexed, time.time() - started)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        index = get_index()
+        for pk_range in ranges:
+            indexed += index_range(pk_range, index)
+            if report:
+                report(indexed, time.time() - started)
+    IndexUpdate.objects.filter(queued_on__lte=started_on).delete()
+    return indexed, time.time() - started
+
+
+def queue_page(page_id):
+    """Marks a page as needing to be indexed again."""
+    from models import IndexUpdate
+    now = datetime.datetime.now()
+    if IndexUpdate.objects.filter(page_id=page_id).update(queued_on=now):
+        return
+    sid = transaction.savepoint()
+    try:
+        IndexUpdate.objects.create(page_id=page_id, queued_on=now)
+        transaction.savepoint_commit(sid)
+    except IntegrityError:
+        # Queued concurrently by somebody else.
+        transaction.savepoint_rollback(sid)
+
+
+def process_queue(batch_size=CHUNK_SIZE, index=None):
+    """
+    Indexes up to batch_size queued pages, and removes the deleted ones from
+    the index.  Pages queued again meanwhile stay queued.  Returns the
+    number of pages handled.
+    """
+    from models import IndexUpdate, WikiPage
+    if index is None:
+        index = get_index()
+    taken_on = datetime.datetime.now()
+    page_ids = list(IndexUpdate.objects.filter(queued_on__lte=taken_on)
+        .order_by('queued_on').values_list('page_id', flat=True)
+        [:batch_size])
+    if not page_ids:
+        return 0
+
+    pages = load_pages(pk__in=page_ids)
+    if pages:
+        index.backend.update(index, pages)
+    found = set(page.pk for page in pages)
+    for page_id in page_ids:
+        if page_id not in found:
+            index.remove_object(WikiPage(pk=page_id))
+    IndexUpdate.objects.filter(page_id__in=page_ids,
+        queued_on__lte=taken_on).delete()
+    return len(page_ids)
@@ -0,0 +1,58 @@
+"""
+Rendering of revision bodies to HTML.
+
+Published revisions never change, so the output of the
+``sanitize | wiki_link | markdown`` pipeline is rendered once, when the
+revision is published, and stored in RenderedRevision.  Rows are keyed by
+revision and by a fingerprint of the settings the pipeline reads, so changing
+WIKI_ALLOWED_TAGS or WIKI_BASE makes every stored rendering a miss, which is
+rendered again lazily (or in bulk with the render_revisions command).
+"""
+from django.conf import settings
+from django.contrib.markup.templatetags.markup import markdown
+from django.db import IntegrityError, transaction
+from django.utils.encoding import smart_str
+from django.utils.hashcompat import sha_constructor
+
+# Bump when the pipeline itself changes so old renderings are not reused.
+RENDERER_VERSION = 2
+
+
+def settings_fingerprint():
+    return sha_constructor(smart_str(u'%s\0%s\0%s' % (RENDERER_VERSION,
+        getattr(settings, 'WIKI_ALLOWED_TAGS', ''),
+        getattr(settings, 'WIKI_BASE', 'wiki')))).hexdigest()
+
+
+def render_body(text):
+    """The same pipeline page_detail.html used to run on every request."""
+    from templatetags.wiki_tags import sanitize, wiki_link
+    return markdown(wiki_link(sanitize(text)))
+
+
+def store_rendering(revision, fingerprint=None):
+    """Renders revision and stores the result, returns the HTML."""
+    from models import RenderedRevision
+    if fingerprint is None:
+        fingerprint = settings_fingerprint()
+    html = render_body(revision.body)
+    sid = transaction.savepoint()
+    try:
+        RenderedRevision.objects.create(revision=revision,
+            fingerprint=fingerprint, html=html)
+        transaction.savepoint_commit(sid)
+    except IntegrityError:
+        # Somebody else rendered it first, theirs is just as good.
+        transaction.savepoint_rollback(sid)
+    return html
+
+
+def rendered_html(revision):
+    """Stored HTML for revision, rendering it on a miss."""
+    from models import RenderedRevision
+    fingerprint = settings_fingerprint()
+    try:
+        return RenderedRevision.objects.filter(revision=revision,
+            fingerprint=fingerprint).values_list('html', flat=True)[0]
+    except IndexError:
+        return store_rendering(revision, fingerprint)
@@ -0,0 +1,433 @@
+"""
+HTML sanitizing for revision bodies.
+
+The sanitize filter used to build a BeautifulSoup tree of every body and then
+walk every tag in it.  This module does the same job in a single pass over
+the text: a tokenizer that follows the rules of sgmllib (which BeautifulSoup
+parses with) feeds a stack of open tags that follows BeautifulSoup's nesting
+rules, and tags are written out as they open and close instead of from a
+tree.  For tags, text, entities and comments the output is the same as the
+old filter's.  Declarations, CDATA sections and processing instructions are
+dropped rather than passed through.
+
+What gets through is a Policy, parsed once per allowed tags string and
+cached, see get_policy.
+"""
+import re
+
+from django.utils.encoding import force_unicode
+
+# How sgmllib finds things.
+interesting = re.compile('[&<]')
+incomplete = re.compile('&([a-zA-Z][a-zA-Z0-9]*|#[0-9]*)?|'
+    '<([a-zA-Z][^<>]*|/([a-zA-Z][^<>]*)?|![^<>]*)?')
+entityref = re.compile('&([a-zA-Z][-.a-zA-Z0-9]*)[^a-zA-Z0-9]')
+charref = re.compile('&#([0-9]+)[^0-9]')
+starttagopen = re.compile('<[>a-zA-Z]')
+shorttagopen = re.compile('<[a-zA-Z][-.a-zA-Z0-9]*/')
+shorttag = re.compile('<([a-zA-Z][-.a-zA-Z0-9]*)/([^/]*)/')
+endbracket = re.compile('[<>]')
+tagfind = re.compile('[a-zA-Z][-_.a-zA-Z0-9]*')
+attrfind = re.compile(
+    r'\s*([a-zA-Z_][-:.a-zA-Z_0-9]*)(\s*=\s*'
+    r'(\'[^\']*\'|"[^"]*"|[][\-a-zA-Z0-9./,:;+*%?!&$\(\)_#=~\'"@]*))?')
+entity_or_charref = re.compile('&(?:([a-zA-Z][-.a-zA-Z0-9]*)|#([0-9]+))(;?)')
+comment_close = re.compile(r'--\s*>')
+declaration_close = re.compile('>')
+
+# Cleanups BeautifulSoup makes to markup before parsing it.
+MARKUP_MASSAGE = (
+    (re.compile('(<[^<>]*)/>'), lambda x: x.group(1) + ' />'),
+    (re.compile('<!\s+([^<>]*)>'), lambda x: '<!' + x.group(1) + '>'),
+)
+
+# BeautifulSoup's model of HTML.
+ROOT_TAG_NAME = u'[document]'
+SELF_CLOSING_TAGS = frozenset(('br', 'hr', 'input', 'img', 'meta', 'spacer',
+    'link', 'frame', 'base', 'col'))
+PRESERVE_WHITESPACE_TAGS = frozenset(('pre', 'textarea'))
+QUOTE_TAGS = frozenset(('script', 'textarea'))
+NESTABLE_TAGS = {
+    'span': [], 'font': [], 'q': [], 'object': [], 'bdo': [], 'sub': [],
+    'sup': [], 'center': [],
+    'blockquote': [], 'div': [], 'fieldset': [], 'ins': [], 'del': [],
+    'ol': [], 'ul': [], 'li': ['ul', 'ol'], 'dl': [], 'dd': ['dl'],
+    'dt': ['dl'],
+    'table': [], 'tr': ['table', 'tbody', 'tfoot', 'thead'], 'td': ['tr'],
+    'th': ['tr'], 'thead': ['table'], 'tbody': ['table'], 'tfoot': ['table'],
+}
+RESET_NESTING_TAGS = frozenset(('blockquote', 'div', 'fieldset', 'ins', 'del',
+    'noscript', 'address', 'form', 'p', 'pre', 'ol', 'ul', 'li', 'dl', 'dd',
+    'dt', 'table', 'tr', 'td', 'th', 'thead', 'tbody', 'tfoot'))
+
+ASCII_SPACES = u'\t\n\x0c\r '
+XML_ENTITIES = {'lt': u'<', 'gt': u'>', 'amp': u'&', 'quot': u'"',
+    'apos': u"'"}
+XML_SPECIAL_CHARS = {u'<': u'&lt;', u'>': u'&gt;', u'&': u'&amp;'}
+bare_ampersand_or_bracket = re.compile('([<>]|&(?!#\d+;|#x[0-9a-fA-F]+;|\w+;))')
+attribute_entity = re.compile('&(#\d+|#x[0-9a-fA-F]+|\w+);')
+js_regex = re.compile(r'[\s]*(&#x.{1,7})?'.join(list('javascript')))
+
+# Policies kept at most, there's normally one per WIKI_ALLOWED_TAGS setting.
+MAX_POLICIES = 100
+_policies = {}
+
+
+def get_policy(allowed_tags):
+    """The cached Policy for an allowed tags string."""
+    policy = _policies.get(allowed_tags)
+    if policy is None:
+        if len(_policies) >= MAX_POLICIES:
+            _policies.clear()
+        policy = _policies[allowed_tags] = Policy(allowed_tags)
+    return policy
+
+
+def _escape(match):
+    return XML_SPECIAL_CHARS[match.group(0)[0]]
+
+
+def _convert_ref(match):
+    """Entity and character references in attribute values, as sgmllib
+    converts them."""
+    name, number, semicolon = match.groups()
+    if number:
+        if int(number) <= 127:
+            return unichr(int(number))
+        return u'&#%s%s' % (number, semicolon)
+    if semicolon:
+        return XML_ENTITIES.get(name, u'&%s;' % name)
+    return u'&%s' % name
+
+
+def _convert_attribute_entity(match):
+    """Character references left in attribute values, as BeautifulSoup
+    converts them."""
+    ref = match.group(1)
+    if ref[0] == '#':
+        try:
+            if ref[1] == 'x':
+                return unichr(int(ref[2:], 16))
+            return unichr(int(ref[1:]))
+        except ValueError:
+            pass
+    return match.group(0)
+
+
+def _render_attribute(name, value):
+    value = js_regex.sub('', attribute_entity.sub(_convert_attribute_entity,
+        value))
+    fmt = u'%s="%s"'
+    if '"' in value:
+        fmt = u"%s='%s'"
+        if "'" in value:
+            value = value.replace("'", "&squot;")
+    return fmt % (name, bare_ampersand_or_bracket.sub(_escape, value))
+
+
+class Policy(object):
+    """
+    The tags, and the attributes of each, that sanitizing lets through.
+
+    allowed_tags is in the form 'tag1:attr1:attr2 tag2:attr1 tag3'.
+    """
+
+    def __init__(self, allowed_tags):
+        self.allowed_tags = allowed_tags
+        tags = [tag.split(':') for tag in allowed_tags.split()]
+        self.attributes = dict((tag[0], frozenset(tag[1:])) for tag in tags)
+
+    def sanitize(self, value):
+        """Strips everything the policy doesn't allow from value."""
+        if not value:
+            return u''
+        return Sanitizer(self).run(force_unicode(value))
+
+
+class Sanitizer(object):
+    """One pass of a Policy over some text."""
+
+    def __init__(self, policy):
+        self.attributes = policy.attributes
+        self.out = []
+        self.data = []
+        # Open tags as (name, shown), innermost last.
+        self.stack = []
+        self.quote_stack = []
+        self.literal = False
+        self.lasttag = '???'
+
+    def run(self, rawdata):
+        for fix, m in MARKUP_MASSAGE:
+            rawdata = fix.sub(m, rawdata)
+        self.rawdata = rawdata
+        self.goahead()
+        self.flush()
+        while self.stack:
+            self.pop()
+        return u''.join(self.out)
+
+    def goahead(self):
+        rawdata = self.rawdata
+        data = self.data
+        i = 0
+        n = len(rawdata)
+        while i < n:
+            match = interesting.search(rawdata, i)
+            if match:
+                j = match.start()
+            else:
+                j = n
+            if i < j:
+                data.append(rawdata[i:j])
+            i = j
+            if i == n:
+                break
+            if rawdata[i] == '<':
+                if starttagopen.match(rawdata, i):
+                    if self.literal:
+                        data.append(u'<')
+                        i = i + 1
+                        continue
+                    k = self.parse_starttag(i)
+                    if k < 0:
+                        break
+                    i = k
+                    continue
+                if rawdata.startswith('</', i):
+                    k = self.parse_endtag(i)
+                    if k < 0:
+                        break
+                    i = k
+                    self.literal = False
+                    continue
+                if self.literal:
+                    if n > i + 1:
+                        data.append(u'<')
+                        i = i + 1
+                    else:
+                        break
+                    continue
+                if rawdata.startswith('<!--', i):
+                    match = comment_close.search(rawdata, i + 4)
+                    if not match:
+                        break
+                    self.flush()
+                    i = match.end(0)
+                    continue
+                if rawdata.startswith('<?', i):
+                    match = declaration_close.search(rawdata, i + 2)
+                    if not match:
+                        break
+                    self.flush()
+                    i = match.end(0)
+                    continue
+                if rawdata.startswith('<!', i):
+                    k = self.parse_declaration(i)
+                    if k < 0:
+                        break
+                    i = k
+                    continue
+            else:
+                if self.literal:
+                    data.append(u'&')
+                    i = i + 1
+                    continue
+                match = charref.match(rawdata, i)
+                if match:
+                    data.append(u'&#%s;' % match.group(1))
+                    i = match.end(0)
+                    if rawdata[i - 1] != ';':
+                        i = i - 1
+                    continue
+                match = entityref.match(rawdata, i)
+                if match:
+                    data.append(u'&%s;' % match.group(1))
+                    i = match.end(0)
+                    if rawdata[i - 1] != ';':
+                        i = i - 1
+                    continue
+            match = incomplete.match(rawdata, i)
+            if not match:
+                data.append(rawdata[i])
+                i = i + 1
+                continue
+            j = match.end(0)
+            if j == n:
+                break
+            data.append(rawdata[i:j])
+            i = j
+
+    def parse_starttag(self, i):
+        rawdata = self.rawdata
+        if shorttagopen.match(rawdata, i):
+            # <tag/data/ is SGML for <tag>data</tag>
+            match = shorttag.match(rawdata, i)
+            if not match:
+                return -1
+            tag, data = match.group(1, 2)
+            tag = tag.lower()
+            self.start_tag(tag, [])
+            self.data.append(data)
+            self.end_tag(tag)
+            return match.end(0)
+
+        match = endbracket.search(rawdata, i + 1)
+        if not match:
+            return -1
+        j = match.start(0)
+        if rawdata[i:i + 2] == '<>':
+            k = j
+            tag = self.lasttag
+        else:
+            k = tagfind.match(rawdata, i + 1).end(0)
+            tag = rawdata[i + 1:k].lower()
+            self.lasttag = tag
+
+        attrs = []
+        # Attributes of hidden tags are never shown, don't parse them.
+        if tag in self.attributes or self.quote_stack:
+            while k < j:
+                match = attrfind.match(rawdata, k)
+                if not match:
+                    break
+                attrname, rest, attrvalue = match.group(1, 2, 3)
+                if not rest:
+                    attrvalue = attrname
+                else:
+                    if attrvalue[:1] == "'" == attrvalue[-1:] or \
+                        attrvalue[:1] == '"' == attrvalue[-1:]:
+                        attrvalue = attrvalue[1:-1]
+                    attrvalue = entity_or_charref.sub(_convert_ref, attrvalue)
+                attrs.append((attrname.lower(), attrvalue))
+                k = match.end(0)
+        if rawdata[j] == '>':
+            j = j + 1
+        self.start_tag(tag, attrs)
+        return j
+
+    def parse_endtag(self, i):
+        rawdata = self.rawdata
+        match = endbracket.search(rawdata, i + 1)
+        if not match:
+            return -1
+        j = match.start(0)
+        tag = rawdata[i + 2:j].strip().lower()
+        if rawdata[j] == '>':
+            j = j + 1
+        self.end_tag(tag)
+        return j
+
+    def parse_declaration(self, i):
+        rawdata = self.rawdata
+        if rawdata.startswith('<![CDATA[', i):
+            k = rawdata.find(']]>', i)
+            self.flush()
+            if k == -1:
+                return len(rawdata)
+            return k + 3
+        if rawdata[i + 2:i + 3] == '>':
+            return i + 3
+        if rawdata[i + 2:i + 3] in ('-', ''):
+            return -1
+        match = declaration_close.search(rawdata, i + 2)
+        if not match:
+            return -1
+        self.flush()
+        return match.end(0)
+
+    def start_tag(self, name, attrs):
+        if self.quote_stack:
+            # Not a real tag inside <script> or <textarea>.
+            self.data.append(u'<%s%s>' % (name,
+                u''.join([u' %s="%s"' % attr for attr in attrs])))
+            return
+        self.flush()
+        self_closing = name in SELF_CLOSING_TAGS
+        if not self_closing:
+            self.smart_pop(name)
+
+        allowed = self.attributes.get(name)
+        if allowed is not None:
+            attrs = [_render_attribute(attr, value) for attr, value in attrs
+                if attr in allowed]
+            if attrs:
+                attrs = u' ' + u' '.join(attrs)
+            else:
+                attrs = u''
+            if self_closing:
+                self.out.append(u'<%s%s />' % (name, attrs))
+            else:
+                self.out.append(u'<%s%s>' % (name, attrs))
+        if not self_closing:
+            self.stack.append((name, allowed is not None))
+        if name in QUOTE_TAGS:
+            self.quote_stack.append(name)
+            self.literal = True
+
+    def end_tag(self, name):
+        if self.quote_stack and self.quote_stack[-1] != name:
+            # Not a real end tag inside <script> or <textarea>.
+            self.data.append(u'</%s>' % name)
+            return
+        self.flush()
+        self.pop_to(name)
+        if self.quote_stack and self.quote_stack[-1] == name:
+            self.quote_stack.pop()
+            self.literal = bool(self.quote_stack)
+
+    def smart_pop(self, name):
+        """
+        Closes the open tags a new name tag implicitly closes.  A tag that
+        can't nest closes the open one of the same name, a tag that can nest
+        closes up to the nearest tag that resets its nesting.
+        """
+        reset_triggers = NESTABLE_TAGS.get(name)
+        is_nestable = reset_triggers is not None
+        is_reset_nesting = name in RESET_NESTING_TAGS
+        for i in xrange(len(self.stack) - 1, -1, -1):
+            parent = self.stack[i][0]
+            if parent == name and not is_nestable:
+                self.pop_to(name)
+                return
+            if (reset_triggers is not None and parent in reset_triggers) or \
+                (reset_triggers is None and is_reset_nesting and
+                parent in RESET_NESTING_TAGS):
+                self.pop_to(parent, False)
+                return
+
+    def pop_to(self, name, inclusive=True):
+        """Closes the innermost open name tag and every tag inside it."""
+        if name == ROOT_TAG_NAME:
+            return
+        pops = 0
+        for i in xrange(len(self.stack) - 1, -1, -1):
+            if self.stack[i][0] == name:
+                pops = len(self.stack) - i
+                break
+        if not inclusive:
+            pops = pops - 1
+        for i in xrange(pops):
+            self.pop()
+
+    def pop(self):
+        name, shown = self.stack.pop()
+        if shown:
+            self.out.append(u'</%s>' % name)
+
+    def flush(self):
+        """Writes out the text seen since the last tag."""
+        if not self.data:
+            return
+        data = u''.join(self.data)
+        del self.data[:]
+        if not data.strip(ASCII_SPACES):
+            for name, shown in self.stack:
+                if name in PRESERVE_WHITESPACE_TAGS:
+                    break
+            else:
+                if u'\n' in data:
+                    data = u'\n'
+                else:
+                    data = u' '
+        self.out.append(bare_ampersand_or_bracket.sub(_escape, data))
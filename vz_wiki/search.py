@@ -0,0 +1,216 @@
+"""
+Built-in full-text search, for when there's no Haystack backend to run.
+
+Each page's title, tags and current revision body are tokenized when a
+revision is published and stored as an inverted index: a SearchTerm row per
+distinct word, and a SearchPosting row per word and page holding one integer
+weight, title words counting TITLE_WEIGHT times, tag words TAGS_WEIGHT times
+and body words once each, up to BODY_CAP.
+
+A query finds the pages holding every one of its words with a single
+grouped query over the postings of those words only, restricted to the pages
+holding the rarest of them, and ranks them by weight times how rare each
+word is across the wiki, from pagination's cached count of pages.  Words
+shorter than MIN_LENGTH and STOP_WORDS aren't indexed, since they'd match
+most pages.
+"""
+import math
+import re
+
+from django.db import connection, IntegrityError, transaction
+from django.db.models import F
+from django.utils.encoding import force_unicode
+from django.utils.html import escape
+
+import pagination
+
+TITLE_WEIGHT = 10
+TAGS_WEIGHT = 5
+BODY_CAP = 20
+MIN_LENGTH = 2
+MAX_LENGTH = 64
+STOP_WORDS = frozenset("""a an and are as at be but by for from has have he
+    her his i if in into is it its not of on or she so that the their then
+    there these they this to was we were which will with you your""".split())
+SNIPPET_LENGTH = 200
+RESULTS_PER_PAGE = 20
+
+word_pattern = re.compile(r'\w+', re.UNICODE)
+markup_pattern = re.compile(r'<[^>]*>')
+
+
+def tokenize(text):
+    """The indexable words in text, lower cased, in order."""
+    text = markup_pattern.sub(' ', force_unicode(text)).lower()
+    return [word for word in word_pattern.findall(text)
+        if MIN_LENGTH <= len(word) <= MAX_LENGTH and word not in STOP_WORDS]
+
+
+def page_weights(title, tags, body):
+    """The weight of every word of a page, tags being a list of tag names."""
+    weights = {}
+    for word in tokenize(title):
+        weights[word] = weights.get(word, 0) + TITLE_WEIGHT
+    for word in tokenize(u' '.join(tags)):
+        weights[word] = weights.get(word, 0) + TAGS_WEIGHT
+    counts = {}
+    for word in tokenize(body):
+        counts[word] = counts.get(word, 0) + 1
+    for word, count in counts.iteritems():
+        weights[word] = weights.get(word, 0) + min(count, BODY_CAP)
+    return weights
+
+
+def term_ids(words, create=False):
+    """Maps words to their SearchTerm ids, adding the missing ones if
+    create."""
+    from models import SearchTerm
+    ids = dict(SearchTerm.objects.filter(term__in=list(words))
+        .values_list('term', 'pk'))
+    if create:
+        for word in words:
+            if word in ids:
+                continue
+            sid = transaction.savepoint()
+            try:
+                ids[word] = SearchTerm.objects.create(term=word).pk
+                transaction.savepoint_commit(sid)
+            except IntegrityError:
+                # Added concurrently by somebody else.
+                transaction.savepoint_rollback(sid)
+                ids[word] = SearchTerm.objects.get(term=word).pk
+    return ids
+
+
+def index_page(page, body):
+    """
+    Makes the page's postings those of its title, tags and body, touching
+    only the ones that changed.
+    """
+    from models import SearchPosting, SearchTerm
+    from tagging.models import Tag
+    tags = [tag.name for tag in Tag.objects.get_for_object(page)]
+    weights = page_weights(page.title, tags, body)
+    ids = term_ids(weights.keys(), create=True)
+    new = dict((ids[word], weight) for word, weight in weights.iteritems())
+    old = dict(SearchPosting.objects.filter(page=page)
+        .values_list('term', 'weight'))
+
+    removed = [term for term in old if term not in new]
+    if removed:
+        SearchPosting.objects.filter(page=page, term__in=removed).delete()
+        SearchTerm.objects.filter(pk__in=removed).update(
+            document_count=F('document_count') - 1)
+    added = [term for term in new if term not in old]
+    for term in added:
+        SearchPosting.objects.create(term_id=term, page=page,
+            weight=new[term])
+    if added:
+        SearchTerm.objects.filter(pk__in=added).update(
+            document_count=F('document_count') + 1)
+    for term, weight in new.iteritems():
+        if term in old and old[term] != weight:
+            SearchPosting.objects.filter(page=page, term=term).update(
+                weight=weight)
+
+
+def unindex_page(page):
+    """Drops a page from the document counts of its words."""
+    from models import SearchPosting, SearchTerm
+    SearchTerm.objects.filter(postings__page=page).update(
+        document_count=F('document_count') - 1)
+    SearchPosting.objects.filter(page=page).delete()
+
+
+def search(query, offset=0, limit=RESULTS_PER_PAGE):
+    """
+    Pages matching every word of query, best first, as a list of
+    (page, score) pairs, and the total number of matches.
+    """
+    from models import SearchPosting, SearchTerm, WikiPage
+    words = set(tokenize(query))
+    if not words:
+        return [], 0
+    terms = term_ids(words)
+    if len(terms) < len(words):
+        return [], 0
+
+    pages = pagination.page_count()
+    counts = dict(SearchTerm.objects.filter(pk__in=terms.values())
+        .values_list('pk', 'document_count'))
+    idf = dict((pk, math.log(float(pages + 1) / (count + 1)) + 1)
+        for pk, count in counts.iteritems())
+    # Only pages with the rarest word can match, start from those when
+    # that's a lot fewer.
+    rarest = min(counts, key=counts.get)
+    narrow = counts[rarest] * 4 < max(counts.values())
+
+    qn = connection.ops.quote_name
+    table = qn(SearchPosting._meta.db_table)
+    page_id = qn(SearchPosting._meta.get_field('page').column)
+    term_id = qn(SearchPosting._meta.get_field('term').column)
+    weight = qn(SearchPosting._meta.get_field('weight').column)
+    placeholders = ', '.join(['%s'] * len(idf))
+    cases = ' '.join(['WHEN %s THEN %s'] * len(idf))
+    where = 'FROM %s WHERE %s IN (%s)' % (table, term_id, placeholders)
+    params = idf.keys()
+    if narrow:
+        where += ' AND %s IN (SELECT %s FROM %s WHERE %s = %%s)' % (page_id,
+            page_id, table, term_id)
+        params.append(rarest)
+    where += ' GROUP BY %s HAVING COUNT(*) = %%s' % page_id
+    params.append(len(idf))
+
+    cursor = connection.cursor()
+    cursor.execute('SELECT COUNT(*) FROM (SELECT %s %s) matches' % (page_id,
+        where), params)
+    total = cursor.fetchone()[0]
+    if not total:
+        return [], 0
+    case_params = []
+    for pk, value in idf.iteritems():
+        case_params.extend([pk, value])
+    cursor.execute('SELECT %s, SUM(%s * CASE %s %s END) AS score %s '
+        'ORDER BY score DESC, %s LIMIT %%s OFFSET %%s' % (page_id, weight,
+        term_id, cases, where, page_id), case_params + params + [limit,
+        offset])
+    scores = cursor.fetchall()
+
+    found = WikiPage.objects.select_related('current_revision') \
+        .in_bulk([pk for pk, score in scores])
+    return [(found[pk], score) for pk, score in scores if pk in found], total
+
+
+def snippet(text, query, length=SNIPPET_LENGTH):
+    """
+    HTML for about length characters of text around the first word of
+    query found in it, with the query's words in bold.
+    """
+    text = markup_pattern.sub(' ', force_unicode(text))
+    words = set(tokenize(query))
+    if not words:
+        return escape(text[:length])
+    pattern = re.compile(r'\b(%s)\b' % '|'.join([re.escape(word)
+        for word in words]), re.IGNORECASE | re.UNICODE)
+    match = pattern.search(text)
+    start = 0
+    if match:
+        start = max(0, match.start() - length / 4)
+        # Start on a word.
+        space = text.rfind(u' ', 0, start)
+        if start and space != -1 and start - space < 20:
+            start = space + 1
+    excerpt = text[start:start + length]
+    html = []
+    last = 0
+    for match in pattern.finditer(excerpt):
+        html.append(escape(excerpt[last:match.start()]))
+        html.append(u'<b>%s</b>' % escape(match.group(0)))
+        last = match.end()
+    html.append(escape(excerpt[last:]))
+    html = u''.join(html)
+    if start > 0:
+        html = u'&hellip;' + html
+    if start + length < len(text):
+        html = html + u'&hellip;'
+    return html
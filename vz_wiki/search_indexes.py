@@ -1,6 +1,9 @@
+from django.db.models.signals import post_delete, post_save
 from haystack import indexes, site
 
 from models import WikiPage, Revision
+from signals import revision_published
+import reindex
 
 class WikiPageIndex(indexes.SearchIndex):
     title = indexes.CharField(model_attr='title')
@@ -12,11 +15,16 @@ class WikiPageIndex(indexes.SearchIndex):
     last_edited_on = indexes.DateTimeField()
     rendered = indexes.CharField(use_template=True, indexed=False)
 
+    def get_queryset(self):
+        return WikiPage.objects.select_related('current_revision')
+
     def prepare(self, object):
         self.prepared_data = super(WikiPageIndex, self).prepare(object)
 
         self.prepared_data['url'] = object.get_absolute_url()
 
+        # No query when the page came from get_queryset or
+        # reindex.load_pages.
         revision = object.latest_revision()
 
         self.prepared_data['latest_revision_number'] = revision.number
@@ -25,4 +33,16 @@ class WikiPageIndex(indexes.SearchIndex):
 
         return self.prepared_data
 
-site.register(WikiPage, WikiPageIndex)
\ No newline at end of file
+site.register(WikiPage, WikiPageIndex)
+
+
+def queue_published_page(sender, revision, **kwargs):
+    reindex.queue_page(revision.page_id)
+
+
+def queue_saved_page(sender, instance, **kwargs):
+    reindex.queue_page(instance.pk)
+
+revision_published.connect(queue_published_page, sender=Revision)
+post_save.connect(queue_saved_page, sender=WikiPage)
+post_delete.connect(queue_saved_page, sender=WikiPage)
@@ -0,0 +1,4 @@
+from django.dispatch import Signal
+
+# Sent once a Revision has been published and its page points at it.
+revision_published = Signal(providing_args=['revision'])
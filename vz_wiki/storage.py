@@ -0,0 +1,65 @@
+"""
+Revision body storage.
+
+With the default ``WIKI_REVISION_STORAGE = 'full'`` every Revision keeps a full
+copy of its text.  With ``'delta'`` a published Revision only keeps a
+diff_match_patch delta against the Revision published before it, and every
+``WIKI_REVISION_KEYFRAME_INTERVAL`` revisions a full copy (a keyframe) is
+stored so rebuilding any text never replays more than interval - 1 deltas.
+
+Unpublished revisions are always stored in full.
+"""
+from django.conf import settings
+
+from utils.diff_match_patch import diff_match_patch
+
+FULL = 'full'
+DELTA = 'delta'
+
+
+def storage_mode():
+    return getattr(settings, 'WIKI_REVISION_STORAGE', FULL)
+
+
+def keyframe_interval():
+    return max(1, int(getattr(settings, 'WIKI_REVISION_KEYFRAME_INTERVAL',
+        10)))
+
+
+def is_keyframe_number(number):
+    """Revisions 1, 1 + N, 1 + 2N, ... are stored in full."""
+    return (number - 1) % keyframe_interval() == 0
+
+
+def last_keyframe_number(number):
+    """The number of the keyframe a revision's delta chain starts at."""
+    return number - (number - 1) % keyframe_interval()
+
+
+def make_delta(text1, text2):
+    """Returns a delta turning text1 into text2."""
+    dmp = diff_match_patch()
+    dmp.Diff_LinearSpace = True
+    diffs = dmp.diff_main(text1, text2)
+    dmp.diff_cleanupEfficiency(diffs)
+    return dmp.diff_toDelta(diffs)
+
+
+def apply_delta(text1, delta):
+    """Rebuilds the text a delta made from text1 describes."""
+    dmp = diff_match_patch()
+    return dmp.diff_text2(dmp.diff_fromDelta(text1, delta))
+
+
+def rebuild(chain):
+    """
+    chain is a list of (content, is_delta) pairs, oldest first, starting at a
+    keyframe.  Returns the text of the last element.
+    """
+    text = None
+    for content, is_delta in chain:
+        if is_delta:
+            text = apply_delta(text, content)
+        else:
+            text = content
+    return text
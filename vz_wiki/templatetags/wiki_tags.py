@@ -1,68 +1,73 @@
 from django.conf import settings
 from django import template
 from django.template.defaultfilters import stringfilter
+from django.utils.safestring import mark_safe
 
-from BeautifulSoup import BeautifulSoup, Comment
-
-import re
-
-wiki_link_pattern = re.compile('\[\[([^\]]+)\]\]')
-white_space_pattern = re.compile('[^\w]+')
+from vz_wiki import metrics
+from vz_wiki.links import existing_slugs, link_slug, linked_slugs, \
+    wiki_link_pattern
+from vz_wiki.sanitizer import get_policy
 
 register = template.Library()
 
 
 @register.filter
 @stringfilter
+@metrics.timed('wiki_link')
 def wiki_link(text):
     """
     Search text for [[link_me]], replace with
     <a href="WIKI_BASE/link_me">link_me</a>
+
+    Links to pages that don't exist yet get class="missing".  All the linked
+    pages are looked up at once.
     """
-    return wiki_link_pattern.sub(get_link, text)
+    existing = existing_slugs(linked_slugs(text))
+    base = getattr(settings, 'WIKI_BASE', 'wiki')
+    return wiki_link_pattern.sub(
+        lambda match_obj: get_link(match_obj, base, existing), text)
 
 wiki_link.is_safe = True
 
 
-def get_link(match_obj):
+def get_link(match_obj, base, existing):
     """
     Creates link text
     """
-    text = match_obj.group(0)[2:-2]
-    slug = white_space_pattern.sub('-', text.lower())
-    WIKI_BASE = getattr(settings, 'WIKI_BASE', 'wiki')
-    return u'<a href="%s/%s" title="%s">%s</a>' % (WIKI_BASE, slug, text, text)
+    text = match_obj.group(1)
+    slug = link_slug(text)
+    if slug in existing:
+        return u'<a href="%s/%s" title="%s">%s</a>' % (base, slug, text, text)
+    return u'<a href="%s/%s" class="missing" title="%s (page does not exist)">' \
+        u'%s</a>' % (base, slug, text, text)
 
 
 @register.filter
+def rendered(revision):
+    """
+    HTML for a published revision, the stored equivalent of
+    {{ revision.body|sanitize|wiki_link|markdown }}.
+    """
+    from vz_wiki.rendering import rendered_html
+    return mark_safe(rendered_html(revision))
+
+rendered.is_safe = True
+
+
+@register.filter
+@metrics.timed('sanitize')
 def sanitize(value, allowed_tags=None):
     """
     Jacked from: http://www.djangosnippets.org/snippets/1655/
 
     Argument should be in form 'tag2:attr1:attr2 tag2:attr1 tag3', where tags
     are allowed HTML tags, and attrs are the allowed attributes for that tag.
-    """
-    js_regex = re.compile(r'[\s]*(&#x.{1,7})?'.join(list('javascript')))
 
+    The work is done by the streaming sanitizer in vz_wiki.sanitizer.
+    """
     WIKI_ALLOWED_TAGS = getattr(settings, 'WIKI_ALLOWED_TAGS', '')
     if allowed_tags is None:
         allowed_tags = WIKI_ALLOWED_TAGS
     else:
         allowed_tags = '%s %s'%(allowed_tags, WIKI_ALLOWED_TAGS)
-
-    allowed_tags = [tag.split(':') for tag in allowed_tags.split()]
-    allowed_tags = dict((tag[0], tag[1:]) for tag in allowed_tags)
-
-    soup = BeautifulSoup(value)
-    for comment in soup.findAll(text=lambda text: isinstance(text, Comment)):
-        comment.extract()
-
-    for tag in soup.findAll(True):
-        if tag.name not in allowed_tags:
-            tag.hidden = True
-        else:
-            tag.attrs = [(attr, js_regex.sub('', val)) for attr, val \
-                in tag.attrs
-                         if attr in allowed_tags[tag.name]]
-
-    return soup.renderContents().decode('utf8')
+    return get_policy(allowed_tags).sanitize(value)
@@ -0,0 +1,102 @@
+"""
+Query budgets, for the tests of vz_wiki and of projects using it.
+
+queries calls a view, or anything else, and counts the queries it made.
+statements gives the SQL of those queries instead, and own_queries counts
+them less the ones any request that looks at the user makes, for the
+session and the user.  check_budgets compares the counts made on wikis of
+different sizes with the most queries each may make, and finds the ones
+that make more queries as the wiki grows, which is how an N+1 query shows.
+"""
+
+
+def queries(func, *args, **kwargs):
+    """Calls func, returns what it returned and the queries it made."""
+    from vz_wiki import metrics
+    metrics.count_queries()
+    before = metrics.query_count()
+    result = func(*args, **kwargs)
+    return result, metrics.query_count() - before
+
+
+class RecordingCursor(object):
+    """Records the SQL run through a database cursor, without parameters."""
+
+    def __init__(self, cursor, statements):
+        self.cursor = cursor
+        self.statements = statements
+
+    def execute(self, sql, *args, **kwargs):
+        self.statements.append(sql)
+        return self.cursor.execute(sql, *args, **kwargs)
+
+    def executemany(self, sql, *args, **kwargs):
+        self.statements.append(sql)
+        return self.cursor.executemany(sql, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+
+def statements(func, *args, **kwargs):
+    """
+    Calls func, returns what it returned and the SQL of the queries it
+    made, in order.
+    """
+    from django.db import connection
+    made = []
+    cursor = connection.cursor
+
+    def recording_cursor():
+        return RecordingCursor(cursor(), made)
+    connection.cursor = recording_cursor
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        connection.cursor = cursor
+    return result, made
+
+
+def own_queries(made, baseline):
+    """
+    The number of statements of made, the SQL of a request, less those of
+    baseline, the SQL of a request that did nothing but look at the user,
+    if made looked at the user too, which starts with baseline's first
+    statement, for the session.  The statements aren't matched up one by
+    one: a view's own lookup of a user has the same SQL as the request's.
+    """
+    if baseline and baseline[0] in made:
+        return len(made) - len(baseline)
+    return len(made)
+
+
+def check_budgets(counts, budgets):
+    """
+    Checks counts, a dictionary of the queries each name made, by the size
+    of the wiki they were made on, against budgets, the most queries each
+    name may make.  Returns a list of problems: names without a budget,
+    over their budget, or making more queries on a larger wiki than on a
+    smaller one.
+    """
+    problems = []
+    sizes = sorted(counts)
+    names = set()
+    for size in sizes:
+        names.update(counts[size])
+    for name in sorted(names - set(budgets)):
+        problems.append('%s has no query budget.' % name)
+    for size in sizes:
+        for name, made in sorted(counts[size].items()):
+            if name in budgets and made > budgets[name]:
+                problems.append('%s made %s queries on %s pages, its budget '
+                    'is %s.' % (name, made, size, budgets[name]))
+    for smaller, larger in zip(sizes, sizes[1:]):
+        for name, made in sorted(counts[larger].items()):
+            fewer = counts[smaller].get(name)
+            if fewer is not None and made > fewer:
+                problems.append('%s made %s queries on %s pages, and %s on '
+                    '%s pages.' % (name, fewer, smaller, made, larger))
+    return problems
@@ -1,7 +1,11 @@
+import datetime
 import unittest
 import random
+import threading
+from django.conf import settings
+from django.conf.urls.defaults import include, patterns
 from django.contrib.auth.models import User
-from vz_wiki.models import WikPage, Revision
+from vz_wiki.models import WikiPage, Revision
 from vz_wiki.exceptions import *
 
 TEST_SIZE = 50
@@ -17,10 +21,14 @@ class WikiTestCase(unittest.TestCase):
             email='wiki_user@localhost')
         self.pages = []
         for x in range(TEST_SIZE):
-            self.pages.append(WikPage.objects.create(
+            self.pages.append(WikiPage.objects.create(
                 title=u'test page number %s'%x,
                 slug=u'test-page-number-%s'%x, tags='test', creator=self.user))
 
+    def tearDown(self):
+        WikiPage.objects.all().delete()
+        User.objects.all().delete()
+
     def testWiki(self):
         for y in range(TEST_SIZE/2):
             page1 = random.choice(self.pages)
@@ -34,6 +42,1562 @@ class WikiTestCase(unittest.TestCase):
                     revivsion.publish)
                 page1.check_in()
             page1.check_out(user=self.user2)
-            self.failUnlessRaises(WikPageAlreadyCheckedOut,
+            self.failUnlessRaises(WikiPageAlreadyCheckedOut,
                 page1.check_out, self.user)
             page2 = random.choice(self.pages)
+
+
+class RevisionStorageTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = getattr(settings, 'WIKI_REVISION_STORAGE', 'full')
+        self.interval = getattr(settings, 'WIKI_REVISION_KEYFRAME_INTERVAL',
+            10)
+        settings.WIKI_REVISION_STORAGE = 'delta'
+        settings.WIKI_REVISION_KEYFRAME_INTERVAL = 4
+        self.user = User.objects.create(username='wiki_admin',
+            email='wiki_admin@localhost')
+        self.page = WikiPage.objects.create(title=u'delta page',
+            slug=u'delta-page', creator=self.user)
+
+    def tearDown(self):
+        settings.WIKI_REVISION_STORAGE = self.storage
+        settings.WIKI_REVISION_KEYFRAME_INTERVAL = self.interval
+        WikiPage.objects.all().delete()
+        User.objects.all().delete()
+
+    def publish(self, body):
+        revision = self.page.check_out(user=self.user)
+        revision.body = body
+        revision.publish()
+        self.page = WikiPage.objects.get(pk=self.page.pk)
+
+    def testDeltaRoundTrip(self):
+        line = u'Line %s of a fairly long wiki page about caf\xe9s.\n'
+        bodies = [u''.join([line % x for x in range(40)])]
+        for x in range(10):
+            bodies.append(bodies[-1].replace(u'Line %s ' % x, u'Row %s ' % x))
+        for body in bodies:
+            self.publish(body)
+
+        revisions = Revision.objects.filter(page=self.page,
+            is_published=True).order_by('number')
+        self.assertEqual(12, revisions.count())
+        for revision in revisions:
+            if revision.number > 2:
+                self.assertEqual(revision.number % 4 != 1, revision.is_delta)
+                self.assertEqual(bodies[revision.number - 2], revision.body)
+
+        # The draft made on check out is a full copy of the latest text.
+        draft = self.page.check_out(user=self.user)
+        self.assertEqual(bodies[-1], draft.content)
+        self.assertFalse(draft.is_delta)
+
+    def testSearchQueries(self):
+        from django.contrib.auth.models import AnonymousUser
+        from django.http import HttpRequest
+        from vz_wiki import views
+        from vz_wiki.testing import queries
+        for x in range(6):
+            self.publish(u'apples and pears, take %s' % x)
+        request = HttpRequest()
+        request.user = AnonymousUser()
+        request.GET = {'q': u'apples'}
+        urlconf = settings.ROOT_URLCONF
+        settings.ROOT_URLCONF = 'vz_wiki.urls'
+        try:
+            made = []
+            for x in range(3):
+                page = WikiPage.objects.create(title=u'apples %s' % x,
+                    slug=u'apples-%s' % x, creator=self.user)
+                for y in range(6):
+                    revision = page.check_out(user=self.user)
+                    revision.body = u'apples, take %s' % y
+                    revision.publish()
+                made.append(queries(views.search_pages, request)[1])
+        finally:
+            settings.ROOT_URLCONF = urlconf
+        self.assertEqual(made[:1] * 3, made)
+
+    def testPrefetchBodies(self):
+        from django.db import connection
+        from vz_wiki.models import prefetch_bodies
+        bodies = [u'apples and pears\n' * 30 + u'%s' % x for x in range(6)]
+        for body in bodies:
+            self.publish(body)
+        self.page = WikiPage.objects.create(title=u'other delta page',
+            slug=u'other-delta-page', creator=self.user)
+        for body in bodies[:3]:
+            self.publish(body + u'!')
+
+        revisions = list(Revision.objects.filter(is_published=True,
+            number__gt=1).order_by('page', 'number'))
+        self.assertTrue([r for r in revisions if r.is_delta])
+        debug = settings.DEBUG
+        settings.DEBUG = True
+        connection.queries = []
+        try:
+            prefetch_bodies(revisions)
+            self.assertEqual(1, len(connection.queries))
+        finally:
+            settings.DEBUG = debug
+        for revision in revisions:
+            expected = bodies[revision.number - 2]
+            if revision.page_id == self.page.pk:
+                expected += u'!'
+            self.assertEqual(expected, revision.body)
+
+        # Many windows are split over several queries.
+        from vz_wiki import models
+        revisions = list(Revision.objects.filter(is_published=True,
+            number__gt=1).order_by('page', 'number'))
+        deltas = len([r for r in revisions if r.is_delta])
+        windows, models.PREFETCH_WINDOWS = models.PREFETCH_WINDOWS, 2
+        settings.DEBUG = True
+        connection.queries = []
+        try:
+            prefetch_bodies(revisions)
+            self.assertEqual((deltas + 1) / 2, len(connection.queries))
+        finally:
+            settings.DEBUG = debug
+            models.PREFETCH_WINDOWS = windows
+        self.assertEqual([bodies[r.number - 2] + (r.page_id == self.page.pk
+            and u'!' or u'') for r in revisions], [r.body for r in revisions])
+
+    def testCompressCommand(self):
+        from django.core.management import call_command
+        settings.WIKI_REVISION_STORAGE = 'full'
+        bodies = [u'apples and pears\n' * 30 + u'%s' % x for x in range(6)]
+        for body in bodies:
+            self.publish(body)
+        self.assertEqual(0, Revision.objects.filter(is_delta=True).count())
+
+        # Revision 2 replaces the whole first body, so only 3, 4, 6 and 7
+        # are worth storing as deltas.
+        settings.WIKI_REVISION_STORAGE = 'delta'
+        call_command('compress_revisions', verbosity=0)
+        self.assertEqual(4, Revision.objects.filter(is_delta=True).count())
+        for revision in Revision.objects.filter(number__gt=1):
+            self.assertEqual(bodies[revision.number - 2], revision.body)
+
+        call_command('compress_revisions', full=True, verbosity=0)
+        self.assertEqual(0, Revision.objects.filter(is_delta=True).count())
+        for revision in Revision.objects.filter(number__gt=1):
+            self.assertEqual(bodies[revision.number - 2], revision.content)
+
+
+class CurrentRevisionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='wiki_admin',
+            email='wiki_admin@localhost')
+        self.page = WikiPage.objects.create(title=u'current page',
+            slug=u'current-page', creator=self.user)
+
+    def tearDown(self):
+        WikiPage.objects.all().delete()
+        User.objects.all().delete()
+
+    def testPublishUpdatesPointer(self):
+        self.assertEqual(1, self.page.revision_count)
+        first = self.page.current_revision
+        self.assertEqual(1, first.number)
+
+        revision = self.page.check_out(user=self.user)
+        revision.body = u'second'
+        revision.publish()
+
+        page = WikiPage.objects.select_related('current_revision').get(
+            pk=self.page.pk)
+        self.assertEqual(2, page.count_revisions())
+        self.assertEqual(revision.pk, page.current_revision_id)
+        self.assertFalse(page.is_checked_out)
+
+        # A stale instance must not roll the pointer back.
+        self.page.is_editable = False
+        self.page.save()
+        page = WikiPage.objects.get(pk=self.page.pk)
+        self.assertEqual(revision.pk, page.current_revision_id)
+        self.assertEqual(2, page.revision_count)
+
+        from django.db import connection
+        debug, settings.DEBUG = settings.DEBUG, True
+        connection.queries = []
+        try:
+            self.assertEqual(u'second', page.latest_revision().body)
+            page.latest_revision()
+            self.assertEqual(1, len(connection.queries))
+        finally:
+            settings.DEBUG = debug
+
+    def testBackfillCommand(self):
+        from django.core.management import call_command
+        WikiPage.objects.update(current_revision=None, revision_count=0)
+        call_command('backfill_current_revisions', verbosity=0)
+        page = WikiPage.objects.get(pk=self.page.pk)
+        self.assertEqual(1, page.revision_count)
+        self.assertEqual(1, page.latest_revision().number)
+
+
+class RevisionNumberingTestCase(unittest.TestCase):
+    THREADS = 8
+    PUBLISHES = 5
+
+    def setUp(self):
+        self.user = User.objects.create(username='wiki_admin',
+            email='wiki_admin@localhost')
+        self.page = WikiPage.objects.create(title=u'busy page',
+            slug=u'busy-page', creator=self.user)
+
+    def tearDown(self):
+        WikiPage.objects.all().delete()
+        User.objects.all().delete()
+
+    def testNumbering(self):
+        for x in range(3):
+            revision = Revision(page=self.page, author=self.user,
+                body=u'body %s' % x)
+            revision.publish(check_in_page=False)
+            self.assertEqual(x + 2, revision.number)
+        page = WikiPage.objects.get(pk=self.page.pk)
+        self.assertEqual(4, page.revision_count)
+        self.assertEqual(4, page.latest_revision().number)
+
+    def testAllocateRevisionNumber(self):
+        from vz_wiki.models import allocate_revision_number
+        first = WikiPage.objects.get(pk=self.page.pk).revision_count
+        numbers = [allocate_revision_number(self.page.pk) for x in range(5)]
+        self.assertEqual(range(first + 1, first + 6), numbers)
+        self.assertEqual(first + 5,
+            WikiPage.objects.get(pk=self.page.pk).revision_count)
+
+    def testConcurrentPublish(self):
+        """
+        Publishes from many threads at once.  Every thread has its own
+        connection, so this needs a database they can share: on SQLite, a
+        test database in a file (TEST_NAME, or TEST_DATABASE_NAME before
+        Django 1.2), where the threads take turns on its write lock.  It
+        does nothing on an in-memory one.
+        """
+        from django.db import connection
+        database = connection.settings_dict
+        engine = database.get('ENGINE', settings.DATABASE_ENGINE)
+        test_name = database.get('TEST_NAME', settings.TEST_DATABASE_NAME)
+        if engine.endswith('sqlite3') and test_name in (None, '',
+            ':memory:'):
+            return
+        errors = []
+
+        def publish_many(thread):
+            try:
+                try:
+                    for x in range(self.PUBLISHES):
+                        Revision(page_id=self.page.pk, author=self.user,
+                            body=u'%s-%s' % (thread, x)).publish(
+                            check_in_page=False)
+                except Exception, e:
+                    errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=publish_many, args=(x, ))
+            for x in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([], errors)
+        total = self.THREADS * self.PUBLISHES + 1
+        numbers = Revision.objects.filter(page=self.page).order_by('number') \
+            .values_list('number', flat=True)
+        self.assertEqual(range(1, total + 1), list(numbers))
+        page = WikiPage.objects.get(pk=self.page.pk)
+        self.assertEqual(total, page.revision_count)
+        self.assertEqual(total, page.latest_revision().number)
+
+
+class CheckOutLockTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='wiki_admin',
+            email='wiki_admin@localhost')
+        self.user2 = User.objects.create(username='wiki_user',
+            email='wiki_user@localhost')
+        self.page = WikiPage.objects.create(title=u'locked page',
+            slug=u'locked-page', creator=self.user)
+
+    def tearDown(self):
+        WikiPage.objects.all().delete()
+        User.objects.all().delete()
+
+    def testCompareAndSet(self):
+        from django.db import connection
+        from vz_wiki import locks
+        # Two stale copies of the same page race for the lock.
+        page_a = WikiPage.objects.get(pk=self.page.pk)
+        page_b = WikiPage.objects.get(pk=self.page.pk)
+
+        debug, settings.DEBUG = settings.DEBUG, True
+        connection.queries = []
+        try:
+            self.assertTrue(locks.acquire(page_a, self.user))
+            self.assertEqual(1, len(connection.queries))
+            self.assertFalse(locks.acquire(page_b, self.user2))
+            self.assertEqual(2, len(connection.queries))
+        finally:
+            settings.DEBUG = debug
+
+        self.assertTrue(page_a.is_locked())
+        self.assertTrue(locks.is_locked_by_id(self.page.pk))
+        self.assertTrue(locks.renew(page_a, self.user))
+        self.assertFalse(locks.renew(page_b, self.user2))
+        self.assertFalse(locks.release(page_b, self.user2))
+        self.assertTrue(locks.release(page_a, self.user))
+        self.assertFalse(locks.is_locked_by_id(self.page.pk))
+
+    def testCheckOut(self):
+        page = WikiPage.objects.get(pk=self.page.pk)
+        page.check_out(user=self.user)
+        self.assertEqual(self.user, page.who_checked_out())
+        self.failUnlessRaises(WikiPageAlreadyCheckedOut,
+            WikiPage.objects.get(pk=self.page.pk).check_out, self.user2)
+        self.failUnlessRaises(UnpublishedRevisionExists, page.check_in)
+
+        page.unpublished_revision().publish()
+        page = WikiPage.objects.get(pk=self.page.pk)
+        self.assertFalse(page.is_checked_out)
+        self.assertEqual(None, page.checked_out_by)
+        self.assertEqual(None, page.who_checked_out())
+
+    def testExpiredLease(self):
+        page = WikiPage.objects.get(pk=self.page.pk)
+        page.check_out(user=self.user)
+        WikiPage.objects.filter(pk=page.pk).update(
+            checked_out_until=datetime.datetime.now() -
+            datetime.timedelta(minutes=1))
+
+        page = WikiPage.objects.get(pk=self.page.pk)
+        self.assertFalse(page.is_locked())
+        self.assertEqual(None, page.who_checked_out())
+        draft = page.check_out(user=self.user2)
+        self.assertEqual(self.user2, page.who_checked_out())
+        self.assertEqual([draft.pk], list(Revision.objects.filter(page=page,
+            is_published=False).values_list('pk', flat=True)))
+
+    def testExpiredLeaseKeepsOwnDraft(self):
+        page = WikiPage.objects.get(pk=self.page.pk)
+        draft = page.check_out(user=self.user)
+        draft.body = u'my unsaved work'
+        draft.save()
+        WikiPage.objects.filter(pk=page.pk).update(
+            checked_out_until=datetime.datetime.now() -
+            datetime.timedelta(minutes=1))
+
+        page = WikiPage.objects.get(pk=self.page.pk)
+        self.assertEqual(draft.pk, page.check_out(user=self.user).pk)
+        self.assertEqual([u'my unsaved work'], [revision.body for revision
+            in Revision.objects.filter(page=page, is_published=False)])
+
+        # Somebody else's expired draft is still dropped.
+        WikiPage.objects.filter(pk=page.pk).update(
+            checked_out_until=datetime.datetime.now() -
+            datetime.timedelta(minutes=1))
+        page = WikiPage.objects.get(pk=self.page.pk)
+        draft2 = page.check_out(user=self.user2)
+        self.assertEqual([draft2.pk], list(Revision.objects.filter(page=page,
+            is_published=False).values_list('pk', flat=True)))
+        self.assertEqual(u'hello world!', draft2.body)
+
+    def testBulkCheckOutAndIn(self):
+        from django.db import connection
+        from vz_wiki import locks
+        for x in range(20):
+            WikiPage.objects.create(title=u'bulk page %s' % x,
+                slug=u'bulk-page-%s' % x, creator=self.user)
+        self.page.check_out(user=self.user2)
+        pages = WikiPage.objects.all()
+
+        debug, settings.DEBUG = settings.DEBUG, True
+        connection.queries = []
+        try:
+            self.assertEqual(20, locks.check_out_pages(pages, self.user))
+            queries = len(connection.queries)
+            self.assertTrue(queries <= 10)
+        finally:
+            settings.DEBUG = debug
+        self.assertEqual(0, locks.check_out_pages(pages, self.user))
+        page = WikiPage.objects.get(slug=u'bulk-page-3')
+        self.assertEqual(self.user, page.who_checked_out())
+        self.assertEqual(u'hello world!', page.unpublished_revision().body)
+        self.assertEqual(21, Revision.objects.filter(is_published=False)
+            .count())
+
+        # Finishing an edit works as usual on a bulk checked out page.
+        draft = page.unpublished_revision()
+        draft.body = u'edited'
+        draft.publish()
+        self.assertFalse(WikiPage.objects.get(pk=page.pk).is_checked_out)
+
+        self.assertEqual((20, 0, 20), locks.check_in_pages(
+            pages.exclude(pk=page.pk)))
+        self.assertEqual(0, Revision.objects.filter(is_published=False)
+            .count())
+        self.assertEqual(0, pages.filter(is_checked_out=True).count())
+
+        # Unchanged drafts aren't published.
+        locks.check_out_pages(pages, self.user)
+        Revision.objects.filter(page=page, is_published=False).update(
+            content=u'edited again')
+        self.assertEqual((21, 1, 20), locks.check_in_pages(pages,
+            publish=True))
+        self.assertEqual(3, WikiPage.objects.get(pk=page.pk).revision_count)
+        self.assertEqual(0, Revision.objects.filter(is_published=False)
+            .count())
+
+    def testBulkCheckOutKeepsOwnDraft(self):
+        from vz_wiki import locks
+        other = WikiPage.objects.create(title=u'other page',
+            slug=u'other-page', creator=self.user)
+        draft = self.page.check_out(user=self.user)
+        draft.body = u'my unsaved work'
+        draft.save()
+        WikiPage.objects.get(pk=other.pk).check_out(user=self.user2)
+        WikiPage.objects.all().update(checked_out_until=
+            datetime.datetime.now() - datetime.timedelta(minutes=1))
+
+        self.assertEqual(2, locks.check_out_pages(WikiPage.objects.all(),
+            self.user))
+        self.assertEqual([draft.pk], list(Revision.objects.filter(
+            page=self.page, is_published=False).values_list('pk', flat=True)))
+        self.assertEqual(u'my unsaved work',
+            Revision.objects.get(pk=draft.pk).body)
+        drafts = Revision.objects.filter(page=other, is_published=False)
+        self.assertEqual([self.user.pk], list(drafts.values_list('author',
+            flat=True)))
+
+    def testReaper(self):
+        from django.core.management import call_command
+        from vz_wiki import metrics, reaper
+        pages = [self.page]
+        for x in range(4):
+            pages.append(WikiPage.objects.create(title=u'reaped page %s' % x,
+                slug=u'reaped-page-%s' % x, creator=self.user))
+        for page in pages:
+            page.check_out(user=self.user)
+        expired = [page.pk for page in pages[:3]]
+        WikiPage.objects.filter(pk__in=expired).update(
+            checked_out_until=datetime.datetime.now() -
+            datetime.timedelta(minutes=1))
+        Revision.objects.filter(page=self.page, is_published=False).update(
+            content=u'left behind')
+
+        metrics.reset()
+        pages, published, abandoned, seconds = reaper.reap(publish=True,
+            batch_size=2)
+        self.assertEqual((3, 1, 2), (pages, published, abandoned))
+        self.assertEqual(2, WikiPage.objects.filter(is_checked_out=True)
+            .count())
+        self.assertEqual(2, Revision.objects.filter(is_published=False)
+            .count())
+        self.assertEqual(u'left behind', WikiPage.objects.get(
+            pk=self.page.pk).latest_revision().body)
+        snapshot = metrics.snapshot()
+        self.assertEqual(3, snapshot['counters']['reaper.pages'])
+        self.assertEqual(1, snapshot['timings']['reaper.run']['count'])
+
+        call_command('reap_checkouts', verbosity=0)
+        self.assertEqual(2, WikiPage.objects.filter(is_checked_out=True)
+            .count())
+        self.assertEqual(2, metrics.snapshot()['counters']['reaper.runs'])
+
+    def testReaperRace(self):
+        from vz_wiki import locks
+        self.page.check_out(user=self.user)
+        now = datetime.datetime.now()
+        WikiPage.objects.filter(pk=self.page.pk).update(
+            checked_out_until=now - datetime.timedelta(minutes=1))
+        pages = WikiPage.objects.filter(pk=self.page.pk)
+        # Read as expired, then taken over before the reaper checks it in.
+        draft = WikiPage.objects.get(pk=self.page.pk).check_out(
+            user=self.user2)
+        self.assertEqual((0, 0, 0), locks.check_in_pages(pages,
+            publish=True, expired_before=now))
+        page = WikiPage.objects.get(pk=self.page.pk)
+        self.assertEqual(self.user2, page.who_checked_out())
+        self.assertEqual(draft.pk, page.unpublished_revision().pk)
+
+        # Two reapers, only the first gets the page.
+        WikiPage.objects.filter(pk=self.page.pk).update(
+            checked_out_until=now - datetime.timedelta(minutes=1))
+        self.assertEqual((1, 0, 1), locks.check_in_pages(pages,
+            expired_before=now))
+        self.assertEqual((0, 0, 0), locks.check_in_pages(pages,
+            expired_before=now))
+
+    def testReapTakenOver(self):
+        from vz_wiki import locks, reaper
+        self.page.check_out(user=self.user)
+        WikiPage.objects.filter(pk=self.page.pk).update(
+            checked_out_until=datetime.datetime.now() -
+            datetime.timedelta(minutes=1))
+        check_in_pages = locks.check_in_pages
+        taken = []
+
+        def take_over_first(*args, **kwargs):
+            # Taken over between the reaper's SELECT and its claim.
+            taken.append(WikiPage.objects.get(pk=self.page.pk).check_out(
+                user=self.user2))
+            return check_in_pages(*args, **kwargs)
+        locks.check_in_pages = take_over_first
+        try:
+            self.assertEqual((0, 0, 0), reaper.reap(publish=True)[:3])
+        finally:
+            locks.check_in_pages = check_in_pages
+        page = WikiPage.objects.get(pk=self.page.pk)
+        self.assertEqual(self.user2, page.who_checked_out())
+        self.assertEqual(taken[0].pk, page.unpublished_revision().pk)
+
+    def testReaperMiddleware(self):
+        from django.core.exceptions import MiddlewareNotUsed
+        from vz_wiki import reaper
+        from vz_wiki.middleware import ReaperMiddleware
+        interval = getattr(settings, 'WIKI_REAPER_INTERVAL', None)
+        settings.WIKI_REAPER_INTERVAL = None
+        try:
+            self.assertRaises(MiddlewareNotUsed, ReaperMiddleware)
+        finally:
+            if interval is None:
+                del settings.WIKI_REAPER_INTERVAL
+            else:
+                settings.WIKI_REAPER_INTERVAL = interval
+        self.assertEqual(None, reaper._thread)
+
+
+class RenderCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.allowed_tags = getattr(settings, 'WIKI_ALLOWED_TAGS', '')
+        self.user = User.objects.create(username='wiki_admin',
+            email='wiki_admin@localhost')
+        self.page = WikiPage.objects.create(title=u'rendered page',
+            slug=u'rendered-page', creator=self.user)
+
+    def tearDown(self):
+        settings.WIKI_ALLOWED_TAGS = self.allowed_tags
+        WikiPage.objects.all().delete()
+        User.objects.all().delete()
+
+    def testRenderedOnPublish(self):
+        from vz_wiki.models import RenderedRevision
+        from vz_wiki.rendering import render_body
+        from vz_wiki.templatetags.wiki_tags import rendered
+        revision = self.page.check_out(user=self.user)
+        revision.body = u'# Title\n\nSee [[Other Page]] <b>now</b>'
+        revision.publish()
+
+        stored = RenderedRevision.objects.get(revision=revision)
+        self.assertEqual(render_body(revision.body), stored.html)
+        self.assertTrue(u'<h1>Title</h1>' in stored.html)
+        self.assertEqual(stored.html, rendered(revision))
+
+        # Changing the settings is a miss, rendered lazily.
+        settings.WIKI_ALLOWED_TAGS = 'b'
+        html = rendered(revision)
+        self.assertTrue(u'<b>now</b>' in html)
+        self.assertEqual(2, RenderedRevision.objects.filter(
+            revision=revision).count())
+
+    def testRenderCommand(self):
+        from django.core.management import call_command
+        from vz_wiki.models import RenderedRevision
+        RenderedRevision.objects.all().delete()
+        settings.WIKI_ALLOWED_TAGS = 'i'
+        call_command('render_revisions', verbosity=0)
+        self.assertEqual(1, RenderedRevision.objects.count())
+        call_command('render_revisions', verbosity=0)
+        self.assertEqual(1, RenderedRevision.objects.count())
+
+
+class DiffCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='wiki_admin',
+            email='wiki_admin@localhost')
+
+    def tearDown(self):
+        from vz_wiki.models import Comparison
+        WikiPage.objects.all().delete()
+        User.objects.all().delete()
+        Comparison.objects.all().delete()
+
+    def publish(self, page, body):
+        revision = page.check_out(user=self.user)
+        revision.body = body
+        revision.publish()
+        return revision
+
+    def testContentAddressed(self):
+        from vz_wiki.models import Comparison
+        page1 = WikiPage.objects.create(title=u'one', slug=u'one',
+            creator=self.user)
+        page2 = WikiPage.objects.create(title=u'two', slug=u'two',
+            creator=self.user)
+        old = page1.latest_revision()
+        new = self.publish(page1, u'goodbye world!')
+        copy = self.publish(page2, u'goodbye world!')
+
+        comparison = page1.compare(str(new.pk), str(old.pk))
+        self.assertEqual(old, comparison.rev1)
+        self.assertEqual(new, comparison.rev2)
+        self.assertTrue('goodbye' in comparison.diff_text)
+        self.assertEqual(comparison.pk, page1.compare(old.pk, new.pk).pk)
+        self.assertEqual(comparison.pk,
+            page2.compare(page2.history()[1].pk, copy.pk).pk)
+        self.assertEqual(1, Comparison.objects.count())
+
+        self.failUnlessRaises(ComparingSameRevision, page1.compare,
+            '%s' % old.pk, '0%s' % old.pk)
+        self.failUnlessRaises(RevisionDoesNotExist, page1.compare, old.pk,
+            copy.pk)
+        self.failUnlessRaises(RevisionDoesNotExist, page1.compare, old.pk,
+            'x')
+
+    def testPrune(self):
+        from vz_wiki import diffs
+        from vz_wiki.models import Comparison
+        for x in range(5):
+            diffs.get_comparison(u'text', u'text %s' % x)
+        Comparison.objects.filter(
+            digest=diffs.diff_digest(u'text', u'text 0')).update(
+            last_used_on=datetime.datetime.now() - datetime.timedelta(days=60))
+        self.assertEqual(1, diffs.prune(entries=10))
+        self.assertEqual(2, diffs.prune(entries=2))
+        self.assertEqual(2, Comparison.objects.count())
+
+    def testQueuedDiff(self):
+        from django.conf import settings
+        from vz_wiki import diffs
+        from vz_wiki.models import Comparison, DiffJob
+        page = WikiPage.objects.create(title=u'big', slug=u'big',
+            creator=self.user)
+        old = page.latest_revision()
+        new = self.publish(page, u'hello big world! ' * 10)
+
+        limit = getattr(settings, 'WIKI_DIFF_SYNC_LIMIT', None)
+        settings.WIKI_DIFF_SYNC_LIMIT = 10
+        try:
+            self.assertEqual(None, diffs.get_or_queue_comparison(old, new))
+            self.assertEqual(None, diffs.get_or_queue_comparison(old, new))
+        finally:
+            if limit is None:
+                del settings.WIKI_DIFF_SYNC_LIMIT
+            else:
+                settings.WIKI_DIFF_SYNC_LIMIT = limit
+        self.assertEqual(1, DiffJob.objects.count())
+        self.assertEqual(0, Comparison.objects.count())
+
+        job = diffs.claim_job()
+        self.assertEqual(DiffJob.RUNNING, job.status)
+        self.assertEqual(None, diffs.claim_job())
+        DiffJob.objects.update(started_on=datetime.datetime.now() -
+            datetime.timedelta(hours=1))
+        self.assertEqual(1, diffs.requeue_stale_jobs(limit=60))
+        job = diffs.claim_job()
+        diffs.run_job(job, limit=60)
+        self.assertEqual(0, DiffJob.objects.count())
+
+        comparison = diffs.get_or_queue_comparison(old, new)
+        self.assertEqual(diffs.diff_digest(old.body, new.body),
+            comparison.digest)
+        self.assertTrue('big' in comparison.diff_text)
+
+    def testTimeLimit(self):
+        from vz_wiki import diffs
+        self.assertEqual(diffs.compute_diff(u'abc', u'abd'),
+            diffs.compute_diff_limited(u'abc', u'abd', 60))
+        # Killed straight away, falls back to the inline diff.
+        self.assertEqual(diffs.compute_diff(u'abc', u'abd'),
+            diffs.compute_diff_limited(u'abc', u'abd', 0))
+
+
+class LinkGraphTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='wiki_admin',
+            email='wiki_admin@localhost')
+        self.home = WikiPage.objects.create(title=u'home', slug=u'home',
+            creator=self.user)
+        self.about = WikiPage.objects.create(title=u'about', slug=u'about',
+            creator=self.user)
+
+    def tearDown(self):
+        WikiPage.objects.all().delete()
+        User.objects.all().delete()
+
+    def publish(self, page, body):
+        revision = page.check_out(user=self.user)
+        revision.body = body
+        revision.publish()
+        return revision
+
+    def testLinks(self):
+        from vz_wiki import links
+        self.assertEqual(set([self.home, self.about]), set(links.orphans()))
+        self.assertEqual([], list(links.wanted()))
+
+        self.publish(self.home, u'See [[About]], [[Contact Us]] and [[home]].')
+        self.publish(self.about, u'Back [[home]], or [[contact us]].')
+        self.assertEqual([self.home], list(links.backlinks(self.about)))
+        self.assertEqual([self.about], list(links.backlinks(self.home)))
+        self.assertEqual([], list(links.orphans()))
+        self.assertEqual([{'target_slug': u'contact-us', 'links': 2}],
+            list(links.wanted()))
+
+        self.publish(self.home, u'Just [[Contact Us]] now.')
+        self.assertEqual([], list(links.backlinks(self.about)))
+        self.assertEqual([self.about], list(links.orphans()))
+        WikiPage.objects.create(title=u'Contact Us', slug=u'contact-us',
+            creator=self.user)
+        self.assertEqual([], list(links.wanted()))
+
+    def testRedLinks(self):
+        from django.db import connection
+        from vz_wiki import links, rendering
+        from vz_wiki.templatetags.wiki_tags import wiki_link
+        self.assertEqual(u'contact-us', links.link_slug(u' Contact  Us! '))
+
+        text = u' '.join([u'[[page %s]]' % x for x in range(499)])
+        text += u' [[About]]'
+        debug, settings.DEBUG = settings.DEBUG, True
+        connection.queries = []
+        try:
+            html = wiki_link(text)
+            self.assertEqual(1, len(connection.queries))
+        finally:
+            settings.DEBUG = debug
+        self.assertEqual(499, html.count(u'class="missing"'))
+        self.assertTrue(u'<a href="wiki/about" title="About">About</a>' in html)
+
+        revision = self.publish(self.home, u'[[Contact Us]]')
+        self.assertTrue(u'class="missing"' in rendering.rendered_html(revision))
+        contact = WikiPage.objects.create(title=u'Contact Us',
+            slug=u'contact-us', creator=self.user)
+        self.assertFalse(u'class="missing"' in
+            rendering.rendered_html(revision))
+        contact.delete()
+        self.assertTrue(u'class="missing"' in rendering.rendered_html(revision))
+
+
+class SanitizerTestCase(unittest.TestCase):
+
+    def testPolicyCache(self):
+        from vz_wiki.sanitizer import get_policy
+        policy = get_policy('a:href b')
+        self.assertTrue(policy is get_policy('a:href b'))
+        self.assertEqual(frozenset(['href']), policy.attributes['a'])
+
+    def testSanitize(self):
+        from vz_wiki.templatetags.wiki_tags import sanitize
+        self.assertEqual(u'<b>bold</b> alert(1)',
+            sanitize(u'<b onclick="x()">bold</b> <script>alert(1)</script>',
+            'b'))
+        self.assertEqual(u'<a href=":alert(1)">x</a>',
+            sanitize(u'<a href="javascript:alert(1)">x</a><!-- y -->',
+            'a:href'))
+        self.assertEqual(u'<p>one</p><p>two &amp; 3 &lt; 4</p>',
+            sanitize(u'<p>one<p>two & 3 < 4', 'p'))
+        self.assertEqual(u'', sanitize(u''))
+
+    def testSameAsBeautifulSoup(self):
+        from vz_wiki.benchmarks.sanitize import ALLOWED_TAGS, SAMPLE, \
+            legacy_sanitize
+        from vz_wiki.sanitizer import get_policy
+        policy = get_policy(ALLOWED_TAGS)
+        for body in SAMPLE.splitlines() + [SAMPLE]:
+            self.assertEqual(legacy_sanitize(body, ALLOWED_TAGS),
+                policy.sanitize(body))
+
+
+class SearchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='wiki_admin',
+            email='wiki_admin@localhost')
+
+    def tearDown(self):
+        from vz_wiki.models import SearchTerm
+        WikiPage.objects.all().delete()
+        User.objects.all().delete()
+        SearchTerm.objects.all().delete()
+
+    def publish(self, page, body):
+        revision = page.check_out(user=self.user)
+        revision.body = body
+        revision.publish()
+        return revision
+
+    def testSearch(self):
+        from vz_wiki import search
+        from vz_wiki.models import SearchTerm
+        apples = WikiPage.objects.create(title=u'Apples', slug=u'apples',
+            creator=self.user)
+        pears = WikiPage.objects.create(title=u'Pears', slug=u'pears',
+            creator=self.user)
+        self.publish(apples, u'Apples and pears are <b>fruit</b>.')
+        self.publish(pears, u'Pears grow on trees, like apples and plums.')
+
+        found, total = search.search(u'apples')
+        self.assertEqual(2, total)
+        self.assertEqual([apples, pears], [page for page, score in found])
+        found, total = search.search(u'Plums APPLES')
+        self.assertEqual([pears], [page for page, score in found])
+        self.assertEqual(([], 0), search.search(u'apples bananas'))
+        self.assertEqual(([], 0), search.search(u'the'))
+        self.assertEqual(1, search.search(u'fruit b')[1])
+
+        self.publish(apples, u'Just apples.')
+        self.assertEqual(0, search.search(u'fruit')[1])
+        self.assertEqual(0, SearchTerm.objects.get(term=u'fruit')
+            .document_count)
+        pears.delete()
+        self.assertEqual(1, SearchTerm.objects.get(term=u'apples')
+            .document_count)
+
+    def testSnippet(self):
+        from vz_wiki import search
+        text = u'x' * 300 + u' some <i>apples</i> & pears ' + u'y' * 300
+        snippet = search.snippet(text, u'Apples')
+        self.assertTrue(snippet.startswith(u'&hellip;'))
+        self.assertTrue(snippet.endswith(u'&hellip;'))
+        self.assertTrue(u'<b>apples</b>' in snippet)
+        self.assertTrue(u'&amp; pears' in snippet)
+        self.assertEqual(u'short &lt;', search.snippet(u'short <', u'x'))
+
+
+class IndexQueueTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='wiki_admin',
+            email='wiki_admin@localhost')
+
+    def tearDown(self):
+        from vz_wiki.models import IndexUpdate
+        WikiPage.objects.all().delete()
+        User.objects.all().delete()
+        IndexUpdate.objects.all().delete()
+
+    def testQueuePage(self):
+        from vz_wiki import reindex
+        from vz_wiki.models import IndexUpdate
+        page = WikiPage.objects.create(title=u'Queued', slug=u'queued',
+            creator=self.user)
+        reindex.queue_page(page.pk)
+        first = IndexUpdate.objects.get(page_id=page.pk).queued_on
+        reindex.queue_page(page.pk)
+        reindex.queue_page(page.pk + 1)
+        self.assertEqual(2, IndexUpdate.objects.count())
+        self.assertTrue(first <= IndexUpdate.objects.get(page_id=page.pk)
+            .queued_on)
+
+        pages = reindex.load_pages(pk=page.pk)
+        self.assertEqual(u'hello world!',
+            pages[0].current_revision.body)
+
+
+class PageDetailTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='wiki_admin',
+            email='wiki_admin@localhost')
+        self.page = WikiPage.objects.create(title=u'Detail', slug=u'detail',
+            tags=u'apples pears plums', creator=self.user)
+
+    def tearDown(self):
+        WikiPage.objects.all().delete()
+        User.objects.all().delete()
+
+    def get(self, view, *args, **meta):
+        from django.contrib.auth.models import AnonymousUser
+        from django.db import connection
+        from django.http import HttpRequest
+        request = HttpRequest()
+        request.method = 'GET'
+        request.user = AnonymousUser()
+        request.GET = meta.pop('GET', {})
+        request.META.update(meta)
+        urlconf = settings.ROOT_URLCONF
+        debug = settings.DEBUG
+        settings.ROOT_URLCONF = 'vz_wiki.urls'
+        settings.DEBUG = True
+        connection.queries = []
+        try:
+            response = view(request, *args)
+            return response, len(connection.queries)
+        finally:
+            settings.ROOT_URLCONF = urlconf
+            settings.DEBUG = debug
+
+    def publish(self, body):
+        revision = self.page.check_out(user=self.user)
+        revision.body = body
+        revision.publish()
+        return revision
+
+    def testQueries(self):
+        from vz_wiki.views import page_detail
+        self.publish(u'Some *fruit*.')
+        # One for the validators, three for the page.
+        response, queries = self.get(page_detail, u'detail')
+        self.assertEqual(4, queries)
+        self.assertTrue(u'<em>fruit</em>' in response.content)
+        self.assertTrue(u'plums' in response.content)
+
+        self.page.check_out(user=self.user)
+        response, queries = self.get(page_detail, u'detail')
+        self.assertEqual(4, queries)
+        self.assertTrue(u'checked out by wiki_admin' in response.content)
+
+    def testConditionalGet(self):
+        from vz_wiki.views import page_detail, page_history, \
+            compare_revisions
+        first = self.publish(u'Some fruit.')
+        response, queries = self.get(page_detail, u'detail')
+        etag = response['ETag']
+        last_modified = response['Last-Modified']
+        response, queries = self.get(page_detail, u'detail',
+            HTTP_IF_NONE_MATCH=etag, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(1, queries)
+        response, queries = self.get(page_detail, u'detail',
+            HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(304, response.status_code)
+
+        # Locking the page changes it.  Unlocking it takes it back to its
+        # earlier date, so a locked page goes without one.
+        self.page.check_out(user=self.user)
+        response, queries = self.get(page_detail, u'detail',
+            HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+        self.assertFalse(response.has_header('Last-Modified'))
+        response, queries = self.get(page_detail, u'detail',
+            HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(200, response.status_code)
+        self.page.unpublished_revision().delete()
+        self.page.check_in()
+        response, queries = self.get(page_detail, u'detail',
+            HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(last_modified, response['Last-Modified'])
+
+        second = self.publish(u'More fruit.')
+        response, queries = self.get(page_history, self.page.pk,
+            HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+        response, queries = self.get(page_history, self.page.pk,
+            HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(304, response.status_code)
+
+        revisions = {'rev1': str(first.pk), 'rev2': str(second.pk)}
+        response, queries = self.get(compare_revisions, self.page.pk,
+            GET=revisions)
+        self.assertEqual(200, response.status_code)
+        response, queries = self.get(compare_revisions, self.page.pk,
+            GET=revisions, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(1, queries)
+
+    def testPendingComparison(self):
+        from vz_wiki import diffs
+        from vz_wiki.views import compare_revisions
+        first = self.publish(u'Some fruit.')
+        second = self.publish(u'Some more fruit.')
+        revisions = {'rev1': str(first.pk), 'rev2': str(second.pk)}
+        limit = getattr(settings, 'WIKI_DIFF_SYNC_LIMIT', None)
+        settings.WIKI_DIFF_SYNC_LIMIT = 10
+        try:
+            response, queries = self.get(compare_revisions, self.page.pk,
+                GET=revisions)
+        finally:
+            if limit is None:
+                del settings.WIKI_DIFF_SYNC_LIMIT
+            else:
+                settings.WIKI_DIFF_SYNC_LIMIT = limit
+        self.assertEqual(202, response.status_code)
+        self.assertFalse(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Last-Modified'))
+        self.assertEqual('no-cache', response['Cache-Control'])
+
+        diffs.run_job(diffs.claim_job(), limit=60)
+        response, queries = self.get(compare_revisions, self.page.pk,
+            GET=revisions)
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response.has_header('ETag'))
+
+    def testMetrics(self):
+        import logging
+        from django.contrib.auth.models import AnonymousUser
+        from django.http import HttpRequest
+        from django.utils import simplejson
+        from vz_wiki import metrics
+        from vz_wiki.middleware import MetricsMiddleware
+        from vz_wiki.views import metrics_text, page_detail
+
+        class Records(logging.Handler):
+            records = []
+
+            def emit(self, record):
+                self.records.append(record.getMessage())
+
+        handler = Records()
+        logger = logging.getLogger('vz_wiki.slow_requests')
+        logger.addHandler(handler)
+        slow = getattr(settings, 'WIKI_SLOW_REQUEST_SECONDS', 1.0)
+        settings.WIKI_SLOW_REQUEST_SECONDS = 0
+        metrics.reset()
+        try:
+            self.publish(u'Some [[fruit]].')
+            request = HttpRequest()
+            request.method = 'GET'
+            request.path = '/wiki/detail/'
+            request.user = AnonymousUser()
+            middleware = MetricsMiddleware()
+            middleware.process_request(request)
+            middleware.process_view(request, page_detail, (u'detail',), {})
+            response = middleware.process_response(request,
+                self.get(page_detail, u'detail')[0])
+        finally:
+            settings.WIKI_SLOW_REQUEST_SECONDS = slow
+            logger.removeHandler(handler)
+        self.assertEqual(200, response.status_code)
+
+        timings = metrics.snapshot()['timings']
+        for name in ('check_out', 'publish', 'sanitize', 'wiki_link',
+            'template', 'request.page_detail'):
+            self.assertEqual(1, timings[name]['count'])
+        self.assertEqual(1, timings['request.page_detail']['buckets'][-1])
+        self.assertEqual(4, timings['request.page_detail']['queries'])
+        self.assertEqual(1, len(handler.records))
+        logged = simplejson.loads(handler.records[0])
+        self.assertEqual((u'page_detail', 200, 4), (logged['view'],
+            logged['status'], logged['queries']))
+        self.assertEqual([u'template'], logged['stages'].keys())
+
+        response = self.get(metrics_text)[0]
+        self.assertEqual(403, response.status_code)
+        request.user = self.user
+        self.user.is_staff = True
+        response = metrics_text(request)
+        self.assert_('vz_wiki_request_page_detail_seconds_count 1\n'
+            in response.content)
+        self.assert_('vz_wiki_publish_seconds_bucket{le="+Inf"} 1\n'
+            in response.content)
+
+
+class PaginationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='wiki_admin',
+            email='wiki_admin@localhost')
+
+    def tearDown(self):
+        WikiPage.objects.all().delete()
+        User.objects.all().delete()
+
+    def testPageIndex(self):
+        from vz_wiki import pagination
+        titles = [u'page, %s' % letter for letter in u'gabfcde']
+        for title in titles:
+            WikiPage.objects.create(title=title, slug=u'page-' + title[-1],
+                creator=self.user)
+        titles.sort()
+        pages = WikiPage.objects.only('title', 'slug')
+
+        rows, previous_key, next_key = pagination.keyset_page(pages,
+            ['title'], limit=3)
+        self.assertEqual(titles[:3], [page.title for page in rows])
+        self.assertEqual(None, previous_key)
+        cursor = pagination.format_cursor(next_key)
+        after = pagination.parse_cursor(cursor, (unicode,))
+        rows, previous_key, next_key = pagination.keyset_page(pages,
+            ['title'], after=after, limit=3)
+        self.assertEqual(titles[3:6], [page.title for page in rows])
+        rows, previous_key, next_key = pagination.keyset_page(pages,
+            ['title'], after=next_key, limit=3)
+        self.assertEqual(titles[6:], [page.title for page in rows])
+        self.assertEqual(None, next_key)
+        rows, previous_key, next_key = pagination.keyset_page(pages,
+            ['title'], before=previous_key, limit=3)
+        self.assertEqual(titles[3:6], [page.title for page in rows])
+        rows, previous_key, next_key = pagination.keyset_page(pages,
+            ['title'], before=previous_key, limit=3)
+        self.assertEqual(titles[:3], [page.title for page in rows])
+        self.assertEqual(None, previous_key)
+
+        self.assertEqual(7, pagination.page_count())
+        WikiPage.objects.create(title=u'one more', slug=u'one-more',
+            creator=self.user)
+        self.assertEqual(8, pagination.page_count())
+        self.assertEqual(None, pagination.parse_cursor(u'x,y',
+            (pagination.parse_datetime, int)))
+
+    def testHistory(self):
+        from django.db import connection
+        from vz_wiki import pagination
+        from vz_wiki.models import Revision
+        page = WikiPage.objects.create(title=u'History', slug=u'history',
+            creator=self.user)
+        for x in range(6):
+            revision = page.check_out(user=self.user)
+            revision.body = u'version %s' % x
+            revision.publish()
+        # Same second, the id breaks the tie.
+        Revision.objects.filter(page=page).update(
+            published_on=datetime.datetime(2010, 1, 1))
+        revisions = Revision.objects.filter(page=page, is_published=True) \
+            .defer('content')
+        fields = ['published_on', 'id']
+        types = (pagination.parse_datetime, int)
+
+        numbers = []
+        after = None
+        while True:
+            rows, previous_key, next_key = pagination.keyset_page(revisions,
+                fields, after=after, limit=4, descending=True)
+            numbers.extend([revision.number for revision in rows])
+            if next_key is None:
+                break
+            after = pagination.parse_cursor(
+                pagination.format_cursor(next_key), types)
+        self.assertEqual(range(7, 0, -1), numbers)
+        rows, previous_key, next_key = pagination.keyset_page(revisions,
+            fields, before=previous_key, limit=4, descending=True)
+        self.assertEqual([7, 6, 5, 4], [revision.number for revision in rows])
+        self.assertEqual(u'version 4', rows[1].body)
+
+
+class AdminTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='wiki_admin',
+            email='wiki_admin@localhost')
+        for x in range(10):
+            page = WikiPage.objects.create(title=u'admin page %s' % x,
+                slug=u'admin-page-%s' % x, creator=self.user)
+            if x % 2:
+                page.check_out(user=self.user)
+
+    def tearDown(self):
+        WikiPage.objects.all().delete()
+        User.objects.all().delete()
+
+    def testChangeListColumns(self):
+        from django.contrib import admin
+        from django.db import connection
+        from vz_wiki.admin import WikiPageAdmin, latest_revision_display, \
+            who_checked_out
+        model_admin = WikiPageAdmin(WikiPage, admin.site)
+        debug = settings.DEBUG
+        settings.DEBUG = True
+        connection.queries = []
+        try:
+            columns = [(latest_revision_display(page), who_checked_out(page))
+                for page in model_admin.queryset(None)]
+            self.assertEqual(1, len(connection.queries))
+        finally:
+            settings.DEBUG = debug
+        self.assertEqual(10, len(columns))
+        self.assertEqual(5, len([user for version, user in columns
+            if user == self.user]))
+        self.assertEqual([u'1'], list(set([version for version, user
+            in columns])))
+
+    def testRevisionInline(self):
+        from vz_wiki.admin import DraftRevisionFormSet
+        from django.forms.models import inlineformset_factory
+        page = WikiPage.objects.get(slug=u'admin-page-1')
+        FormSet = inlineformset_factory(WikiPage, Revision,
+            formset=DraftRevisionFormSet)
+        formset = FormSet(instance=page)
+        self.assertEqual([page.unpublished_revision()],
+            [form.instance for form in formset.initial_forms])
+
+
+class ImportTestCase(unittest.TestCase):
+
+    def setUp(self):
+        import os
+        import tempfile
+        from django.utils import simplejson
+        self.user = User.objects.create(username='wiki_admin',
+            email='wiki_admin@localhost')
+        WikiPage.objects.create(title=u'existing page',
+            slug=u'existing-page', creator=self.user)
+        pages = [{'title': u'imported page %s' % x,
+            'slug': u'imported-page-%s' % x, 'tags': u'imported old',
+            'creator': 'old_editor',
+            'created_on': '2009-01-01 10:00:00',
+            'revisions': [{'author': 'old_editor',
+                'body': u'version %s of page %s' % (y, x),
+                'published_on': '2009-01-0%s 10:00:00' % (y + 1)}
+                for y in range(x % 4)]} for x in range(25)]
+        pages[3]['revisions'].append({'author': 'wiki_admin',
+            'body': u'a draft', 'is_published': False})
+        pages.append({'title': u'existing page', 'slug': u'existing-page'})
+        handle, self.path = tempfile.mkstemp(suffix='.jsonl')
+        dump = os.fdopen(handle, 'w')
+        for page in pages:
+            dump.write(simplejson.dumps(page) + '\n')
+        dump.close()
+
+    def tearDown(self):
+        import os
+        os.remove(self.path)
+        WikiPage.objects.all().delete()
+        User.objects.all().delete()
+
+    def testImport(self):
+        from tagging.models import Tag
+        from vz_wiki import dumps
+        batches = list(dumps.read_batches(dumps.read_dump(self.path), 10))
+        self.assertEqual([10, 10, 6], [len(batch) for batch in batches])
+        page_ids = []
+        skipped = []
+        for batch in batches:
+            batch_ids, revisions, comparisons, batch_skipped = \
+                dumps.import_batch(batch)
+            page_ids.extend(batch_ids)
+            skipped.extend(batch_skipped)
+        self.assertEqual(25, len(page_ids))
+        self.assertEqual(['%s:26' % self.path], [where
+            for where, reason in skipped])
+        self.assertEqual([], dumps.check_invariants(min(page_ids),
+            max(page_ids)))
+
+        page = WikiPage.objects.get(slug=u'imported-page-3')
+        self.assertEqual(3, page.revision_count)
+        self.assertEqual(u'version 2 of page 3', page.latest_revision().body)
+        self.assertEqual(datetime.datetime(2009, 1, 3, 10),
+            page.latest_revision().published_on)
+        self.assertEqual(u'old_editor', page.creator.username)
+        self.assertEqual(set([u'imported', u'old']), set([tag.name
+            for tag in Tag.objects.get_for_object(page)]))
+        self.assert_(page.is_locked())
+        self.assertEqual(u'a draft', page.unpublished_revision().body)
+        page.unpublished_revision().publish()
+        self.assertEqual(4, WikiPage.objects.get(pk=page.pk).revision_count)
+
+        page = WikiPage.objects.get(slug=u'imported-page-4')
+        self.assertEqual(1, page.revision_count)
+        self.assertEqual(dumps.FIRST_REVISION_BODY,
+            page.latest_revision().body)
+        self.failIf(page.is_checked_out)
+
+        Revision.objects.filter(page=page).update(number=2)
+        Revision.objects.create(page=WikiPage.objects.get(
+            slug=u'imported-page-5'), author=self.user)
+        self.assertEqual(2, len(dumps.check_invariants(min(page_ids),
+            max(page_ids))))
+
+
+class ExportTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Delta storage, so exports read revisions back through their chains.
+        self.storage = getattr(settings, 'WIKI_REVISION_STORAGE', 'full')
+        self.interval = getattr(settings, 'WIKI_REVISION_KEYFRAME_INTERVAL',
+            10)
+        settings.WIKI_REVISION_STORAGE = 'delta'
+        settings.WIKI_REVISION_KEYFRAME_INTERVAL = 4
+        self.user = User.objects.create(username='wiki_admin',
+            email='wiki_admin@localhost')
+        self.page = WikiPage.objects.create(title=u'exported page',
+            slug=u'exported-page', creator=self.user)
+
+    def tearDown(self):
+        settings.WIKI_REVISION_STORAGE = self.storage
+        settings.WIKI_REVISION_KEYFRAME_INTERVAL = self.interval
+        WikiPage.objects.all().delete()
+        User.objects.all().delete()
+
+    def publish(self, body):
+        revision = self.page.check_out(user=self.user)
+        revision.body = body
+        revision.publish()
+        self.page = WikiPage.objects.get(pk=self.page.pk)
+
+    def testExportCompression(self):
+        import os
+        import shutil
+        import tarfile
+        import tempfile
+        from django.core.management import call_command
+        self.publish(u'caf\xe9 tables and chairs')
+        directory = tempfile.mkdtemp()
+        try:
+            for name, gzipped in (('wiki.tar', False), ('wiki.tar.gz', True),
+                ('wiki.tgz', True)):
+                path = os.path.join(directory, name)
+                call_command('export_pages', output=path, verbosity=0)
+                self.assertEqual(gzipped,
+                    open(path, 'rb').read(2) == '\x1f\x8b', name)
+                self.assertTrue(tarfile.is_tarfile(path), name)
+        finally:
+            shutil.rmtree(directory)
+
+    def testExportRoundTrip(self):
+        import os
+        import tempfile
+        from vz_wiki import dumps
+        bodies = [u'caf\xe9 tables and chairs\n' * 20 + u'%s' % x
+            for x in range(6)]
+        for body in bodies:
+            self.publish(body)
+        draft = self.page.check_out(user=self.user)
+        draft.body = u'draft text'
+        draft.save()
+        Revision.objects.filter(page=self.page, number=5).update(
+            published_on=datetime.datetime(2030, 1, 1))
+        Revision.objects.filter(page=self.page, number__gt=5).update(
+            published_on=datetime.datetime(2030, 1, 2))
+
+        handle, path = tempfile.mkstemp(suffix='.tar.gz')
+        try:
+            stream = os.fdopen(handle, 'wb')
+            written = dumps.write_tar([('pages', dumps.export_pages())],
+                stream)
+            stream.close()
+            self.assertEqual(1, written)
+            changed = [list(chunk) for chunk in dumps.export_pages(
+                datetime.datetime(2030, 1, 1))]
+            self.assertEqual([[5, 6, 7]], [[revision['number']
+                for revision in page['revisions']] for page in changed[0]])
+            self.assertEqual(bodies[3], changed[0][0]['revisions'][0]['body'])
+
+            WikiPage.objects.all().delete()
+            page_ids, revisions, comparisons, skipped = dumps.import_batch(
+                list(dumps.read_dump(path)))
+        finally:
+            os.remove(path)
+        self.assertEqual(8, revisions)
+        page = WikiPage.objects.get(pk=page_ids[0])
+        self.assertEqual([u'hello world!'] + bodies, [revision.body
+            for revision in page.revision_set.filter(is_published=True)
+            .order_by('number')])
+        self.assertEqual(u'draft text', page.unpublished_revision().body)
+        self.assertEqual(u'wiki_admin', page.checked_out_by.username)
+
+        # An incremental export lacks the start of the history.
+        incremental = changed[0][0]
+        self.assertEqual([], dumps.import_batch([('changed',
+            incremental)])[0])
+        self.assertEqual([], dumps.import_batch([('changed',
+            dict(incremental, slug=u'changed-page',
+            title=u'changed page'))], append=True)[0])
+
+        # It can be appended to the page it carries on from.
+        WikiPage.objects.filter(pk=page.pk).update(revision_count=4,
+            current_revision=Revision.objects.get(page=page, number=4))
+        Revision.objects.filter(page=page, number__gte=5).delete()
+        incremental['tags'] = u'restored'
+        page_ids, revisions, comparisons, skipped = dumps.import_batch(
+            [('changed', incremental)], append=True)
+        self.assertEqual(([page.pk], 3, []), (page_ids, revisions, skipped))
+        page = WikiPage.objects.get(pk=page.pk)
+        self.assertEqual(7, page.revision_count)
+        self.assertEqual(bodies[-1], page.latest_revision().body)
+        self.assertEqual(7, page.latest_revision().number)
+        self.assertEqual(u'restored', page.tags)
+        self.assertEqual([], dumps.check_invariants(page.pk, page.pk))
+        # Not twice.
+        self.assertEqual([], dumps.import_batch([('changed', incremental)],
+            append=True)[0])
+
+
+class GeneratorTestCase(unittest.TestCase):
+
+    def tearDown(self):
+        WikiPage.objects.all().delete()
+        User.objects.all().delete()
+
+    def testGenerate(self):
+        from vz_wiki import dumps, links
+        from vz_wiki.benchmarks.generator import generate, populate
+        pages = list(generate(20, 3, seed=4))
+        self.assertEqual(pages, list(generate(20, 3, seed=4)))
+        self.assertNotEqual(pages, list(generate(20, 3, seed=5)))
+        self.assertEqual(20, len(set([page['slug'] for page in pages])))
+        self.assert_(links.linked_slugs(u' '.join([page['revisions'][-1]
+            ['body'] for page in pages])))
+
+        populate(20, 3, seed=4)
+        self.assertEqual(20, WikiPage.objects.count())
+        self.assertEqual(set([3]), set(WikiPage.objects.values_list(
+            'revision_count', flat=True)))
+        self.assertEqual([], dumps.check_invariants(0,
+            WikiPage.objects.order_by('-pk')[0].pk))
+
+    def testDiffCorpus(self):
+        from vz_wiki.benchmarks import diff_corpus, diff_engine
+        pairs = diff_corpus.pairs('small_edit', seed=2, count=3)
+        self.assertEqual(pairs, diff_corpus.pairs('small_edit', seed=2,
+            count=3))
+        self.assertNotEqual(pairs, diff_corpus.pairs('small_edit', seed=3,
+            count=3))
+        text1, text2 = diff_corpus.pairs('reorder', count=1)[0]
+        self.assertEqual(sorted(text1.split(u'\n\n')),
+            sorted(text2.split(u'\n\n')))
+
+        for operation in diff_engine.OPERATIONS:
+            result = diff_engine.measure(operation, pairs, 1, 1.0)
+            self.assertEqual(3, result['runs'])
+            self.assertEqual(0, result['failed_patches'])
+
+
+def look_at_user(request):
+    """Does nothing but render the user, as every page for a logged in user
+    does."""
+    from django.http import HttpResponse
+    from django.template import RequestContext, Template
+    return HttpResponse(Template(u'{{ user }}').render(
+        RequestContext(request)))
+
+
+urlpatterns = patterns('',
+    (r'^look-at-user/$', look_at_user),
+    (r'', include('vz_wiki.urls')),
+)
+
+
+class QueryBudgetTestCase(unittest.TestCase):
+    """
+    The most queries each URL in vz_wiki.urls may make, requested by a
+    logged in editor.  The queries of a request that only looks at the user,
+    for the session and the user, which vary with the version of Django,
+    are taken out, so a budget is the wiki's own queries.  They're checked
+    on wikis of each of SIZES pages, and must not go up as the wiki grows.
+    """
+    SIZES = (10, 1000, 10000)
+    BUDGETS = {
+        'index': 0,
+        'create_wikipage': 0,
+        'edit_wikipage': 7,
+        'abandon_wikipage_revision': 12,
+        'wikipage_tags': 4,
+        'wikipage_history': 2,
+        'compare_wikipage_revisions': 4,
+        'wikipage_backlinks': 2,
+        'orphaned_wikipages': 1,
+        'wanted_wikipages': 1,
+        'wikipage_search': 5,
+        'wikipage_list': 2,
+        'wiki_metrics': 0,
+        'wikipage_detail': 3,
+    }
+    # Pages rendered, and indexed for links and search, of each wiki.
+    SAMPLE = 50
+
+    def setUp(self):
+        self.urlconf = settings.ROOT_URLCONF
+        settings.ROOT_URLCONF = 'vz_wiki.tests'
+
+    def tearDown(self):
+        settings.ROOT_URLCONF = self.urlconf
+        self.flush()
+
+    def flush(self):
+        # Deleting thousands of pages one by one through the ORM takes
+        # minutes.
+        from django.contrib.contenttypes.models import ContentType
+        from django.core.management import call_command
+        call_command('flush', interactive=False, verbosity=0)
+        ContentType.objects.clear_cache()
+
+    def populate(self, size):
+        from vz_wiki import links, rendering, search
+        from vz_wiki.benchmarks.generator import populate
+        populate(size, 2, blocks=2, rebuild=False)
+        for page in WikiPage.objects.select_related('current_revision') \
+            .order_by('pk')[:self.SAMPLE]:
+            body = page.current_revision.body
+            rendering.store_rendering(page.current_revision)
+            links.update_links(page, body)
+            search.index_page(page, body)
+        user = User.objects.create_user('budget', 'budget@localhost',
+            'budget')
+        user.is_staff = user.is_superuser = True
+        user.save()
+
+    def requests(self):
+        """Requests every URL as the editor, returns the queries each made,
+        by the URL's name."""
+        from django.core.urlresolvers import reverse
+        from django.test.client import Client
+        from vz_wiki.testing import own_queries, statements
+        client = Client()
+        self.assert_(client.login(username='budget', password='budget'))
+        response, baseline = statements(client.get, '/look-at-user/')
+        self.assertEqual(200, response.status_code)
+        page = WikiPage.objects.order_by('pk')[1]
+        rev1, rev2 = Revision.objects.filter(page=page, is_published=True) \
+            .order_by('number').values_list('pk', flat=True)
+        page_id = {'page_id': page.pk}
+        urls = [
+            ('index', {}, {}, 301),
+            ('wikipage_detail', {'slug': page.slug}, {}, 200),
+            ('wikipage_list', {}, {}, 200),
+            ('wikipage_history', page_id, {}, 200),
+            ('compare_wikipage_revisions', page_id, {'rev1': rev1,
+                'rev2': rev2}, 200),
+            ('wikipage_backlinks', page_id, {}, 200),
+            ('orphaned_wikipages', {}, {}, 200),
+            ('wanted_wikipages', {}, {}, 200),
+            ('wikipage_search', {}, {'q': page.title.split()[0]}, 200),
+            ('wikipage_tags', {}, {'tags': page.tags}, 200),
+            ('wiki_metrics', {}, {}, 200),
+            ('create_wikipage', {}, {}, 200),
+            ('edit_wikipage', page_id, {}, 200),
+        ]
+        counts = {}
+        for name, kwargs, GET, status in urls:
+            response, made = statements(client.get,
+                reverse(name, kwargs=kwargs), GET)
+            self.assertEqual(status, response.status_code, name)
+            counts[name] = own_queries(made, baseline)
+        draft = page.unpublished_revision()
+        response, made = statements(client.get,
+            reverse('abandon_wikipage_revision',
+            kwargs={'revision_id': draft.pk}))
+        self.assertEqual(302, response.status_code)
+        counts['abandon_wikipage_revision'] = own_queries(made, baseline)
+        return counts
+
+    def testQueryBudgets(self):
+        from vz_wiki import urls
+        from vz_wiki.testing import check_budgets
+        counts = {}
+        for size in self.SIZES:
+            self.populate(size)
+            counts[size] = self.requests()
+            self.assertEqual(sorted([pattern.name for pattern
+                in urls.urlpatterns]), sorted(counts[size]))
+            self.flush()
+        self.assertEqual([], check_budgets(counts, self.BUDGETS))
+
+    def testCheckBudgets(self):
+        from vz_wiki.testing import check_budgets
+        self.assertEqual([], check_budgets({10: {'a': 3, 'b': 2},
+            1000: {'a': 3, 'b': 1}}, {'a': 3, 'b': 2}))
+        self.assertEqual(['c has no query budget.',
+            'a made 4 queries on 1000 pages, its budget is 3.',
+            'a made 3 queries on 10 pages, and 4 on 1000 pages.'],
+            check_budgets({10: {'a': 3, 'c': 1}, 1000: {'a': 4, 'c': 1}},
+            {'a': 3}))
+
+    def testOwnQueries(self):
+        from vz_wiki.testing import own_queries
+        baseline = ['session', 'user']
+        self.assertEqual(2, own_queries(['session', 'page', 'user', 'user'],
+            baseline))
+        self.assertEqual(2, own_queries(['page', 'user'], baseline))
+        self.assertEqual(0, own_queries([], baseline))
@@ -1,5 +1,4 @@
 from django.conf.urls.defaults import *
-from models import WikiPage
 
 urlpatterns = patterns('vz_wiki.views',
     url(r'^pages:create/$', 'create_page', name='create_wikipage'),
@@ -12,24 +11,17 @@ urlpatterns = patterns('vz_wiki.views',
     url(
         r'^pages:compare\-revisions/(?P<page_id>\d+)/$',
             'compare_revisions', name='compare_wikipage_revisions'),
+    url(r'^pages:backlinks/(?P<page_id>\d+)/$', 'page_backlinks',
+        name='wikipage_backlinks'),
+    url(r'^pages:orphans/$', 'orphaned_pages', name='orphaned_wikipages'),
+    url(r'^pages:wanted/$', 'wanted_pages', name='wanted_wikipages'),
+    url(r'^pages:search/$', 'search_pages', name='wikipage_search'),
+    url(r'^pages:index/$', 'page_list', name='wikipage_list'),
+    url(r'^pages:metrics/$', 'metrics_text', name='wiki_metrics'),
+    url(r'^(?P<slug>[\w\-]+)/$', 'page_detail', name='wikipage_detail'),
 )
 
 urlpatterns += patterns('django.views.generic',
-    url(
-        r'^(?P<slug>[\w\-]+)/$',
-        'list_detail.object_detail',
-            {'queryset': WikiPage.objects.select_related().all(),
-            'template_name': 'vz_wiki/page_detail.html',
-            'template_object_name': 'wikipage', },
-        name='wikipage_detail',
-    ),
-    url(
-        r'^pages:index/$',
-        'list_detail.object_list', {'queryset': WikiPage.objects.all(),
-            'template_name': 'vz_wiki/page_list.html',
-            'template_object_name': 'wikipage', },
-        name='wikipage_list',
-    ),
     url(
         r'^$',
         'simple.redirect_to',
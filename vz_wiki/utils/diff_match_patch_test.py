@@ -400,6 +400,55 @@ class DiffTest(DiffMatchPatchTest):
     v_map.append({(2,6):True, (3,5):True, (4,4):True})
     self.assertEquals([(self.dmp.DIFF_DELETE, "CD"), (self.dmp.DIFF_EQUAL, "34"), (self.dmp.DIFF_INSERT, "YZ")], self.dmp.diff_path2(v_map, "CD34", "34YZ"))
 
+  def testDiffBisect(self):
+    # Normal.
+    a = "cat"
+    b = "map"
+    # Since the resulting diff hasn't been normalized, it would be ok if
+    # the insertion and deletion pairs are swapped.
+    # If the order changes, tweak this test as required.
+    self.assertEquals([(self.dmp.DIFF_DELETE, "c"), (self.dmp.DIFF_INSERT, "m"), (self.dmp.DIFF_EQUAL, "a"), (self.dmp.DIFF_DELETE, "t"), (self.dmp.DIFF_INSERT, "p")], self.dmp.diff_bisect(a, b, 0))
+
+    # Timeout.
+    self.assertEquals([(self.dmp.DIFF_DELETE, "cat"), (self.dmp.DIFF_INSERT, "map")], self.dmp.diff_bisect(a, b, 1))
+
+  def testDiffMainLinearSpace(self):
+    # Linear-space mode must give the same results as diff_map.
+    self.dmp.Diff_LinearSpace = True
+    self.dmp.Diff_Timeout = 0
+    self.assertEquals([(self.dmp.DIFF_EQUAL, "abc")], self.dmp.diff_main("abc", "abc", False))
+
+    self.assertEquals([(self.dmp.DIFF_EQUAL, "ab"), (self.dmp.DIFF_INSERT, "123"), (self.dmp.DIFF_EQUAL, "c")], self.dmp.diff_main("abc", "ab123c", False))
+
+    self.assertEquals([(self.dmp.DIFF_DELETE, "a"), (self.dmp.DIFF_INSERT, "b")], self.dmp.diff_main("a", "b", False))
+
+    self.assertEquals([(self.dmp.DIFF_DELETE, "Apple"), (self.dmp.DIFF_INSERT, "Banana"), (self.dmp.DIFF_EQUAL, "s are a"), (self.dmp.DIFF_INSERT, "lso"), (self.dmp.DIFF_EQUAL, " fruit.")], self.dmp.diff_main("Apples are a fruit.", "Bananas are also fruit.", False))
+
+    self.assertEquals([(self.dmp.DIFF_DELETE, "a"), (self.dmp.DIFF_INSERT, u"\u0680"), (self.dmp.DIFF_EQUAL, "x"), (self.dmp.DIFF_DELETE, "\t"), (self.dmp.DIFF_INSERT, u"\x00")], self.dmp.diff_main("ax\t", u"\u0680x\x00", False))
+
+    self.assertEquals([(self.dmp.DIFF_DELETE, "1"), (self.dmp.DIFF_EQUAL, "a"), (self.dmp.DIFF_DELETE, "y"), (self.dmp.DIFF_EQUAL, "b"), (self.dmp.DIFF_DELETE, "2"), (self.dmp.DIFF_INSERT, "xab")], self.dmp.diff_main("1ayb2", "abxab", False))
+
+    self.assertEquals([(self.dmp.DIFF_INSERT, "xaxcx"), (self.dmp.DIFF_EQUAL, "abc"), (self.dmp.DIFF_DELETE, "y")], self.dmp.diff_main("abcy", "xaxcxabc", False))
+
+    # Both modes find an edit script of the same size.
+    a = "The quick brown fox jumps over the lazy dog.\n" * 20
+    b = a.replace("quick", "slow").replace("lazy", "sleepy")
+    linear = self.dmp.diff_main(a, b, False)
+    self.assertEquals((a, b), self.diff_rebuildtexts(linear))
+    self.dmp.Diff_LinearSpace = False
+    self.assertEquals(self.dmp.diff_levenshtein(self.dmp.diff_main(a, b, False)), self.dmp.diff_levenshtein(linear))
+
+    # Timeout gives a complete, if crude, diff instead of None.
+    self.dmp.Diff_LinearSpace = True
+    self.dmp.Diff_Timeout = 0.001  # 1ms
+    a = "`Twas brillig, and the slithy toves\nDid gyre and gimble in the wabe:\nAll mimsy were the borogoves,\nAnd the mome raths outgrabe.\n"
+    b = "I am the very model of a modern major general,\nI've information vegetable, animal, and mineral,\nI know the kings of England, and I quote the fights historical,\nFrom Marathon to Waterloo, in order categorical.\n"
+    # Increase the text lengths by 1024 times to ensure a timeout.
+    for x in xrange(10):
+      a = a + a
+      b = b + b
+    self.assertEquals((a, b), self.diff_rebuildtexts(self.dmp.diff_main(a, b)))
+
   def testDiffMain(self):
     # Perform a trivial diff.
     # Null case.
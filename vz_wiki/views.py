@@ -1,18 +1,36 @@
+from django.conf import settings
 from django.contrib.auth.decorators import permission_required
-from django.http import HttpResponseForbidden, HttpResponseBadRequest, Http404
+from django.http import HttpResponse, HttpResponseForbidden, \
+    HttpResponseBadRequest, Http404
 from django.shortcuts import render_to_response, redirect, get_object_or_404
 from django.template import RequestContext
+from django.utils import simplejson
 from tagging.models import Tag, TaggedItem
 from tagging.utils import parse_tag_input
-from models import WikiPage, Revision
+from models import WikiPage, Revision, prefetch_bodies
 from forms import WikiPageForm, RevisionForm
-from exceptions import RevisionDoesNotExist
+from exceptions import RevisionDoesNotExist, ComparingSameRevision, \
+    WikiPageAlreadyCheckedOut
+from conditional import conditional, comparison_validators, \
+    history_validators, page_validators
+import datetime
+import diffs
+import links
+import locks
+import metrics
+import pagination
+import search
+
+render_to_response = metrics.timed('template')(render_to_response)
 
 def page_tags(request):
     tags_string = request.GET.get('tags', None)
     if tags_string is not None:
         tag_list = parse_tag_input(tags_string)
-        page_list = TaggedItem.objects.get_union_by_model(WikiPage, tags_string)
+        # Loaded once here, counting a queryset in the template would cost
+        # another query when there are more than a chunk of pages.
+        page_list = list(TaggedItem.objects.get_union_by_model(WikiPage,
+            tags_string).only('title', 'slug'))
     else:
         page_list = None
         tag_list = None
@@ -23,17 +41,24 @@ def page_tags(request):
 
 def compare_revisions(request, page_id):
     """
-    Compare revisions from page using Python's Difflib.
+    Compare revisions from page using diff-match-patch.
 
     WikiPage is page_id, revision number to compare are from GET.  Revision numbers
     are rev1 and rev2.
 
-    Templates: ``compare_revisions.html``
+    Large comparisons that aren't cached yet are queued for the diff worker
+    and answered with ``202 Accepted`` and a page that refreshes itself until
+    the diff is ready.  AJAX requests get {"status": "pending"} or
+    {"status": "done"} instead of HTML, to poll with.
+
+    Templates: ``compare_revisions.html``, ``compare_pending.html``
     Context:
         page
             WikiPage object
         comparision
             Comparision object from page, rev1 and rev2
+        rev1, rev2
+            Revision objects, older first
     """
     page = get_object_or_404(WikiPage, pk=page_id)
     rev1 = request.GET.get('rev1', None)
@@ -41,26 +66,206 @@ def compare_revisions(request, page_id):
     if rev1 is None or rev2 is None:
         return HttpResponseBadRequest('Missing rev1 and rev2.')
     try:
-        comparison = page.compare(rev1, rev2)
+        rev1, rev2 = page.revision_pair(rev1, rev2)
     except RevisionDoesNotExist:
         raise Http404
+    except ComparingSameRevision:
+        return HttpResponseBadRequest('Cannot compare a revision to itself.')
+
+    comparison = diffs.get_or_queue_comparison(rev1, rev2)
+    if comparison is None:
+        if request.is_ajax():
+            response = HttpResponse(simplejson.dumps({'status': 'pending'}),
+                mimetype='application/json')
+        else:
+            response = render_to_response('vz_wiki/compare_pending.html',
+                {'wikipage': page, 'rev1': rev1, 'rev2': rev2},
+                context_instance=RequestContext(request))
+        response.status_code = 202
+        return response
+
+    if request.is_ajax():
+        return HttpResponse(simplejson.dumps({'status': 'done'}),
+            mimetype='application/json')
+    comparison.rev1, comparison.rev2 = rev1, rev2
     return render_to_response('vz_wiki/compare_revisions.html',
-        {'wikipage': page, 'comparison': comparison},
+        {'wikipage': page, 'comparison': comparison, 'rev1': rev1,
+        'rev2': rev2}, context_instance=RequestContext(request))
+
+compare_revisions = conditional(comparison_validators)(compare_revisions)
+
+
+def page_detail(request, slug):
+    """
+    A page's current revision.
+
+    The page, its current revision and the check-out holder come in one
+    query and the tags in another, the rendering adds a third.
+
+    Templates: ``page_detail.html``
+    Context:
+        wikipage
+            WikiPage object
+        latest_revision
+            its current Revision
+        tags_list
+            its Tags
+        checked_out_by
+            the User holding the page, if it is locked
+    """
+    page = get_object_or_404(WikiPage.objects.select_related(
+        'current_revision', 'checked_out_by'), slug=slug)
+    return render_to_response('vz_wiki/page_detail.html',
+        {'wikipage': page, 'object': page,
+        'latest_revision': page.latest_revision(),
+        'tags_list': Tag.objects.get_for_object(page),
+        'checked_out_by': page.who_checked_out()},
+        context_instance=RequestContext(request))
+
+page_detail = conditional(page_validators)(page_detail)
+
+
+def page_list(request):
+    """
+    Alphabetical index of the pages, PAGES_PER_PAGE at a time, keyset
+    paginated on the title.
+
+    Templates: ``page_list.html``
+    Context:
+        wikipage_list
+            WikiPages, with only their titles and slugs loaded
+        total
+            number of pages in the wiki
+        previous_cursor, next_cursor
+            the before and after parameters for the pages either side, or
+            None
+    """
+    after = pagination.parse_cursor(request.GET.get('after'), (unicode,))
+    before = pagination.parse_cursor(request.GET.get('before'), (unicode,))
+    pages, previous_key, next_key = pagination.keyset_page(
+        WikiPage.objects.only('title', 'slug'), ['title'], after, before,
+        pagination.PAGES_PER_PAGE)
+    return render_to_response('vz_wiki/page_list.html',
+        {'wikipage_list': pages, 'total': pagination.page_count(),
+        'previous_cursor': pagination.format_cursor(previous_key),
+        'next_cursor': pagination.format_cursor(next_key)},
         context_instance=RequestContext(request))
 
 
 def page_history(request, page_id):
     """
-    List of page history.
+    List of page history, newest first, REVISIONS_PER_PAGE at a time, keyset
+    paginated on published_on and id.
 
     Templates: ``page_history.html``
     Context:
-        page
+        wikipage
             WikiPage object
+        revision_list
+            published Revisions, without their bodies
+        previous_cursor, next_cursor
+            the before and after parameters for newer and older revisions,
+            or None
     """
     page = get_object_or_404(WikiPage, pk=page_id)
+    types = (pagination.parse_datetime, int)
+    after = pagination.parse_cursor(request.GET.get('after'), types)
+    before = pagination.parse_cursor(request.GET.get('before'), types)
+    revisions = Revision.objects.filter(page=page, is_published=True) \
+        .select_related('author').defer('content')
+    revisions, previous_key, next_key = pagination.keyset_page(revisions,
+        ['published_on', 'id'], after, before, pagination.REVISIONS_PER_PAGE,
+        descending=True)
+    for revision in revisions:
+        revision.page = page
     return render_to_response('vz_wiki/page_history.html',
-        {'wikipage': page},
+        {'wikipage': page, 'revision_list': revisions,
+        'previous_cursor': pagination.format_cursor(previous_key),
+        'next_cursor': pagination.format_cursor(next_key)},
+        context_instance=RequestContext(request))
+
+page_history = conditional(history_validators)(page_history)
+
+
+def search_pages(request):
+    """
+    Search the built-in index for the words in q.
+
+    Templates: ``search.html``
+    Context:
+        query
+            the query
+        results
+            list of (WikiPage, snippet HTML) pairs
+        total
+            number of pages found
+        page, has_next
+            page number and whether there are more
+    """
+    query = request.GET.get('q', '').strip()
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    found, total = search.search(query, (page - 1) * search.RESULTS_PER_PAGE,
+        search.RESULTS_PER_PAGE)
+    prefetch_bodies([wikipage.current_revision for wikipage, score in found
+        if wikipage.current_revision is not None])
+    results = []
+    for wikipage, score in found:
+        body = u''
+        if wikipage.current_revision is not None:
+            body = wikipage.current_revision.body
+        results.append((wikipage, search.snippet(body, query)))
+    return render_to_response('vz_wiki/search.html',
+        {'query': query, 'results': results, 'total': total, 'page': page,
+        'has_next': page * search.RESULTS_PER_PAGE < total},
+        context_instance=RequestContext(request))
+
+
+def page_backlinks(request, page_id):
+    """
+    List of pages linking to a page.
+
+    Templates: ``page_backlinks.html``
+    Context:
+        wikipage
+            WikiPage object
+        wikipage_list
+            WikiPages linking to it
+    """
+    page = get_object_or_404(WikiPage, pk=page_id)
+    return render_to_response('vz_wiki/page_backlinks.html',
+        {'wikipage': page, 'wikipage_list': links.backlinks(page)},
+        context_instance=RequestContext(request))
+
+
+def orphaned_pages(request):
+    """
+    List of pages no other page links to.
+
+    Templates: ``orphaned_pages.html``
+    Context:
+        wikipage_list
+            WikiPages nothing links to
+    """
+    return render_to_response('vz_wiki/orphaned_pages.html',
+        {'wikipage_list': links.orphans()},
+        context_instance=RequestContext(request))
+
+
+def wanted_pages(request):
+    """
+    List of pages that are linked to but don't exist yet.
+
+    Templates: ``wanted_pages.html``
+    Context:
+        wanted_list
+            dictionaries of target_slug and links, the number of pages
+            linking to it
+    """
+    return render_to_response('vz_wiki/wanted_pages.html',
+        {'wanted_list': links.wanted()},
         context_instance=RequestContext(request))
 
 
@@ -93,7 +298,8 @@ def edit_page(request, page_id):
     Creates/saves/publishes a page's revision.
 
     If page is checked out and current user isn't the "checker outer",
-    don't allow edit.  Otherwise open the WikiPage.unpublished_revision().
+    don't allow edit.  Otherwise open the WikiPage.unpublished_revision() and
+    renew the check-out lease.
 
     Templates: ``edit_page.html``
     Context:
@@ -103,19 +309,25 @@ def edit_page(request, page_id):
             RevisionForm ojbect
     """
     page = get_object_or_404(WikiPage, pk=page_id)
-    if page.is_checked_out:
+    if page.is_locked():
         if page.who_checked_out() != request.user:
             request.user.message_set.create(
                 message='This wiki page is already checked out.')
             return redirect(page)
         unpublished_revision = page.unpublished_revision()
+        locks.renew(page, request.user)
     else:
-        unpublished_revision = page.check_out(user=request.user)
+        try:
+            unpublished_revision = page.check_out(user=request.user)
+        except WikiPageAlreadyCheckedOut:
+            request.user.message_set.create(
+                message='This wiki page is already checked out.')
+            return redirect(page)
 
     if request.method == 'POST':
         form = RevisionForm(request.POST, instance=unpublished_revision)
         if form.is_valid():
-            Tag.objects.update_tags(page, form.cleaned_data['tags'])
+            update_tags(page, form.cleaned_data['tags'])
             unpublished_revision = form.save(commit=False)
             if unpublished_revision.is_published:
                 unpublished_revision.publish()
@@ -135,6 +347,15 @@ def edit_page(request, page_id):
 edit_page = permission_required('vz_wiki.wikipage.can_change')(edit_page)
 
 
+@metrics.timed('update_tags')
+def update_tags(page, tags):
+    Tag.objects.update_tags(page, tags)
+    if tags != page.tags:
+        # Keep the column in step, and the page's Last-Modified.
+        WikiPage.objects.filter(pk=page.pk).update(tags=tags,
+            edited_on=datetime.datetime.now())
+
+
 def create_page(request):
     """
     Creates a new page.
@@ -158,3 +379,19 @@ def create_page(request):
         {'form': form}, context_instance=RequestContext(request))
 
 create_page = permission_required('vz_wiki.wikipage.can_add')(create_page)
+
+
+def metrics_text(request):
+    """
+    The counters, timings and latency histograms in metrics, as plain text
+    in the Prometheus format, for staff and the INTERNAL_IPS only.
+
+    Templates: none
+    Context:
+        none
+    """
+    if not request.user.is_staff and request.META.get('REMOTE_ADDR') not in \
+        settings.INTERNAL_IPS:
+        return HttpResponseForbidden('Metrics are for staff only.')
+    return HttpResponse(metrics.render_text(),
+        mimetype='text/plain; version=0.0.4; charset=utf-8')